@@ -7,3 +7,6 @@ from django.utils.translation import ugettext as _
 class AuthAppConfig(AppConfig):
     name = 'auth_app'
     verbose_name = 'Auth App'
+
+    def ready(self):
+        from . import signals  # noqa
@@ -0,0 +1,342 @@
+"""
+ASGI application serving the token endpoints asynchronously. Python 3.5+
+only: nothing else in `auth_app` imports this module.
+
+Database access and authentication run on a small thread pool (the ORM
+and `django.contrib.auth.authenticate()` are synchronous; passwords are
+hashed on the password hashing pool), and token signing and verification
+on a separate thread pool, so that a single process keeps accepting and
+progressing requests while others wait on the database or the CPU. Every
+other request is handed to the WSGI application on the database thread
+pool.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import io
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.test.signals import setting_changed
+from rest_framework import exceptions, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_jwt.settings import api_settings
+
+from .conf import app_settings
+from .instrumentation import registry
+from .routers import reset_pinning
+from .serializers import (
+    JSONWebTokenSerializer,
+    RefreshJSONWebTokenSerializer,
+    VerifyJSONWebTokenSerializer,
+)
+from .utils.jwt import get_current_authorization_claims
+
+
+logger = logging.getLogger('django.request')
+
+
+class Executors(object):
+    """
+    The thread pools of the current process, created on first use so that
+    none are inherited across a fork.
+    """
+
+    def __init__(self):
+        self.database = concurrent.futures.ThreadPoolExecutor(app_settings.ASGI_DATABASE_WORKERS)
+        self.signing = concurrent.futures.ThreadPoolExecutor(
+            app_settings.ASGI_SIGNING_WORKERS or multiprocessing.cpu_count(),
+        )
+        self.pid = os.getpid()
+
+    def shutdown(self):
+        self.database.shutdown(wait=False)
+        self.signing.shutdown(wait=False)
+
+
+_executors = None
+_executors_lock = threading.Lock()
+
+
+def get_executors():
+    global _executors
+
+    if _executors is None or _executors.pid != os.getpid():
+        with _executors_lock:
+            if _executors is None or _executors.pid != os.getpid():
+                _executors = Executors()
+    return _executors
+
+
+def reload_executors(*args, **kwargs):
+    global _executors
+    if kwargs['setting'] == 'AUTH_APP' and _executors is not None:
+        with _executors_lock:
+            _executors.shutdown()
+            _executors = None
+
+
+setting_changed.connect(reload_executors)
+
+
+def _in_request(func, *args, **kwargs):
+    # Database threads outlive requests, so connections are recycled the
+    # way `request_started`/`request_finished` do for WSGI, and a thread
+    # pinned to the primary by a write is released.
+    close_old_connections()
+    reset_pinning()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_database(func, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        get_executors().database,
+        functools.partial(_in_request, func, *args, **kwargs),
+    )
+
+
+async def run_signing(func, *args):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executors().signing, functools.partial(func, *args))
+
+
+async def obtain_token(data):
+    serializer = JSONWebTokenSerializer()
+    attrs = serializer.to_internal_value(data)
+
+    # Through `AUTHENTICATION_BACKENDS`, holding a database thread while the
+    # backend waits for the password hashing pool.
+    user = await run_database(serializer.authenticate, attrs)
+    payload = await run_database(api_settings.JWT_PAYLOAD_HANDLER, user)
+    token = await run_signing(api_settings.JWT_ENCODE_HANDLER, payload)
+    return api_settings.JWT_RESPONSE_PAYLOAD_HANDLER(token, user, None)
+
+
+def _refresh_payload(serializer, payload):
+    user = serializer._check_user(payload=payload)
+    orig_iat = serializer._check_orig_iat(payload)
+
+    new_payload = api_settings.JWT_PAYLOAD_HANDLER(
+        user,
+        authorization_claims=get_current_authorization_claims(payload, user),
+    )
+    new_payload['orig_iat'] = orig_iat
+    return user, new_payload
+
+
+async def refresh_token(data):
+    serializer = RefreshJSONWebTokenSerializer()
+    attrs = serializer.to_internal_value(data)
+
+    payload = await run_signing(serializer._check_payload, attrs['token'])
+    user, new_payload = await run_database(_refresh_payload, serializer, payload)
+    token = await run_signing(api_settings.JWT_ENCODE_HANDLER, new_payload)
+    return api_settings.JWT_RESPONSE_PAYLOAD_HANDLER(token, user, None)
+
+
+async def verify_token(data):
+    serializer = VerifyJSONWebTokenSerializer()
+    attrs = serializer.to_internal_value(data)
+
+    payload = await run_signing(serializer._check_payload, attrs['token'])
+    user = await run_database(serializer._check_user, payload)
+    return api_settings.JWT_RESPONSE_PAYLOAD_HANDLER(attrs['token'], user, None)
+
+
+# Paths and the handlers serving POST requests to them; other methods go to
+# the WSGI application, like `OPTIONS`.
+TOKEN_ENDPOINTS = {
+    '/api/tokens/auth/': obtain_token,
+    '/api/tokens/refresh/': refresh_token,
+    '/api/tokens/verify/': verify_token,
+}
+
+
+def parse_request(scope, body):
+    """
+    Returns the data of a request body, parsed by the parsers of the DRF
+    views. Raises `ParseError` or `UnsupportedMediaType`.
+    """
+    return Request(
+        WSGIRequest(build_environ(scope, body)),
+        parsers=[parser_class() for parser_class in drf_settings.DEFAULT_PARSER_CLASSES],
+    ).data
+
+
+class TokenApplication(object):
+    """
+    ASGI 3 application answering POST requests to `TOKEN_ENDPOINTS` with
+    the same responses as the DRF views, and passing everything else to
+    `wsgi_application`.
+    """
+
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+        self.renderer = JSONRenderer()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type: %s' % scope['type'])
+
+        body = await read_body(receive)
+        handler = TOKEN_ENDPOINTS.get(scope['path'])
+        if handler is None or scope['method'] != 'POST':
+            await self.call_wsgi(scope, body, send)
+            return
+
+        started = time.time()
+        status, data, extra_headers = await self.call_handler(handler, scope, body)
+
+        if app_settings.INSTRUMENTATION_ENABLED:
+            view = 'asgi_%s' % handler.__name__
+            registry.inc('authserver_requests_total', view=view, method='POST', status=status)
+            registry.observe('authserver_request_duration_seconds', time.time() - started, view=view)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'allow', b'POST, OPTIONS'),
+                (b'vary', b'Accept'),
+            ] + extra_headers,
+        })
+        await send({'type': 'http.response.body', 'body': self.renderer.render(data)})
+
+    async def call_handler(self, handler, scope, body):
+        """
+        Returns the status, data and extra headers of the response, errors
+        rendered like the DRF views do.
+        """
+        try:
+            return 200, await handler(parse_request(scope, body)), []
+        except serializers.ValidationError as e:
+            detail = e.detail
+            if not isinstance(detail, dict):
+                detail = {drf_settings.NON_FIELD_ERRORS_KEY: detail if isinstance(detail, list) else [detail]}
+            return 400, detail, []
+        except exceptions.APIException as e:
+            headers = []
+            if getattr(e, 'wait', None):
+                headers.append((b'retry-after', b'%d' % e.wait))
+            detail = e.detail if isinstance(e.detail, (list, dict)) else {'detail': e.detail}
+            return e.status_code, detail, headers
+        except Exception:
+            logger.exception('Internal Server Error: %s', scope['path'])
+            return 500, {'detail': 'A server error occurred.'}, []
+
+    async def call_wsgi(self, scope, body, send):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            get_executors().database, self.run_wsgi, build_environ(scope, body), send, loop,
+        )
+
+    def run_wsgi(self, environ, send, loop):
+        """
+        Runs the WSGI application and sends each chunk of its response as
+        its own message as soon as it is produced, so that streaming
+        responses are not buffered. The response is iterated and closed on
+        this thread, which owns the database connections it uses.
+        """
+        async def send_on_loop(message):
+            await send(message)
+
+        def send_message(message):
+            # Waiting for the send gives the client's pace to the iteration.
+            asyncio.run_coroutine_threadsafe(send_on_loop(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        chunks = self.wsgi_application(environ, start_response)
+        try:
+            send_message({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': response['headers'],
+            })
+            for chunk in chunks:
+                if chunk:
+                    send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_message({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if _executors is not None:
+                    _executors.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            break
+    return body
+
+
+def build_environ(scope, body):
+    """
+    Returns the WSGI environ of an ASGI HTTP request.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+            continue
+        key = 'HTTP_%s' % name
+        environ[key] = '%s,%s' % (environ[key], value) if key in environ else value
+    return environ
@@ -0,0 +1,40 @@
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password
+
+from .hashers import get_hashing_pool, hash_password
+
+
+class HashingPoolModelBackend(ModelBackend):
+    """
+    `ModelBackend` checking passwords on the password hashing pool, so that
+    logins beyond its capacity fail fast with a 503 instead of queueing.
+    Passwords hashed with another hasher or cost than the preferred one are
+    re-hashed after a successful check; the new hash is saved from the
+    request thread, in the request's database connection.
+    """
+
+    def authenticate(self, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a non-existing user (#20760).
+            hash_password(password)
+        else:
+            if self.check_password(user, password) and self.user_can_authenticate(user):
+                return user
+
+    def check_password(self, user, password):
+        outdated = []
+        is_correct = get_hashing_pool().run(check_password, password, user.password, outdated.append)
+
+        if outdated:
+            user.password = hash_password(password)
+            user.save(update_fields=['password'])
+        return is_correct
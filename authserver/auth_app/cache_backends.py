@@ -0,0 +1,176 @@
+from __future__ import unicode_literals
+
+import collections
+import math
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+from django.utils.six.moves import cPickle as pickle
+
+
+class RedisCache(BaseCache):
+    """
+    A Django cache backend for Redis or any server speaking its protocol,
+    through a `redis-py` compatible client: `OPTIONS['CLIENT_CLASS']` names
+    a class with a `from_url(LOCATION)` constructor, `redis.StrictRedis` by
+    default. `auth_app.cache_backends.InProcessRedisClient` serves tests and
+    single-process development without a server.
+
+        CACHES = {
+            'authorization': {
+                'BACKEND': 'auth_app.cache_backends.RedisCache',
+                'LOCATION': 'redis://localhost:6379/0',
+            },
+        }
+    """
+
+    def __init__(self, server, params):
+        super(RedisCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        client_class = import_string(options.get('CLIENT_CLASS', 'redis.StrictRedis'))
+        self._client = client_class.from_url(server)
+
+    def get_backend_timeout(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Returns the expiry in whole seconds for the client, `None` for no
+        expiry, or 0 if the value must not be stored at all.
+        """
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return max(0, int(math.ceil(timeout)))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        timeout = self.get_backend_timeout(timeout)
+        if timeout == 0:
+            return False
+        return bool(self._client.set(key, self._dumps(value), ex=timeout, nx=True))
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        value = self._client.get(key)
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        timeout = self.get_backend_timeout(timeout)
+        if timeout == 0:
+            self._client.delete(key)
+        else:
+            self._client.set(key, self._dumps(value), ex=timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._client.delete(key)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return bool(self._client.exists(key))
+
+    def clear(self):
+        self._client.flushdb()
+
+    def get_stats(self):
+        """
+        Returns the key count and evictions reported by the server.
+        """
+        info = self._client.info()
+        return {
+            'keys': self._client.dbsize(),
+            'evictions': info.get('evicted_keys', 0),
+        }
+
+    def _dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+class InProcessRedisClient(object):
+    """
+    An in-process stand-in for the subset of the `redis-py` client used by
+    `RedisCache`. Clients created for the same URL share their data, like
+    connections to the same server. With a `max_keys` query parameter, e.g.
+    `memory://test?max_keys=100`, the least recently written keys are
+    evicted beyond that count, like a server with `maxmemory` set.
+    """
+    _databases = {}
+    _databases_lock = threading.Lock()
+
+    def __init__(self, url='memory://', max_keys=None):
+        with self._databases_lock:
+            self._database = self._databases.setdefault(url, {
+                'entries': collections.OrderedDict(),
+                'evicted_keys': 0,
+                'lock': threading.Lock(),
+            })
+        self.max_keys = max_keys
+
+    @classmethod
+    def from_url(cls, url):
+        max_keys = None
+        if '?max_keys=' in url:
+            max_keys = int(url.rsplit('?max_keys=', 1)[1])
+        return cls(url, max_keys=max_keys)
+
+    def _get_entry(self, key):
+        # Called with the lock held; drops the entry if it expired.
+        entries = self._database['entries']
+        try:
+            value, expires_at = entries[key]
+        except KeyError:
+            return None
+
+        if expires_at is not None and expires_at <= time.time():
+            del entries[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._database['lock']:
+            return self._get_entry(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._database['lock']:
+            if nx and self._get_entry(key) is not None:
+                return None
+
+            entries = self._database['entries']
+            entries.pop(key, None)
+            entries[key] = (value, time.time() + ex if ex else None)
+
+            if self.max_keys is not None:
+                while len(entries) > self.max_keys:
+                    entries.popitem(last=False)
+                    self._database['evicted_keys'] += 1
+            return True
+
+    def delete(self, *keys):
+        with self._database['lock']:
+            return sum(1 for key in keys if self._database['entries'].pop(key, None) is not None)
+
+    def exists(self, key):
+        with self._database['lock']:
+            return int(self._get_entry(key) is not None)
+
+    def dbsize(self):
+        with self._database['lock']:
+            return len(self._database['entries'])
+
+    def flushdb(self):
+        with self._database['lock']:
+            self._database['entries'].clear()
+        return True
+
+    def info(self):
+        with self._database['lock']:
+            return {'evicted_keys': self._database['evicted_keys']}
@@ -0,0 +1,361 @@
+from __future__ import unicode_literals
+
+import base64
+import collections
+import hashlib
+import json
+import threading
+import time
+
+from django.utils.functional import cached_property
+
+from .conf import app_settings
+from .models import (
+    Permission,
+    PermissionCatalogueGeneration,
+    PermissionCatalogueVersion,
+    Role,
+    RolePermissionAssociation,
+)
+
+
+# Part of the permission version, so that compact tokens whose bitset was
+# encoded differently never match a catalogue.
+BITSET_FORMAT = 'positions'
+
+
+class PermissionCatalogue(object):
+    """
+    An immutable view of all roles and permissions, identified by a version
+    derived from its content. Compact tokens reference permissions and roles
+    by ID against this catalogue instead of embedding them, and full tokens
+    are built from it and the user's role associations alone.
+
+    Compact tokens carry the catalogue's `permission_version` as their `pcv`
+    claim. It only derives from the permission IDs, which fix the bit
+    positions, so editing roles leaves it unchanged.
+
+    `generation` is the `PermissionCatalogueGeneration` the catalogue was
+    loaded at.
+    """
+
+    def __init__(self, permissions, roles, generation=None):
+        self.generation = generation
+        self.permissions = collections.OrderedDict(
+            (permission['id'], permission) for permission in permissions
+        )
+        self.roles = collections.OrderedDict(
+            (role['id'], role) for role in roles
+        )
+        self.permission_names = {
+            permission_id: permission['name']
+            for permission_id, permission in self.permissions.items()
+        }
+        # Compact tokens set the bit of a permission's position in this
+        # catalogue rather than of its ID, so that their size depends on
+        # the number of permissions only.
+        self.permission_ids = list(self.permissions)
+        self.permission_positions = {
+            permission_id: position
+            for position, permission_id in enumerate(self.permission_ids)
+        }
+
+        fingerprint = json.dumps(
+            [
+                [(p['id'], p['name']) for p in self.permissions.values()],
+                [(r['id'], r['permissions']) for r in self.roles.values()],
+            ],
+            separators=(',', ':'),
+        )
+        self.version = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]
+
+        fingerprint = json.dumps([BITSET_FORMAT, self.permission_ids], separators=(',', ':'))
+        self.permission_version = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]
+
+    @classmethod
+    def load(cls):
+        # Read first, so that changes made while loading make the catalogue
+        # stale rather than going unnoticed.
+        generation = PermissionCatalogueGeneration.objects.current()
+
+        permissions = list(
+            Permission.objects.order_by('id').values('id', 'name', 'description')
+        )
+        roles = list(
+            Role.objects.order_by('id').values('id', 'name', 'description')
+        )
+
+        role_permissions = collections.defaultdict(list)
+        for role_id, permission_id in RolePermissionAssociation.objects.order_by(
+            'role_id', 'permission_id',
+        ).values_list('role_id', 'permission_id'):
+            role_permissions[role_id].append(permission_id)
+
+        for role in roles:
+            role['permissions'] = role_permissions[role['id']]
+
+        return cls(permissions, roles, generation)
+
+    def as_dict(self):
+        return {
+            'version': self.version,
+            'permission_version': self.permission_version,
+            'permissions': list(self.permissions.values()),
+            'roles': list(self.roles.values()),
+        }
+
+    @cached_property
+    def permission_representations(self):
+        """
+        Maps permission IDs to their `PermissionSerializer` representation.
+        """
+        from .serializers import permission_row_serializer
+
+        return {
+            permission_id: permission_row_serializer.to_representation(permission)
+            for permission_id, permission in self.permissions.items()
+        }
+
+    @cached_property
+    def role_representations(self):
+        """
+        Maps role IDs to their `RoleSerializer` representation.
+        """
+        from .serializers import role_row_serializer
+
+        return {
+            role_id: role_row_serializer.to_representation(dict(
+                role,
+                permissions=[
+                    self.permission_representations[permission_id]
+                    for permission_id in role['permissions']
+                ],
+            ))
+            for role_id, role in self.roles.items()
+        }
+
+    def encode_permissions(self, permission_ids):
+        """
+        Returns the bitset of the given permissions. IDs unknown to this
+        catalogue (deleted permissions) are left out.
+        """
+        positions = self.permission_positions
+        return encode_bitset(
+            positions[permission_id]
+            for permission_id in permission_ids
+            if permission_id in positions
+        )
+
+
+def encode_bitset(ids):
+    """
+    Encodes a set of non-negative integers as an unpadded base64url string of
+    the big-endian integer whose bit `n` is set for every `n` in `ids`.
+    """
+    ids = list(ids)
+    if not ids:
+        return ''
+
+    raw = bytearray(max(ids) // 8 + 1)
+    last = len(raw) - 1
+    for n in ids:
+        raw[last - n // 8] |= 1 << (n % 8)
+    return base64.urlsafe_b64encode(bytes(raw)).rstrip(b'=').decode('ascii')
+
+
+def decode_bitset(encoded, limit=None):
+    """
+    Returns the sorted integers set in a bitset of `encode_bitset`, only
+    those below `limit` if given. Takes time linear in the bitset's length.
+    """
+    padding = '=' * (-len(encoded) % 4)
+    raw = bytearray(base64.urlsafe_b64decode((encoded + padding).encode('ascii')))
+
+    ids = []
+    for offset, byte in enumerate(reversed(raw)):
+        base = offset * 8
+        if limit is not None and base >= limit:
+            break
+        while byte:
+            low = byte & -byte
+            ids.append(base + low.bit_length() - 1)
+            byte ^= low
+
+    if limit is not None:
+        ids = [n for n in ids if n < limit]
+    return ids
+
+
+class UnknownCatalogueVersion(Exception):
+    """
+    Raised for a compact token whose `pcv` was never recorded, e.g. one
+    issued before its catalogue versions were, whose bitsets cannot be read.
+    """
+
+
+# Permission IDs by position of the catalogue versions this process used
+# recently, to decode tokens issued against a previous version without a
+# query. Older versions are read from `PermissionCatalogueVersion`.
+_permission_ids_by_version = collections.OrderedDict()
+MAX_REMEMBERED_VERSIONS = 16
+
+
+def remember_catalogue_version(version, permission_ids):
+    _permission_ids_by_version.pop(version, None)
+    _permission_ids_by_version[version] = permission_ids
+    while len(_permission_ids_by_version) > MAX_REMEMBERED_VERSIONS:
+        _permission_ids_by_version.popitem(last=False)
+
+
+def get_permission_ids(version):
+    """
+    Returns the permission IDs by bit position of the catalogue
+    `permission_version` given, raising `UnknownCatalogueVersion` if it was
+    never recorded.
+    """
+    catalogue = _catalogue
+    if catalogue is not None and catalogue.permission_version == version:
+        return catalogue.permission_ids
+
+    try:
+        return _permission_ids_by_version[version]
+    except KeyError:
+        pass
+
+    permission_ids = PermissionCatalogueVersion.objects.get_permission_ids(version)
+    if permission_ids is None:
+        raise UnknownCatalogueVersion(version)
+
+    remember_catalogue_version(version, permission_ids)
+    return permission_ids
+
+
+_catalogue = None
+_generation_checked_at = 0
+_catalogue_lock = threading.Lock()
+
+
+def get_catalogue(check_generation=False):
+    """
+    Returns the process-local catalogue, loading it on first use.
+
+    The catalogue is reloaded once the `PermissionCatalogueGeneration` has
+    moved on, which is checked with a single query at most every
+    `CATALOGUE_GENERATION_CHECK_INTERVAL` seconds, or right away with
+    `check_generation`. Every catalogue loaded records its permission
+    version, before any token is encoded against it.
+    """
+    global _catalogue, _generation_checked_at
+
+    catalogue = _catalogue
+    now = time.time()
+    stale = False
+    if catalogue is not None and (
+        check_generation or
+        now - _generation_checked_at >= app_settings.CATALOGUE_GENERATION_CHECK_INTERVAL
+    ):
+        _generation_checked_at = now
+        stale = PermissionCatalogueGeneration.objects.current() != catalogue.generation
+
+    if not stale and catalogue is not None:
+        return catalogue
+
+    with _catalogue_lock:
+        catalogue = _catalogue
+        if stale or catalogue is None:
+            catalogue = PermissionCatalogue.load()
+            PermissionCatalogueVersion.objects.record(
+                catalogue.permission_version,
+                catalogue.permission_ids,
+            )
+            remember_catalogue_version(catalogue.permission_version, catalogue.permission_ids)
+            _catalogue = catalogue
+            _generation_checked_at = now
+
+    return catalogue
+
+
+def invalidate_catalogue():
+    global _catalogue
+    _catalogue = None
+
+
+def encode_compact_authorization(authorization_data):
+    """
+    Returns the compact token claims for the given authorization data: the
+    permission version of the catalogue, the bitset of all permissions, and
+    the organizations with their roles referenced by ID and the bitset of
+    the permissions those roles grant there.
+    """
+    permission_ids = [permission['id'] for permission in authorization_data['permissions']]
+
+    catalogue = get_catalogue()
+    if any(permission_id not in catalogue.permissions for permission_id in permission_ids):
+        # A permission created since the last generation check.
+        catalogue = get_catalogue(check_generation=True)
+
+    return {
+        'pcv': catalogue.permission_version,
+        'perms': catalogue.encode_permissions(permission_ids),
+        'orgs': [
+            {
+                'id': organization['id'],
+                'parent_id': organization['parent_id'],
+                'roles': [role['id'] for role in organization['roles']],
+                'perms': catalogue.encode_permissions(
+                    permission['id']
+                    for role in organization['roles']
+                    for permission in role['permissions']
+                ),
+            }
+            for organization in authorization_data['organizations']
+        ],
+    }
+
+
+def decode_permission_names(encoded, version):
+    """
+    Returns the names of the permissions set in the bitset `encoded` of the
+    catalogue `version`. Permissions deleted since are left out; the names
+    of the others are the current ones.
+    """
+    permission_ids = get_permission_ids(version)
+    permission_ids = [
+        permission_ids[position]
+        for position in decode_bitset(encoded, limit=len(permission_ids))
+    ]
+
+    catalogue = get_catalogue()
+    if any(permission_id not in catalogue.permission_names for permission_id in permission_ids):
+        # A permission created since the last generation check, or deleted.
+        catalogue = get_catalogue(check_generation=True)
+
+    names = catalogue.permission_names
+    return frozenset(
+        names[permission_id]
+        for permission_id in permission_ids
+        if permission_id in names
+    )
+
+
+def decode_compact_permissions(payload):
+    """
+    Returns the names of the permissions granted by a compact payload.
+    Raises `KeyError` if the payload carries no permission bitset, and
+    `UnknownCatalogueVersion` if it cannot be decoded.
+    """
+    return decode_permission_names(payload['perms'], payload['pcv'])
+
+
+def decode_compact_organization_permissions(payload):
+    """
+    Returns a dict mapping the organization IDs of a compact payload to the
+    names of the permissions its roles granted there when it was issued.
+    Raises `KeyError` and `UnknownCatalogueVersion` like
+    `decode_compact_permissions`.
+    """
+    version = payload['pcv']
+    return {
+        organization['id']: decode_permission_names(organization['perms'], version)
+        for organization in payload['orgs']
+    }
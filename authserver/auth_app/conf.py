@@ -0,0 +1,71 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.test.signals import setting_changed
+
+
+DEFAULTS = {
+    'TOKEN_FORMAT': 'full',
+    'CATALOGUE_GENERATION_CHECK_INTERVAL': 1,
+    'ORGANIZATION_INDEX_CHECK_INTERVAL': 1,
+    'SIGNING_KEYS': [],
+    'SIGNING_KEY_ID': None,
+    'JWKS_MAX_AGE': 86400,
+    'BATCH_VERIFY_MAX_TOKENS': 100,
+    'BATCH_PERMISSION_CHECK_MAX_CHECKS': 1000,
+    'INSTRUMENTATION_ENABLED': False,
+    'INSTRUMENTATION_LOG': False,
+    'METRICS_TOKEN': None,
+    'TOKEN_CACHE_MAX_SIZE': 10000,
+    'TOKEN_CACHE_TTL': 300,
+    'CACHE_ALIAS': None,
+    'CACHE_TIMEOUT': 300,
+    'CACHE_LOCK_TIMEOUT': 5,
+    'PASSWORD_HASH_ITERATIONS': 30000,
+    'PASSWORD_HASHING_WORKERS': None,
+    'PASSWORD_HASHING_MAX_PENDING': 16,
+    'PASSWORD_HASHING_TIMEOUT': 10,
+    'READ_REPLICAS': [],
+    'REPLICA_PIN_SECONDS': 15,
+    'REVOCATION_REFRESH_INTERVAL': 5,
+    'REVOCATION_BLOOM_MIN_CAPACITY': 10000,
+    'REVOCATION_BLOOM_ERROR_RATE': 0.001,
+    'ASGI_DATABASE_WORKERS': 8,
+    'ASGI_SIGNING_WORKERS': None,
+}
+
+
+class AppSettings(object):
+    """
+    Settings of `auth_app`, read from the `AUTH_APP` dict of the project
+    settings and falling back to `DEFAULTS`.
+    """
+
+    def __init__(self, defaults):
+        self.defaults = defaults
+
+    def __getattr__(self, attr):
+        if attr not in self.defaults:
+            raise AttributeError("Invalid auth_app setting: '%s'" % attr)
+
+        user_settings = getattr(settings, 'AUTH_APP', {})
+        val = user_settings.get(attr, self.defaults[attr])
+
+        # Cache the result
+        setattr(self, attr, val)
+        return val
+
+    def reload(self):
+        for attr in self.defaults:
+            self.__dict__.pop(attr, None)
+
+
+app_settings = AppSettings(DEFAULTS)
+
+
+def reload_app_settings(*args, **kwargs):
+    if kwargs['setting'] == 'AUTH_APP':
+        app_settings.reload()
+
+
+setting_changed.connect(reload_app_settings)
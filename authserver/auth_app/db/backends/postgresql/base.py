@@ -0,0 +1,14 @@
+"""
+PostgreSQL backend with pooled connections, configured like
+`auth_app.db.backends.sqlite3` through a `POOL` dict of the `DATABASES`
+entry. Requires psycopg2.
+"""
+from __future__ import unicode_literals
+
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgreSQLDatabaseWrapper
+
+from auth_app.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, PostgreSQLDatabaseWrapper):
+    pass
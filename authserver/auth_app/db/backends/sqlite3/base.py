@@ -0,0 +1,67 @@
+"""
+SQLite backend with pooled connections, WAL journaling and tuned pragmas:
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'auth_app.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'POOL': {'MAX_SIZE': 10, 'IDLE_TIMEOUT': 300},
+            'PRAGMAS': {'cache_size': -64000},
+        },
+    }
+
+`PRAGMAS` are merged into `DEFAULT_PRAGMAS`; a `None` value drops one.
+With `READ_ONLY`, connections refuse writes (`query_only`), for an alias
+only serving reads from the same file. In-memory databases, such as the
+test database, are never pooled.
+"""
+from __future__ import unicode_literals
+
+import collections
+
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+
+from auth_app.db.pool import PooledDatabaseWrapperMixin
+
+
+DEFAULT_PRAGMAS = collections.OrderedDict([
+    # Readers no longer block the writer nor each other, and commits only
+    # append to the log.
+    ('journal_mode', 'wal'),
+    # Safe with WAL: a power loss may only roll back the last commits.
+    ('synchronous', 'normal'),
+    # Milliseconds to wait for a lock instead of failing straight away.
+    ('busy_timeout', 5000),
+    # Page cache per connection, in KiB when negative.
+    ('cache_size', -16000),
+    ('temp_store', 'memory'),
+    ('mmap_size', 128 * 1024 * 1024),
+])
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, SQLiteDatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        if self.is_in_memory_db(self.settings_dict['NAME']):
+            return SQLiteDatabaseWrapper.get_new_connection(self, conn_params)
+        return super(DatabaseWrapper, self).get_new_connection(conn_params)
+
+    def create_connection(self, conn_params):
+        connection = super(DatabaseWrapper, self).create_connection(conn_params)
+
+        # Pragmas hold for the lifetime of the connection, so they are only
+        # set once per pooled connection.
+        cursor = connection.cursor()
+        try:
+            for name, value in self.get_pragmas():
+                cursor.execute('PRAGMA %s = %s' % (name, value))
+        finally:
+            cursor.close()
+        return connection
+
+    def get_pragmas(self):
+        pragmas = DEFAULT_PRAGMAS.copy()
+        pragmas.update(self.settings_dict.get('PRAGMAS', {}))
+        if self.settings_dict.get('READ_ONLY'):
+            pragmas['query_only'] = 'on'
+        return [(name, value) for name, value in pragmas.items() if value is not None]
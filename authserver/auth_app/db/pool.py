@@ -0,0 +1,200 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+
+POOL_DEFAULTS = {
+    # Most connections open at once, in use or idle.
+    'MAX_SIZE': 10,
+    # Seconds an idle connection is kept before being closed.
+    'IDLE_TIMEOUT': 300,
+    # Connections idle for longer than this many seconds are pinged before
+    # being handed out again.
+    'HEALTH_CHECK_INTERVAL': 30,
+    # Seconds to wait for a connection when MAX_SIZE are in use.
+    'TIMEOUT': 10,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of DB-API connections. Connections are handed out
+    most recently used first, so that the surplus of a traffic spike goes
+    idle and is closed after `idle_timeout` seconds; connections idle for
+    more than `health_check_interval` seconds are pinged before reuse and
+    replaced if that fails.
+    """
+
+    def __init__(self, max_size, idle_timeout, health_check_interval, timeout):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.size = 0
+        self._idle = []
+        self._condition = threading.Condition(threading.Lock())
+
+    def acquire(self, connect):
+        """
+        Returns an idle connection, or a new one from `connect()` if fewer
+        than `max_size` are open. Otherwise waits up to `timeout` seconds
+        for one to be released, then raises `PoolTimeout`.
+        """
+        deadline = time.time() + self.timeout
+        while True:
+            connection = None
+            with self._condition:
+                while self._idle:
+                    connection, released_at = self._idle.pop()
+                    idle = time.time() - released_at
+                    if idle <= self.idle_timeout:
+                        break
+                    self._discard(connection)
+                    connection = None
+                else:
+                    if self.size < self.max_size:
+                        self.size += 1
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise PoolTimeout('No database connection available after %ss.' % self.timeout)
+                        self._condition.wait(remaining)
+                        continue
+
+            if connection is None:
+                try:
+                    return connect()
+                except Exception:
+                    with self._condition:
+                        self.size -= 1
+                        self._condition.notify()
+                    raise
+
+            if idle <= self.health_check_interval or self.is_usable(connection):
+                return connection
+
+            with self._condition:
+                self._discard(connection)
+
+    def release(self, connection, check=False):
+        """
+        Returns `connection` to the pool, after pinging it if `check` is
+        true, e.g. because an error occurred while it was in use.
+        """
+        usable = not check or self.is_usable(connection)
+        with self._condition:
+            if usable:
+                self._idle.append((connection, time.time()))
+                self._condition.notify()
+            else:
+                self._discard(connection)
+
+    def discard(self, connection):
+        with self._condition:
+            self._discard(connection)
+
+    def _discard(self, connection):
+        # Called with the lock held.
+        self.size -= 1
+        self._condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._condition:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def is_usable(self, connection):
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(settings_dict):
+    """
+    Returns the pool of the process for a `DATABASES` entry, configured by
+    its `POOL` dict. Pools inherited across a fork are left alone: their
+    connections belong to the parent process.
+    """
+    key = (os.getpid(), settings_dict['ENGINE'], settings_dict['NAME'], settings_dict.get('HOST'),
+           settings_dict.get('PORT'), settings_dict.get('USER'))
+    try:
+        return _pools[key]
+    except KeyError:
+        pass
+
+    with _pools_lock:
+        if key not in _pools:
+            options = dict(POOL_DEFAULTS, **settings_dict.get('POOL', {}))
+            _pools[key] = ConnectionPool(
+                options['MAX_SIZE'],
+                options['IDLE_TIMEOUT'],
+                options['HEALTH_CHECK_INTERVAL'],
+                options['TIMEOUT'],
+            )
+        return _pools[key]
+
+
+def close_pools():
+    """
+    Closes the idle connections of the pools of this process.
+    """
+    pid = os.getpid()
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == pid]:
+            _pools.pop(key).close()
+
+
+class PooledDatabaseWrapperMixin(object):
+    """
+    Mixin for a `DatabaseWrapper` taking connections from the pool of its
+    `DATABASES` entry instead of opening them, and releasing them to it
+    instead of closing them. Use with `CONN_MAX_AGE = 0`: every request
+    still checks a connection out and in, but no longer pays to open it.
+    """
+
+    def get_new_connection(self, conn_params):
+        try:
+            return get_pool(self.settings_dict).acquire(lambda: self.create_connection(conn_params))
+        except PoolTimeout as e:
+            raise self.Database.OperationalError(*e.args)
+
+    def create_connection(self, conn_params):
+        """
+        Opens a connection for the pool.
+        """
+        return super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params)
+
+    def _close(self):
+        if self.connection is None:
+            return
+
+        pool = get_pool(self.settings_dict)
+        with self.wrap_database_errors:
+            try:
+                # Never hand out a connection in the middle of a transaction,
+                # e.g. one closed inside an atomic block.
+                self.connection.rollback()
+            except Exception:
+                pool.discard(self.connection)
+                raise
+            pool.release(self.connection, check=self.errors_occurred)
@@ -0,0 +1,154 @@
+from __future__ import unicode_literals
+
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.test.signals import setting_changed
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .conf import app_settings
+from .instrumentation import count, timer
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    `pbkdf2_sha256` with the iteration count of
+    `AUTH_APP['PASSWORD_HASH_ITERATIONS']`. Existing hashes with another
+    count still verify and are re-encoded on the next successful login, so
+    the cost can be tuned either way without resetting passwords.
+    """
+
+    @property
+    def iterations(self):
+        return app_settings.PASSWORD_HASH_ITERATIONS
+
+
+class PasswordHashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many logins in progress, try again shortly.')
+    default_code = 'password_hashing_unavailable'
+
+    # Sent as the Retry-After header by the DRF exception handler.
+    wait = 1
+
+
+class PasswordHashingPool(object):
+    """
+    Runs password hashing on a fixed number of threads (PBKDF2 releases
+    the GIL while it runs) and admits at most `max_pending` more jobs
+    waiting for one. Beyond that, or when a job does not finish within
+    `timeout` seconds, `PasswordHashingUnavailable` is raised straight away
+    instead of letting requests pile up behind the CPU.
+    """
+
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # Threads do not survive a fork, so a pool created before the
+        # server forked its workers is replaced.
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pool = multiprocessing.pool.ThreadPool(self.workers)
+                    self._pid = pid
+        return self._pool
+
+    def submit(self, func, args=(), callback=None):
+        """
+        Queues `func(*args)` and returns its `AsyncResult`; `callback` is
+        called from the worker thread with `(result, exception)` once it
+        completes. Raises `PasswordHashingUnavailable` if the pool is full.
+        """
+        if not self._slots.acquire(False):
+            count('authserver_password_hashing_total', result='rejected')
+            raise PasswordHashingUnavailable()
+
+        def job():
+            # The slot is held until the job finishes, even if the caller
+            # stopped waiting for it.
+            try:
+                result = func(*args)
+            except Exception as e:
+                self._slots.release()
+                if callback is not None:
+                    callback(None, e)
+                raise
+            self._slots.release()
+            if callback is not None:
+                callback(result, None)
+            return result
+
+        try:
+            return self._get_pool().apply_async(job)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def run(self, func, *args):
+        result = self.submit(func, args)
+
+        with timer('password_hashing'):
+            try:
+                value = result.get(self.timeout)
+            except multiprocessing.TimeoutError:
+                count('authserver_password_hashing_total', result='timeout')
+                raise PasswordHashingUnavailable()
+
+        count('authserver_password_hashing_total', result='completed')
+        return value
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.close()
+            self._pool = self._pid = None
+
+
+def hash_password(password):
+    """
+    `make_password()` on the hashing pool.
+    """
+    return get_hashing_pool().run(make_password, password)
+
+
+_hashing_pool = None
+_hashing_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    global _hashing_pool
+
+    if _hashing_pool is None:
+        with _hashing_pool_lock:
+            if _hashing_pool is None:
+                _hashing_pool = PasswordHashingPool(
+                    app_settings.PASSWORD_HASHING_WORKERS or multiprocessing.cpu_count(),
+                    app_settings.PASSWORD_HASHING_MAX_PENDING,
+                    app_settings.PASSWORD_HASHING_TIMEOUT,
+                )
+    return _hashing_pool
+
+
+def reload_hashing_pool(*args, **kwargs):
+    global _hashing_pool
+    if kwargs['setting'] == 'AUTH_APP':
+        with _hashing_pool_lock:
+            if _hashing_pool is not None:
+                _hashing_pool.close()
+            _hashing_pool = None
+
+
+setting_changed.connect(reload_hashing_pool)
@@ -0,0 +1,173 @@
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+from .conf import app_settings
+from .models import Organization, OrganizationTreeGeneration
+
+
+class OrganizationIndex(object):
+    """
+    A process-local ancestor/descendant index over the `Organization.parent`
+    tree. It is loaded with a single query, kept up to date incrementally by
+    the `Organization` signal handlers of this process, and fully reloaded
+    once the `OrganizationTreeGeneration` has moved on, which is checked at
+    most every `ORGANIZATION_INDEX_CHECK_INTERVAL` seconds, to pick up changes
+    made by other processes.
+    """
+
+    def __init__(self):
+        self._parents = None
+        self._children = None
+        self._ancestors = {}
+        self._descendants = {}
+        self._generation = None
+        self._checked_at = 0
+        self._lock = threading.RLock()
+
+    def load(self):
+        # Read first, so that changes committed while loading trigger a reload.
+        generation = OrganizationTreeGeneration.objects.current()
+        parents = dict(Organization.objects.values_list('id', 'parent_id'))
+
+        children = collections.defaultdict(set)
+        for organization_id, parent_id in parents.items():
+            if parent_id is not None:
+                children[parent_id].add(organization_id)
+
+        with self._lock:
+            self._parents = parents
+            self._children = children
+            self._ancestors = {}
+            self._descendants = {}
+            self._generation = generation
+            self._checked_at = time.time()
+
+    def invalidate(self):
+        """
+        Makes the next lookup reload the index.
+        """
+        with self._lock:
+            self._generation = None
+            self._checked_at = 0
+
+    def _ensure_loaded(self):
+        if self._parents is None:
+            self.load()
+            return
+
+        now = time.time()
+        if now - self._checked_at < app_settings.ORGANIZATION_INDEX_CHECK_INTERVAL:
+            return
+
+        self._checked_at = now
+        if OrganizationTreeGeneration.objects.current() != self._generation:
+            self.load()
+
+    def ancestors(self, organization_id):
+        """
+        Returns a tuple of `organization_id` followed by its ancestors, from
+        the closest to the root.
+        """
+        self._ensure_loaded()
+
+        try:
+            return self._ancestors[organization_id]
+        except KeyError:
+            pass
+
+        with self._lock:
+            chain = []
+            current = organization_id
+            # Guard against cycles left behind by inconsistent data.
+            while current is not None and current not in chain:
+                chain.append(current)
+                current = self._parents.get(current)
+
+            ancestors = self._ancestors[organization_id] = tuple(chain)
+            return ancestors
+
+    def descendants(self, organization_id):
+        """
+        Returns a frozenset of `organization_id` and all organizations below it.
+        """
+        self._ensure_loaded()
+
+        try:
+            return self._descendants[organization_id]
+        except KeyError:
+            pass
+
+        with self._lock:
+            found = set()
+            pending = [organization_id]
+            while pending:
+                current = pending.pop()
+                if current not in found:
+                    found.add(current)
+                    pending.extend(self._children.get(current, ()))
+
+            descendants = self._descendants[organization_id] = frozenset(found)
+            return descendants
+
+    def update(self, organization_id, parent_id):
+        """
+        Records that `organization_id` now has `parent_id` as its parent,
+        discarding only the memoized chains affected by the change.
+        """
+        with self._lock:
+            if self._parents is None:
+                return
+
+            old_parent_id = self._parents.get(organization_id)
+            is_new = organization_id not in self._parents
+            if not is_new and old_parent_id == parent_id:
+                return
+
+            self._discard_memoized(organization_id, old_parent_id)
+
+            if old_parent_id is not None:
+                self._children[old_parent_id].discard(organization_id)
+            if parent_id is not None:
+                self._children[parent_id].add(organization_id)
+            self._parents[organization_id] = parent_id
+
+            self._discard_memoized(organization_id, parent_id)
+
+    def remove(self, organization_id):
+        with self._lock:
+            if self._parents is None or organization_id not in self._parents:
+                return
+
+            parent_id = self._parents.pop(organization_id)
+            self._discard_memoized(organization_id, parent_id)
+            if parent_id is not None:
+                self._children[parent_id].discard(organization_id)
+            self._children.pop(organization_id, None)
+
+    def _discard_memoized(self, organization_id, parent_id):
+        # The ancestor chains of the moved subtree and the descendant sets
+        # of the ancestors on either side of the move are affected.
+        for descendant_id in self.descendants(organization_id):
+            self._ancestors.pop(descendant_id, None)
+        if parent_id is not None:
+            for ancestor_id in self.ancestors(parent_id):
+                self._descendants.pop(ancestor_id, None)
+        self._descendants.pop(organization_id, None)
+
+
+organization_index = OrganizationIndex()
+
+
+def has_organization_permission(organization_permissions, organization_id, permission_name):
+    """
+    Returns `True` if `permission_name` is granted in `organization_id`, either
+    directly or through a role held in one of its ancestor organizations.
+    `organization_permissions` maps organization IDs to permission names.
+    """
+    for ancestor_id in organization_index.ancestors(organization_id):
+        if permission_name in organization_permissions.get(ancestor_id, ()):
+            return True
+    return False
@@ -0,0 +1,194 @@
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+from .conf import app_settings
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry(object):
+    """
+    A thread-safe, process-local store of counters, gauges and histograms,
+    rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = collections.OrderedDict()
+        self._gauges = collections.OrderedDict()
+        self._histograms = collections.OrderedDict()
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            try:
+                histogram = self._histograms[key]
+            except KeyError:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0.0]
+
+            bucket_counts = histogram[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+            histograms = [
+                (key, (list(bucket_counts), count, total))
+                for key, (bucket_counts, count, total) in self._histograms.items()
+            ]
+
+        lines = []
+        described = set()
+
+        def header(name, metric_type):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append('# HELP %s %s' % (name, self._help[name]))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+
+        for (name, labels), value in sorted(counters):
+            header(name, 'counter')
+            lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+
+        for (name, labels), value in sorted(gauges):
+            header(name, 'gauge')
+            lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+
+        for (name, labels), (bucket_counts, count, total) in sorted(histograms):
+            header(name, 'histogram')
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append('%s_bucket%s %d' % (
+                    name, format_labels(labels + (('le', format_value(bound)),)), bucket_count,
+                ))
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), count))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(total)))
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return '%s' % value
+
+
+registry = MetricsRegistry()
+registry.describe('authserver_requests_total', 'Requests handled, by view, method and status.')
+registry.describe('authserver_request_duration_seconds', 'Total request latency, by view.')
+registry.describe('authserver_db_queries_total', 'Database queries executed, by view.')
+registry.describe('authserver_db_query_seconds_total', 'Time spent in database queries, by view.')
+registry.describe('authserver_operation_duration_seconds', 'Duration of instrumented operations.')
+registry.describe('authserver_token_cache_total', 'Verified token cache lookups, by result.')
+registry.describe('authserver_cache_evictions_total', 'Entries evicted from process-local caches, by cache.')
+registry.describe('authserver_shared_cache_total', 'Shared cache lookups, by cache and result.')
+registry.describe('authserver_shared_cache_evictions', 'Evictions reported by the shared cache server.')
+registry.describe('authserver_password_hashing_total', 'Password hashing jobs, by result.')
+registry.describe('authserver_revocation_checks_total', 'Token revocation checks, by result.')
+registry.describe('authserver_revocation_bloom_total', 'Revoked token IDs possibly in the Bloom filter, by result.')
+
+_local = threading.local()
+
+
+def is_enabled():
+    return app_settings.INSTRUMENTATION_ENABLED
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.time() - self.started
+        registry.observe('authserver_operation_duration_seconds', elapsed, operation=self.operation)
+
+        phases = getattr(_local, 'phases', None)
+        if phases is not None:
+            phases[self.operation] += elapsed
+        return False
+
+
+def timer(operation):
+    """
+    Returns a context manager recording the duration of `operation`, both
+    as a histogram and in the totals of the current request. When
+    instrumentation is disabled, a shared no-op context manager is returned.
+    """
+    if not app_settings.INSTRUMENTATION_ENABLED:
+        return NULL_TIMER
+    return _Timer(operation)
+
+
+def count(name, amount=1, **labels):
+    if app_settings.INSTRUMENTATION_ENABLED:
+        registry.inc(name, amount, **labels)
+
+
+def start_request():
+    _local.phases = collections.defaultdict(float)
+
+
+def finish_request():
+    """
+    Returns the per-operation durations recorded since `start_request()`.
+    """
+    phases = getattr(_local, 'phases', None) or {}
+    _local.phases = None
+    return phases
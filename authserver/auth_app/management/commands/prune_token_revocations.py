@@ -0,0 +1,17 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from auth_app.models import RevokedToken, TokenEpoch
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes the revoked token IDs and user token epochs whose tokens '
+        'have all expired. Run periodically, e.g. hourly from cron.'
+    )
+
+    def handle(self, *args, **options):
+        tokens = RevokedToken.objects.prune()
+        epochs = TokenEpoch.objects.prune()
+        self.stdout.write('Deleted %d revoked tokens and %d token epochs.' % (tokens, epochs))
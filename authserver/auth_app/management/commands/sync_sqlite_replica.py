@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        'Copies the schema and rows of an SQLite database into the SQLite '
+        'file of a replica alias in one transaction, to exercise read '
+        'replica routing locally. With --interval, keeps copying, which '
+        'simulates replication lag.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('replica', help='DATABASES alias of the replica.')
+        parser.add_argument('--source', default=DEFAULT_DB_ALIAS, help='DATABASES alias of the primary.')
+        parser.add_argument('--interval', type=float, help='Seconds between copies; copy once if omitted.')
+
+    def handle(self, *args, **options):
+        source = self.get_database_file(options['source'])
+        replica = self.get_database_file(options['replica'])
+        if source == replica:
+            raise CommandError('The primary and the replica are the same file.')
+
+        while True:
+            started = time.time()
+            tables = sync_database(source, replica)
+            self.stdout.write('Copied %d tables to %s in %.3fs.' % (tables, replica, time.time() - started))
+
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def get_database_file(self, alias):
+        try:
+            settings_dict = settings.DATABASES[alias]
+        except KeyError:
+            raise CommandError('Unknown database alias: %s' % alias)
+
+        if not settings_dict['ENGINE'].endswith('sqlite3'):
+            raise CommandError('%s is not an SQLite database.' % alias)
+        return settings_dict['NAME']
+
+
+def sync_database(source, replica):
+    """
+    Replaces the schema and rows of the `replica` file with those of
+    `source` in a single transaction, so readers of the replica see either
+    the previous or the new copy. Returns the number of tables copied.
+    """
+    connection = sqlite3.connect(replica, isolation_level=None)
+    try:
+        connection.execute('PRAGMA busy_timeout = 5000')
+        connection.execute('ATTACH DATABASE ? AS source', [source])
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            existing = connection.execute(
+                "SELECT type, name FROM main.sqlite_master "
+                "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+            for object_type, name in existing:
+                connection.execute('DROP %s "%s"' % (object_type.upper(), name))
+
+            # Tables first, then the indexes, triggers and views on them.
+            schema = connection.execute(
+                "SELECT type, name, sql FROM source.sqlite_master "
+                "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END, rowid"
+            ).fetchall()
+            tables = [name for object_type, name, sql in schema if object_type == 'table']
+
+            for object_type, name, sql in schema:
+                connection.execute(sql)
+            for name in tables:
+                connection.execute('INSERT INTO main."%s" SELECT * FROM source."%s"' % (name, name))
+
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+    finally:
+        connection.close()
+
+    return len(tables)
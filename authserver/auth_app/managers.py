@@ -1,6 +1,12 @@
 from __future__ import unicode_literals
 
+import json
+
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, models, transaction
+from django.utils import timezone
+
+from .routers import get_read_database
 
 
 class UserManager(BaseUserManager):
@@ -31,3 +37,280 @@ class UserManager(BaseUserManager):
             raise ValueError('Superuser must have is_superuser=True.')
 
         return self._create_user(email, password, **extra_fields)
+
+    def bump_authorization_version(self, **filters):
+        """
+        Increments the authorization version of the users matching `filters`,
+        marking their authorization snapshots and the authorization claims
+        of their tokens as stale.
+        """
+        self.filter(**filters).update(authorization_version=models.F('authorization_version') + 1)
+
+
+class AuthorizationSnapshotManager(models.Manager):
+
+    def get_data_for_user(self, user):
+        """
+        Returns the authorization data of the given user and the authorization
+        version it reflects, with a single lookup if the user's snapshot is
+        current, building and storing it first otherwise.
+
+        The version is read before the data is built, so a snapshot built
+        while the user's roles change is stored with the version preceding
+        the change and gets rebuilt on the next lookup.
+
+        Reads go to a read replica if configured, unless it lags behind the
+        primary `user` was loaded from: then the data is read and built from
+        the primary. Snapshots are written to the primary explicitly: they
+        are derived data, so storing one does not pin the request to the
+        primary.
+        """
+        database = get_read_database()
+        row = self._get_snapshot_row(user, database)
+        if database != DEFAULT_DB_ALIAS and (row is None or row[0] < user.authorization_version):
+            # The replica misses the user's latest changes.
+            database = DEFAULT_DB_ALIAS
+            row = self._get_snapshot_row(user, database)
+
+        if row is None:
+            return user.build_authorization_data(using=database), user.authorization_version
+
+        version, snapshot_version, data = row
+        if data is not None and snapshot_version == version:
+            return json.loads(data), version
+
+        data = user.build_authorization_data(using=database)
+        serialized = json.dumps(data)
+
+        # Never replace a snapshot of a newer version.
+        primary = self.db_manager(DEFAULT_DB_ALIAS)
+        updated = primary.filter(user_id=user.pk, authorization_version__lt=version).update(
+            authorization_version=version,
+            created_at=timezone.now(),
+            data=serialized,
+        )
+        if not updated:
+            try:
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    # By id: assigning `user` would ask the router for a
+                    # write database, pinning the request to the primary.
+                    primary.create(user_id=user.pk, authorization_version=version, data=serialized)
+            except IntegrityError:
+                # A snapshot of this or a newer version was stored first.
+                pass
+
+        return data, version
+
+    def _get_snapshot_row(self, user, database):
+        return (
+            user.__class__._default_manager
+            .using(database)
+            .filter(pk=user.pk)
+            .values_list(
+                'authorization_version',
+                'authorization_snapshot__authorization_version',
+                'authorization_snapshot__data',
+            )
+            .first()
+        )
+
+
+class OrganizationManager(models.Manager):
+
+    def descendants(self, organization, include_self=False):
+        """
+        Returns the organizations below `organization` in the tree, closest
+        first, with a single query on the closure table.
+        """
+        return self.filter(
+            ancestor_links__ancestor=organization,
+            ancestor_links__depth__gte=0 if include_self else 1,
+        ).order_by('ancestor_links__depth', 'id')
+
+    def ancestors(self, organization, include_self=False):
+        """
+        Returns the organizations above `organization` in the tree, from its
+        parent up to the root, with a single query on the closure table.
+        """
+        return self.filter(
+            descendant_links__descendant=organization,
+            descendant_links__depth__gte=0 if include_self else 1,
+        ).order_by('descendant_links__depth')
+
+
+class OrganizationClosureManager(models.Manager):
+
+    def insert_node(self, organization):
+        """
+        Adds the closure rows of a newly created leaf organization.
+        """
+        rows = [
+            self.model(ancestor_id=organization.pk, descendant_id=organization.pk, depth=0),
+        ]
+
+        if organization.parent_id is not None:
+            parent_links = self.filter(
+                descendant_id=organization.parent_id,
+            ).values_list('ancestor_id', 'depth')
+
+            for ancestor_id, depth in parent_links:
+                rows.append(self.model(
+                    ancestor_id=ancestor_id,
+                    descendant_id=organization.pk,
+                    depth=depth + 1,
+                ))
+
+        self.bulk_create(rows)
+
+    def move_node(self, organization):
+        """
+        Re-attaches the subtree rooted at `organization` under its current
+        `parent_id`, replacing the rows that linked the subtree to its
+        former ancestors.
+        """
+        subtree = list(self.filter(ancestor_id=organization.pk).values_list('descendant_id', 'depth'))
+        subtree_ids = self.filter(ancestor_id=organization.pk).values('descendant_id')
+
+        if organization.parent_id is not None and any(
+            descendant_id == organization.parent_id for descendant_id, _depth in subtree
+        ):
+            raise ValueError('An organization cannot be moved below itself.')
+
+        self.filter(
+            descendant_id__in=subtree_ids,
+        ).exclude(
+            ancestor_id__in=subtree_ids,
+        ).delete()
+
+        if organization.parent_id is None:
+            return
+
+        parent_links = list(self.filter(
+            descendant_id=organization.parent_id,
+        ).values_list('ancestor_id', 'depth'))
+
+        self.bulk_create([
+            self.model(
+                ancestor_id=ancestor_id,
+                descendant_id=descendant_id,
+                depth=ancestor_depth + descendant_depth + 1,
+            )
+            for ancestor_id, ancestor_depth in parent_links
+            for descendant_id, descendant_depth in subtree
+        ])
+
+
+class GenerationManager(models.Manager):
+    """
+    Manager of a single row counter telling every process that some data it
+    keeps in memory is stale.
+    """
+    # The primary key of the only row.
+    row_id = 1
+
+    def current(self):
+        """
+        Returns the current generation with a single primary key lookup.
+        """
+        generation = self.filter(pk=self.row_id).values_list('generation', flat=True).first()
+        return generation or 0
+
+    def bump(self):
+        updated = self.filter(pk=self.row_id).update(
+            generation=models.F('generation') + 1,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            return
+
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(pk=self.row_id, generation=1)
+        except IntegrityError:
+            # Created concurrently.
+            self.bump()
+
+
+class PermissionCatalogueVersionManager(models.Manager):
+
+    def record(self, version, permission_ids):
+        """
+        Stores the permission IDs by position of the catalogue `version` on
+        the primary, without pinning the request to it. Recording a version
+        twice is harmless.
+        """
+        primary = self.db_manager(DEFAULT_DB_ALIAS)
+        if primary.filter(pk=version).exists():
+            return
+
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                primary.create(version=version, permission_ids=json.dumps(permission_ids))
+        except IntegrityError:
+            # Recorded concurrently.
+            pass
+
+    def get_permission_ids(self, version):
+        """
+        Returns the permission IDs by position of the catalogue `version`, or
+        `None` if it was never recorded. Read from the primary, as the
+        version may have been recorded just now.
+        """
+        permission_ids = self.db_manager(DEFAULT_DB_ALIAS).filter(
+            pk=version,
+        ).values_list('permission_ids', flat=True).first()
+        if permission_ids is None:
+            return None
+        return json.loads(permission_ids)
+
+
+class RevokedTokenManager(models.Manager):
+
+    def revoke(self, jti, user_id, expires_at):
+        """
+        Records the token `jti` as revoked until it expires. Revoking a token
+        twice is harmless.
+        """
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(jti=jti, user_id=user_id, expires_at=expires_at)
+        except IntegrityError:
+            pass
+
+    def unexpired_ids(self):
+        return self.filter(expires_at__gt=timezone.now()).values_list('jti', flat=True)
+
+    def prune(self):
+        """
+        Deletes the revocations of tokens that have expired anyway.
+        """
+        return self.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+class TokenEpochManager(models.Manager):
+
+    def revoke_user_tokens(self, user_id, revoked_at, expires_at):
+        """
+        Revokes the tokens of the user issued before `revoked_at`,
+        which have all expired by `expires_at`.
+        """
+        updated = self.filter(user_id=user_id).update(
+            revoked_at=revoked_at,
+            expires_at=expires_at,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            return
+
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(user_id=user_id, revoked_at=revoked_at, expires_at=expires_at)
+        except IntegrityError:
+            # Created concurrently.
+            self.revoke_user_tokens(user_id, revoked_at, expires_at)
+
+    def unexpired(self):
+        return self.filter(expires_at__gt=timezone.now()).values_list('user_id', 'revoked_at')
+
+    def prune(self):
+        return self.filter(expires_at__lte=timezone.now()).delete()[0]
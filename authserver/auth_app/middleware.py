@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+
+import json
+import logging
+import time
+
+from django.db import connections
+
+from . import instrumentation, routers
+from .conf import app_settings
+
+
+logger = logging.getLogger('auth_app.instrumentation')
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records, per request, the total latency, the number and duration of
+    database queries and the durations of the operations timed with
+    `auth_app.instrumentation.timer` (JWT signing and verification,
+    permission checks, serialization...). Metrics are served by
+    `MetricsView`; with `INSTRUMENTATION_LOG` a JSON line is also logged
+    for every request.
+
+    Does nothing but a settings lookup when `INSTRUMENTATION_ENABLED` is off.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not app_settings.INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+
+        # Query logging is what Django's own `CaptureQueriesContext` relies
+        # on; `queries_log` is reset by `request_started` for every request.
+        query_logs = []
+        for connection in connections.all():
+            query_logs.append((connection, connection.force_debug_cursor, len(connection.queries_log)))
+            connection.force_debug_cursor = True
+
+        instrumentation.start_request()
+        started = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.time() - started
+            phases = instrumentation.finish_request()
+
+            query_count = 0
+            query_time = 0.0
+            for connection, force_debug_cursor, initial in query_logs:
+                connection.force_debug_cursor = force_debug_cursor
+                for query in list(connection.queries_log)[initial:]:
+                    query_count += 1
+                    query_time += float(query['time'])
+
+        view = self.get_view_name(request)
+        registry = instrumentation.registry
+        registry.inc(
+            'authserver_requests_total',
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+        registry.observe('authserver_request_duration_seconds', duration, view=view)
+        registry.inc('authserver_db_queries_total', query_count, view=view)
+        registry.inc('authserver_db_query_seconds_total', query_time, view=view)
+
+        if app_settings.INSTRUMENTATION_LOG:
+            record = {
+                'event': 'request',
+                'view': view,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 3),
+                'db_queries': query_count,
+                'db_time_ms': round(query_time * 1000, 3),
+            }
+            for operation, elapsed in phases.items():
+                record['%s_ms' % operation] = round(elapsed * 1000, 3)
+            logger.info(json.dumps(record, sort_keys=True))
+
+        return response
+
+    def get_view_name(self, request):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return 'unresolved'
+        return getattr(resolver_match.func, '__name__', resolver_match.view_name)
+
+
+class ReplicaPinningMiddleware(object):
+    """
+    Read-your-writes across requests: after a request that wrote to the
+    primary, a cookie pins the client's reads to the primary for
+    `REPLICA_PIN_SECONDS`, long enough for the replicas to catch up.
+    """
+    cookie_name = 'authserver_pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not app_settings.READ_REPLICAS:
+            return self.get_response(request)
+
+        routers.reset_pinning(pinned=self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+            if routers.has_written():
+                response.set_cookie(self.cookie_name, '1', max_age=app_settings.REPLICA_PIN_SECONDS, httponly=True)
+        finally:
+            routers.reset_pinning()
+        return response
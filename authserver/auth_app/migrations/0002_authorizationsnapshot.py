@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:17
+from __future__ import unicode_literals
+
+import auth_app.managers
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorizationSnapshot',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='authorization_snapshot', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('created_at', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created at')),
+                ('data', models.TextField(verbose_name='data')),
+            ],
+            options={
+                'verbose_name': 'authorization snapshot',
+                'verbose_name_plural': 'authorization snapshots',
+                'db_table': 'authorization_snapshots',
+            },
+        ),
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', auth_app.managers.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='permission',
+            name='roles',
+            field=models.ManyToManyField(through='auth_app.RolePermissionAssociation', to='auth_app.Role'),
+        ),
+        migrations.AddField(
+            model_name='role',
+            name='permissions',
+            field=models.ManyToManyField(through='auth_app.RolePermissionAssociation', to='auth_app.Permission'),
+        ),
+        migrations.AlterField(
+            model_name='organization',
+            name='parent',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='auth_app.Organization'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_organization_closure(apps, schema_editor):
+    Organization = apps.get_model('auth_app', 'Organization')
+    OrganizationClosure = apps.get_model('auth_app', 'OrganizationClosure')
+
+    parents = dict(Organization.objects.values_list('id', 'parent_id'))
+
+    rows = []
+    for organization_id in parents:
+        ancestor_id, depth = organization_id, 0
+        while ancestor_id is not None:
+            rows.append(OrganizationClosure(
+                ancestor_id=ancestor_id,
+                descendant_id=organization_id,
+                depth=depth,
+            ))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+
+    OrganizationClosure.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0002_authorizationsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganizationClosure',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('depth', models.PositiveIntegerField(verbose_name='depth')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='auth_app.Organization')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='auth_app.Organization')),
+            ],
+            options={
+                'verbose_name': 'organization closure',
+                'verbose_name_plural': 'organization closures',
+                'db_table': 'organizations_closure',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='organizationclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='organizationclosure',
+            index_together=set([('descendant', 'depth')]),
+        ),
+        migrations.RunPython(build_organization_closure, migrations.RunPython.noop),
+    ]
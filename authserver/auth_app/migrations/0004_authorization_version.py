@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0003_organizationclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorizationsnapshot',
+            name='authorization_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='authorization version'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='authorization_version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented whenever the roles of this user or their permissions change.', verbose_name='authorization version'),
+        ),
+    ]
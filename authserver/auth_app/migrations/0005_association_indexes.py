@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:33
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0004_authorization_version'),
+    ]
+
+    operations = [
+        # Create the composite indexes before dropping the single column
+        # indexes they replace.
+        migrations.AlterIndexTogether(
+            name='rolepermissionassociation',
+            index_together=set([('permission', 'role')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='roleuserorgassociation',
+            index_together=set([('user', 'organization', 'role')]),
+        ),
+        migrations.AlterField(
+            model_name='rolepermissionassociation',
+            name='permission',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='auth_app.Permission'),
+        ),
+        migrations.AlterField(
+            model_name='roleuserorgassociation',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0005_association_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PermissionCatalogueGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.BigIntegerField(default=0, verbose_name='generation')),
+                ('updated_at', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'permission catalogue generation',
+                'verbose_name_plural': 'permission catalogue generations',
+                'db_table': 'permission_catalogue_generation',
+            },
+        ),
+    ]
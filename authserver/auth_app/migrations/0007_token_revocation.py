@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 11:54
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0006_permissioncataloguegeneration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('jti', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='JWT ID')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='expires at')),
+                ('created_at', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created at')),
+            ],
+            options={
+                'verbose_name': 'revoked token',
+                'verbose_name_plural': 'revoked tokens',
+                'db_table': 'revoked_tokens',
+            },
+        ),
+        migrations.CreateModel(
+            name='TokenEpoch',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='token_epoch', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('revoked_at', models.DateTimeField(verbose_name='revoked at')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='expires at')),
+                ('updated_at', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'token epoch',
+                'verbose_name_plural': 'token epochs',
+                'db_table': 'token_epochs',
+            },
+        ),
+        migrations.AddField(
+            model_name='revokedtoken',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revoked_tokens', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0007_token_revocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PermissionCatalogueVersion',
+            fields=[
+                ('version', models.CharField(max_length=40, primary_key=True, serialize=False, verbose_name='version')),
+                ('permission_ids', models.TextField(verbose_name='permission IDs')),
+                ('created_at', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created at')),
+            ],
+            options={
+                'verbose_name': 'permission catalogue version',
+                'verbose_name_plural': 'permission catalogue versions',
+                'db_table': 'permission_catalogue_versions',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 12:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_app', '0008_permissioncatalogueversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganizationTreeGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.BigIntegerField(default=0, verbose_name='generation')),
+                ('updated_at', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'organization tree generation',
+                'verbose_name_plural': 'organization tree generations',
+                'db_table': 'organization_tree_generation',
+            },
+        ),
+    ]
@@ -3,14 +3,24 @@ from __future__ import unicode_literals
 import collections
 
 from django.core.mail import send_mail
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 from django.contrib.auth.base_user import AbstractBaseUser
 
 from model_utils.fields import AutoCreatedField, AutoLastModifiedField
 
-from .managers import UserManager
+from .managers import (
+    AuthorizationSnapshotManager,
+    GenerationManager,
+    OrganizationClosureManager,
+    OrganizationManager,
+    PermissionCatalogueVersionManager,
+    RevokedTokenManager,
+    TokenEpochManager,
+    UserManager,
+)
+from .routers import get_read_database
 
 
 class Application(models.Model):
@@ -34,11 +44,59 @@ class Organization(models.Model):
     parent = models.ForeignKey('Organization', null=True, related_name='children')
     is_active = models.BooleanField(_('is active'), default=True)
 
+    objects = OrganizationManager()
+
     class Meta:
         db_table = 'organizations'
         verbose_name = _('organization')
         verbose_name_plural = _('organizations')
 
+    def __init__(self, *args, **kwargs):
+        super(Organization, self).__init__(*args, **kwargs)
+        self._saved_parent_id = self.parent_id
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the organization and keeps its `OrganizationClosure` rows in
+        sync when it is created or re-parented. Rows of deleted organizations
+        are removed by the cascade.
+        """
+        adding = self._state.adding
+
+        with transaction.atomic(using=kwargs.get('using')):
+            super(Organization, self).save(*args, **kwargs)
+
+            if adding:
+                OrganizationClosure.objects.insert_node(self)
+            elif self.parent_id != self._saved_parent_id:
+                OrganizationClosure.objects.move_node(self)
+
+        self._saved_parent_id = self.parent_id
+
+
+class OrganizationClosure(models.Model):
+    """
+    One row per (ancestor, descendant) pair of the organization tree,
+    including each organization paired with itself at depth 0.
+    """
+    id = models.BigAutoField(primary_key=True)
+    ancestor = models.ForeignKey(Organization, null=False, related_name='descendant_links')
+    descendant = models.ForeignKey(Organization, null=False, related_name='ancestor_links')
+    depth = models.PositiveIntegerField(_('depth'))
+
+    objects = OrganizationClosureManager()
+
+    class Meta:
+        db_table = 'organizations_closure'
+        unique_together = (
+            ('ancestor', 'descendant',),
+        )
+        index_together = (
+            ('descendant', 'depth',),
+        )
+        verbose_name = _('organization closure')
+        verbose_name_plural = _('organization closures')
+
 
 class User(AbstractBaseUser):
     id = models.BigAutoField(primary_key=True)
@@ -54,6 +112,14 @@ class User(AbstractBaseUser):
         ),
     )
     updated_at = AutoLastModifiedField(_('updated at'))
+    authorization_version = models.PositiveIntegerField(
+        _('authorization version'),
+        default=0,
+        help_text=_(
+            'Incremented whenever the roles of this user or their '
+            'permissions change.'
+        ),
+    )
     is_staff = models.BooleanField(
         _('staff status'),
         default=False,
@@ -129,54 +195,105 @@ class User(AbstractBaseUser):
 
         return False
 
-    def get_permissions(self):
-        roles_ids = RoleUserOrgAssociation.objects.filter(
-            user=self,
-        ).values_list('role_id', flat=True)
-
-        permissions_ids = RolePermissionAssociation.objects.filter(
-            role_id__in=roles_ids,
-        ).values_list('permission_id', flat=True)
-
-        permissions = Permission.objects.filter(id__in=permissions_ids).all()
+    def get_permissions(self, names_only=False):
+        """
+        Returns the permissions granted by any role of this User, ordered by
+        id, from a single joined and de-duplicated query, on a read replica
+        if configured. With `names_only`, returns their names instead of
+        `Permission` instances.
+        """
+        permissions = Permission.objects.using(get_read_database()).filter(
+            roles__roleuserorgassociation__user=self,
+        ).distinct().order_by('id')
 
+        if names_only:
+            return permissions.values_list('name', flat=True)
         return permissions
 
     def get_organizations(self):
-        from .serializers import (
-            OrganizationSerializer,
-            RoleSerializer,
-        )
+        """
+        Returns the organizations this User holds roles in, with those roles
+        and their permissions, as rendered by `OrganizationSerializer` and
+        `RoleSerializer`.
+        """
+        return self.build_authorization_data()['organizations']
 
-        associated_roles = RoleUserOrgAssociation.objects.filter(
+    def build_authorization_data(self, using=None):
+        """
+        Returns the organizations, roles and permissions embedded in this
+        User's tokens, as stored in its `AuthorizationSnapshot`.
+
+        Renders the same data as `OrganizationSerializer`, `RoleSerializer`
+        and `PermissionSerializer(get_permissions(), many=True)`. Only the
+        User's role associations are queried, from the database `using`,
+        by default a read replica if configured: roles and their permissions
+        come from the process-local `PermissionCatalogue`, whose generation
+        is checked first so that no stale role is stored in a snapshot.
+        """
+        from .catalogue import get_catalogue, invalidate_catalogue
+        from .serializers import organization_row_serializer
+
+        catalogue = get_catalogue(check_generation=True)
+
+        associations = list(RoleUserOrgAssociation.objects.using(using or get_read_database()).filter(
             user=self,
-        ).select_related(
-            'role',
-            'organization',
-        ).prefetch_related(
-            'role__permissions',
-        ).all()
-
-        organizations_dict = collections.defaultdict(dict)
-        for associated_role in associated_roles:
-            organization = associated_role.organization
-            role = associated_role.role
-
-            organizations_dict[organization.id]['obj'] = organization
+        ).order_by(
+            'id',
+        ).values_list(
+            'organization_id',
+            'organization__name',
+            'organization__parent_id',
+            'role_id',
+        ))
+
+        if any(association[3] not in catalogue.roles for association in associations):
+            # A role created since the generation check.
+            invalidate_catalogue()
+            catalogue = get_catalogue()
+
+        organizations = collections.OrderedDict()
+        permission_ids = set()
+        for organization_id, organization_name, organization_parent_id, role_id in associations:
             try:
-                roles = organizations_dict[organization.id]['roles']
+                organization = organizations[organization_id]
             except KeyError:
-                roles = organizations_dict[organization.id]['roles'] = []
-
-            roles.append(RoleSerializer(role).data)
+                organization = organizations[organization_id] = organization_row_serializer.to_representation({
+                    'id': organization_id,
+                    'name': organization_name,
+                    'parent_id': organization_parent_id,
+                })
+                organization['roles'] = []
+
+            organization['roles'].append(catalogue.role_representations[role_id])
+            permission_ids.update(catalogue.roles[role_id]['permissions'])
+
+        return {
+            'organizations': list(organizations.values()),
+            'permissions': [
+                catalogue.permission_representations[permission_id]
+                for permission_id in sorted(permission_ids)
+            ],
+        }
+
+
+class AuthorizationSnapshot(models.Model):
+    """
+    Materialized authorization data of a User, built on first token issue.
+    It is current as long as its `authorization_version` matches the user's,
+    which the signal handlers in `auth_app.signals` increment whenever any of
+    the rows it was built from change.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='authorization_snapshot')
+    authorization_version = models.PositiveIntegerField(_('authorization version'), default=0)
+    created_at = AutoCreatedField(_('created at'))
+    data = models.TextField(_('data'))
 
-        organizations = []
-        for _org_dict in organizations_dict.values():
-            _org_data = OrganizationSerializer(_org_dict['obj']).data
-            _org_data['roles'] = _org_dict['roles']
-            organizations.append(_org_data)
+    objects = AuthorizationSnapshotManager()
 
-        return organizations
+    class Meta:
+        db_table = 'authorization_snapshots'
+        verbose_name = _('authorization snapshot')
+        verbose_name_plural = _('authorization snapshots')
 
 
 class Role(models.Model):
@@ -197,13 +314,19 @@ class RoleUserOrgAssociation(models.Model):
     id = models.BigAutoField(primary_key=True)
     role = models.ForeignKey(Role, null=False)
     organization = models.ForeignKey(Organization, null=False)
-    user = models.ForeignKey(User, null=False)
+    # Indexed by the user-leading index below.
+    user = models.ForeignKey(User, null=False, db_index=False)
 
     class Meta:
         db_table = 'roles_users_org'
         unique_together = (
             ('role', 'organization', 'user',),
         )
+        # Covers the per-user lookups of `User.get_permissions()`,
+        # `User.build_authorization_data()` and `check_permissions()`.
+        index_together = (
+            ('user', 'organization', 'role',),
+        )
         verbose_name = _('role + user + organization association')
         verbose_name_plural = _('role + user + organization associations')
 
@@ -225,12 +348,108 @@ class Permission(models.Model):
 class RolePermissionAssociation(models.Model):
     id = models.BigAutoField(primary_key=True)
     role = models.ForeignKey(Role, null=False)
-    permission = models.ForeignKey(Permission, null=False)
+    # Indexed by the permission-leading index below.
+    permission = models.ForeignKey(Permission, null=False, db_index=False)
 
     class Meta:
         db_table = 'roles_permissions'
+        # Also covers the `role_id__in` lookups of the permissions of roles.
         unique_together = (
             ('role', 'permission',),
         )
+        index_together = (
+            ('permission', 'role',),
+        )
         verbose_name = _('role + permission association')
         verbose_name_plural = _('role + permission associations')
+
+
+class PermissionCatalogueGeneration(models.Model):
+    """
+    A single row counter incremented by the signal handlers in
+    `auth_app.signals` whenever roles, permissions or their associations
+    change, telling every process its `PermissionCatalogue` is stale.
+    """
+    generation = models.BigIntegerField(_('generation'), default=0)
+    updated_at = AutoLastModifiedField(_('updated at'))
+
+    objects = GenerationManager()
+
+    class Meta:
+        db_table = 'permission_catalogue_generation'
+        verbose_name = _('permission catalogue generation')
+        verbose_name_plural = _('permission catalogue generations')
+
+
+class OrganizationTreeGeneration(models.Model):
+    """
+    A single row counter incremented by the signal handlers in
+    `auth_app.signals` whenever organizations are created, re-parented or
+    deleted, telling every process its `OrganizationIndex` is stale.
+    """
+    generation = models.BigIntegerField(_('generation'), default=0)
+    updated_at = AutoLastModifiedField(_('updated at'))
+
+    objects = GenerationManager()
+
+    class Meta:
+        db_table = 'organization_tree_generation'
+        verbose_name = _('organization tree generation')
+        verbose_name_plural = _('organization tree generations')
+
+
+class PermissionCatalogueVersion(models.Model):
+    """
+    The permission IDs of a catalogue in the order of their bit positions in
+    compact tokens, by the `pcv` claim of those tokens, so that any process
+    can decode a token issued against a catalogue it never loaded itself.
+    """
+    version = models.CharField(_('version'), max_length=40, primary_key=True)
+    permission_ids = models.TextField(_('permission IDs'))
+    created_at = AutoCreatedField(_('created at'))
+
+    objects = PermissionCatalogueVersionManager()
+
+    class Meta:
+        db_table = 'permission_catalogue_versions'
+        verbose_name = _('permission catalogue version')
+        verbose_name_plural = _('permission catalogue versions')
+
+
+class RevokedToken(models.Model):
+    """
+    A token revoked before its expiration, by its `jti` claim. Checked by
+    `auth_app.revocation`, which keeps the unexpired ids in a Bloom filter.
+    """
+    jti = models.CharField(_('JWT ID'), max_length=64, primary_key=True)
+    user = models.ForeignKey(User, null=True, related_name='revoked_tokens')
+    expires_at = models.DateTimeField(_('expires at'), db_index=True)
+    created_at = AutoCreatedField(_('created at'))
+
+    objects = RevokedTokenManager()
+
+    class Meta:
+        db_table = 'revoked_tokens'
+        verbose_name = _('revoked token')
+        verbose_name_plural = _('revoked tokens')
+
+
+class TokenEpoch(models.Model):
+    """
+    Revokes every token of a User issued before `revoked_at`, e.g.
+    when the user is deactivated or loses a role. Past `expires_at`, all of
+    those tokens have expired and the row no longer matters.
+    """
+    # Without a constraint, as deleting a user deletes their associations
+    # first, whose signals create the epoch of the user being deleted.
+    user = models.OneToOneField(User, primary_key=True, related_name='token_epoch', db_constraint=False)
+    revoked_at = models.DateTimeField(_('revoked at'))
+    expires_at = models.DateTimeField(_('expires at'), db_index=True)
+    updated_at = AutoLastModifiedField(_('updated at'))
+
+    objects = TokenEpochManager()
+
+    class Meta:
+        db_table = 'token_epochs'
+        verbose_name = _('token epoch')
+        verbose_name_plural = _('token epochs')
@@ -0,0 +1,25 @@
+from __future__ import unicode_literals
+
+from rest_framework.pagination import CursorPagination, _positive_int
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key: each page is fetched with
+    `id > <last id of the previous page>` instead of an offset, so deep
+    pages cost the same as the first one. Works on `values()` querysets.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
@@ -1,10 +1,24 @@
 from __future__ import unicode_literals
 
+import contextlib
+
 from django.http import Http404
+from django.utils.translation import ugettext as _
 
 from rest_framework.compat import is_authenticated
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_jwt.settings import api_settings
 
+from auth_app.catalogue import UnknownCatalogueVersion
+from auth_app.hierarchy import has_organization_permission
+from auth_app.instrumentation import timer
+from auth_app.models import RoleUserOrgAssociation
+from auth_app.revocation import is_revoked
+from auth_app.utils.jwt import (
+    get_organization_permission_names,
+    get_permission_names,
+)
+
 
 jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
 
@@ -17,33 +31,193 @@ class JWTPermission(object):
     """
 
     def get_payload(self, request):
-        return jwt_decode_handler(request.auth)
+        """
+        Returns the verified payload of the request's token, raising
+        `AuthenticationFailed` if the token was revoked.
+        """
+        payload = jwt_decode_handler(request.auth)
+        if is_revoked(payload):
+            raise AuthenticationFailed(_('Token has been revoked.'))
+        return payload
 
     def has_permission(self, request, view):
         """
         Return `True` if permission is granted, `False` otherwise.
         """
+        with timer('permission_check'):
+            return self.check_permission(request, view)
+
+    def check_permission(self, request, view):
         if not (request.user and is_authenticated(request.user)):
             return False
 
         payload = self.get_payload(request)
 
         try:
-            resource_name = view.resource_name
-        except AttributeError:
+            required_permission = self.get_required_permission(request, view)
+        except (AttributeError, KeyError):
             return False
 
         try:
-            available_permissions = [x['name'] for x in payload['permissions']]
+            available_permissions = self.get_permission_names(payload)
         except KeyError:
             return False
 
-        required_permission = '%s-%s' % (resource_name, request.method)
-
         return required_permission in available_permissions
 
+    def get_permission_names(self, payload):
+        """
+        Returns the names of the permissions `payload` grants, raising
+        `KeyError` if it carries none.
+        """
+        with self.catalogue_version_check():
+            try:
+                return payload.permission_names
+            except AttributeError:
+                # Payloads not decoded through `auth_app.utils.jwt`.
+                return get_permission_names(payload)
+
+    @contextlib.contextmanager
+    def catalogue_version_check(self):
+        # A compact token that cannot be decoded grants nothing, which its
+        # holder is told, to obtain a new token rather than being refused.
+        try:
+            yield
+        except UnknownCatalogueVersion:
+            raise AuthenticationFailed(_('Token was issued against an unknown permission catalogue.'))
+
+    def get_required_permission(self, request, view):
+        """
+        Returns the permission name the request must be granted, e.g.
+        `Users-GET`, preferring the keys precomputed by `ResourceAPIView`.
+        """
+        try:
+            required_permissions = view.required_permissions
+        except AttributeError:
+            # Views not built by `ResourceAPIViewMetaclass`.
+            if view.resource_name is None:
+                raise AttributeError('%r declares no resource_name.' % view)
+            return '%s-%s' % (view.resource_name, request.method)
+
+        return required_permissions[request.method]
+
     def has_object_permission(self, request, view, obj):
         """
         Return `True` if permission is granted, `False` otherwise.
         """
         return False
+
+
+class IsAuthenticatedJWT(JWTPermission):
+    """
+    Grants any authenticated request whose token was not revoked, for
+    views that require no particular permission.
+    """
+
+    def check_permission(self, request, view):
+        if not (request.user and is_authenticated(request.user)):
+            return False
+
+        self.get_payload(request)
+        return True
+
+
+class OrganizationJWTPermission(JWTPermission):
+    """
+    Grants the view's permission only within the organization the request
+    targets, or any of its ancestors. The organization is read from the view's
+    `get_organization_id(request)` if defined, or else its `organization_id`
+    URL keyword argument.
+    """
+
+    def check_permission(self, request, view):
+        if not (request.user and is_authenticated(request.user)):
+            return False
+
+        payload = self.get_payload(request)
+
+        try:
+            required_permission = self.get_required_permission(request, view)
+        except (AttributeError, KeyError):
+            return False
+
+        try:
+            organization_id = self.get_organization_id(request, view)
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        try:
+            organization_permissions = self.get_organization_permission_names(payload)
+        except KeyError:
+            return False
+
+        return has_organization_permission(
+            organization_permissions,
+            organization_id,
+            required_permission,
+        )
+
+    def get_organization_permission_names(self, payload):
+        """
+        Returns the names of the permissions `payload` grants by organization
+        ID, raising `KeyError` if it carries no organizations.
+        """
+        with self.catalogue_version_check():
+            try:
+                return payload.organization_permission_names
+            except AttributeError:
+                # Payloads not decoded through `auth_app.utils.jwt`.
+                return get_organization_permission_names(payload)
+
+    def get_organization_id(self, request, view):
+        try:
+            get_organization_id = view.get_organization_id
+        except AttributeError:
+            return int(view.kwargs['organization_id'])
+
+        return int(get_organization_id(request))
+
+
+def check_permissions(checks):
+    """
+    Evaluates many `(user_id, organization_id, permission_name)` checks at
+    once and returns a list of booleans in the same order. A permission is
+    granted in an organization if one of the user's roles grants it there or
+    in an ancestor organization; an `organization_id` of `None` asks whether
+    it is granted in any organization. Inactive users are granted nothing.
+
+    All checks are answered from a single query, whatever their number.
+    """
+    checks = list(checks)
+    if not checks:
+        return []
+
+    user_ids = set(user_id for user_id, _, _ in checks)
+    permission_names = set(name for _, _, name in checks)
+
+    grants = (
+        RoleUserOrgAssociation.objects
+        .filter(
+            user_id__in=user_ids,
+            user__is_active=True,
+            role__permissions__name__in=permission_names,
+        )
+        .values_list('user_id', 'organization_id', 'role__permissions__name')
+        .distinct()
+    )
+
+    # user ID -> organization ID -> granted permission names.
+    organization_permissions = {}
+    for user_id, organization_id, name in grants:
+        organizations = organization_permissions.setdefault(user_id, {})
+        organizations.setdefault(organization_id, set()).add(name)
+
+    results = []
+    for user_id, organization_id, permission_name in checks:
+        organizations = organization_permissions.get(user_id, {})
+        if organization_id is None:
+            granted = any(permission_name in names for names in organizations.values())
+        else:
+            granted = has_organization_permission(organizations, organization_id, permission_name)
+        results.append(granted)
+    return results
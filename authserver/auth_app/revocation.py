@@ -0,0 +1,192 @@
+"""
+Revocation of tokens before their expiration.
+
+A single token is revoked by its `jti` claim (`RevokedToken`), all tokens of
+a user issued before a point in time by the user's `TokenEpoch`. Both are
+kept until the tokens they revoke have expired anyway.
+
+Each process checks tokens against a `RevocationList` held in memory: the
+per-user epochs, and a Bloom filter of the revoked `jti`s, so that the
+common case of a token that was not revoked costs no query. A `jti` that
+may be in the filter is confirmed against the database. The list is
+rebuilt at most every `REVOCATION_REFRESH_INTERVAL` seconds, which bounds
+how long a revocation made by another process takes to apply here;
+revocations made by this process apply right away.
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+from calendar import timegm
+from datetime import datetime, timedelta
+
+from django.test.signals import setting_changed
+from django.utils import timezone
+from rest_framework_jwt.settings import api_settings
+
+from .conf import app_settings
+from .instrumentation import count, timer
+from .models import RevokedToken, TokenEpoch
+from .utils.bloom import BloomFilter
+
+
+def to_timestamp(value):
+    """
+    Returns the timestamp of the aware datetime `value`, to the microsecond.
+    """
+    return timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+class RevocationList(object):
+    """
+    The revoked `jti`s and the user epochs unexpired at load time.
+    """
+
+    def __init__(self, jtis, epochs):
+        self.bloom = BloomFilter(
+            max(len(jtis) * 2, app_settings.REVOCATION_BLOOM_MIN_CAPACITY),
+            app_settings.REVOCATION_BLOOM_ERROR_RATE,
+        )
+        for jti in jtis:
+            self.bloom.add(jti)
+
+        # User ID -> timestamp before which tokens are revoked.
+        self.epochs = epochs
+        self.loaded_at = time.time()
+
+    @classmethod
+    def load(cls):
+        with timer('revocation_list_load'):
+            jtis = list(RevokedToken.objects.unexpired_ids())
+            epochs = dict(
+                (user_id, to_timestamp(revoked_at))
+                for user_id, revoked_at in TokenEpoch.objects.unexpired()
+            )
+            return cls(jtis, epochs)
+
+    def add_token(self, jti):
+        self.bloom.add(jti)
+
+    def set_epoch(self, user_id, revoked_at):
+        self.epochs[user_id] = max(self.epochs.get(user_id, 0), to_timestamp(revoked_at))
+
+    def is_revoked(self, payload):
+        epoch = self.epochs.get(payload.get('user_id'))
+        if epoch is not None:
+            issued_at = get_issued_at(payload)
+            if issued_at is None or issued_at < epoch:
+                return True
+
+        jti = payload.get('jti')
+        if jti is None or jti not in self.bloom:
+            return False
+
+        count('authserver_revocation_bloom_total', result='maybe')
+        is_revoked = RevokedToken.objects.filter(jti=jti).exists()
+        if not is_revoked:
+            count('authserver_revocation_bloom_total', result='false_positive')
+        return is_revoked
+
+
+_revocation_list = None
+_revocation_list_lock = threading.Lock()
+
+
+def get_revocation_list():
+    """
+    Returns the process-local revocation list, loading it on first use and
+    rebuilding it once it is older than `REVOCATION_REFRESH_INTERVAL`. While
+    one thread rebuilds it, the others keep using the previous list.
+    """
+    global _revocation_list
+
+    revocation_list = _revocation_list
+    if revocation_list is not None and (
+        time.time() - revocation_list.loaded_at < app_settings.REVOCATION_REFRESH_INTERVAL
+    ):
+        return revocation_list
+
+    if not _revocation_list_lock.acquire(revocation_list is None):
+        return revocation_list
+
+    try:
+        revocation_list = _revocation_list
+        if revocation_list is None or (
+            time.time() - revocation_list.loaded_at >= app_settings.REVOCATION_REFRESH_INTERVAL
+        ):
+            revocation_list = _revocation_list = RevocationList.load()
+    finally:
+        _revocation_list_lock.release()
+
+    return revocation_list
+
+
+def invalidate_revocation_list(*args, **kwargs):
+    global _revocation_list
+    if kwargs.get('setting', 'AUTH_APP') == 'AUTH_APP':
+        _revocation_list = None
+
+
+setting_changed.connect(invalidate_revocation_list)
+
+
+def get_issued_at(payload):
+    """
+    Returns when the token of `payload` was issued as a timestamp, derived
+    from its expiration for tokens issued without an `iat` claim.
+    """
+    if 'iat' in payload:
+        return payload['iat']
+    if 'exp' in payload:
+        return payload['exp'] - int(api_settings.JWT_EXPIRATION_DELTA.total_seconds())
+    return None
+
+
+def get_new_token_issued_at(user_id, issued_at):
+    """
+    Returns the `iat` of a token of the user issued at the timestamp
+    `issued_at`: no earlier than the user's epoch, read from the primary, so
+    that a token issued right after a revocation by a host whose clock is
+    behind is not revoked itself.
+    """
+    revoked_at = TokenEpoch.objects.filter(user_id=user_id).values_list('revoked_at', flat=True).first()
+    if revoked_at is None:
+        return issued_at
+    return max(issued_at, to_timestamp(revoked_at))
+
+
+def is_revoked(payload):
+    revoked = get_revocation_list().is_revoked(payload)
+    count('authserver_revocation_checks_total', result='revoked' if revoked else 'valid')
+    return revoked
+
+
+def get_tokens_expire_at(revoked_at):
+    """
+    Returns when all tokens issued up to `revoked_at` have expired.
+    """
+    return revoked_at + api_settings.JWT_EXPIRATION_DELTA + timedelta(seconds=api_settings.JWT_LEEWAY)
+
+
+def revoke_token(payload):
+    """
+    Revokes the token of `payload`, which must carry a `jti` claim.
+    """
+    expires_at = timezone.now() + api_settings.JWT_EXPIRATION_DELTA
+    if 'exp' in payload:
+        expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc)
+    expires_at += timedelta(seconds=api_settings.JWT_LEEWAY)
+
+    RevokedToken.objects.revoke(payload['jti'], payload.get('user_id'), expires_at)
+    if _revocation_list is not None:
+        _revocation_list.add_token(payload['jti'])
+
+
+def revoke_user_tokens(user_id):
+    """
+    Revokes every token of the user issued until now.
+    """
+    revoked_at = timezone.now()
+    TokenEpoch.objects.revoke_user_tokens(user_id, revoked_at, get_tokens_expire_at(revoked_at))
+    if _revocation_list is not None:
+        _revocation_list.set_epoch(user_id, revoked_at)
@@ -0,0 +1,67 @@
+from __future__ import unicode_literals
+
+import contextlib
+import random
+import threading
+
+from django.db import DEFAULT_DB_ALIAS
+
+from .conf import app_settings
+
+
+_local = threading.local()
+
+
+def get_read_database():
+    """
+    Returns the alias reads that tolerate replication lag should use: a
+    random one of `AUTH_APP['READ_REPLICAS']`, or the primary if there is
+    none or the current thread is pinned to it because it wrote.
+    """
+    replicas = app_settings.READ_REPLICAS
+    if not replicas or getattr(_local, 'pinned', False):
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+
+def reset_pinning(pinned=False):
+    _local.pinned = pinned
+    _local.wrote = False
+
+
+def has_written():
+    return getattr(_local, 'wrote', False)
+
+
+@contextlib.contextmanager
+def preserve_pinning():
+    """
+    Keeps the writes of the block from pinning the current thread to the
+    primary, for writes the client never reads back such as `last_login`.
+    """
+    pinned, wrote = getattr(_local, 'pinned', False), has_written()
+    try:
+        yield
+    finally:
+        _local.pinned = pinned
+        _local.wrote = wrote
+
+
+class ReplicaRouter(object):
+    """
+    Sends every write to the primary and pins the current thread to it, so
+    that the rest of the request reads its own writes. Reads only go to the
+    replicas where `get_read_database()` is used explicitly; see
+    `ReplicaPinningMiddleware` for pinning across requests.
+    """
+
+    def db_for_write(self, model, **hints):
+        _local.pinned = True
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set([DEFAULT_DB_ALIAS]).union(app_settings.READ_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
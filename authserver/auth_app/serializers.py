@@ -1,6 +1,24 @@
-from rest_framework import serializers
+from calendar import timegm
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
+import jwt
+from django.contrib.auth import authenticate
+from django.contrib.auth.signals import user_logged_in
+from django.utils import six
+from django.utils.translation import ugettext as _
+from rest_framework import serializers
+from rest_framework_jwt.serializers import (
+    JSONWebTokenSerializer as BaseJSONWebTokenSerializer,
+    RefreshJSONWebTokenSerializer as BaseRefreshJSONWebTokenSerializer,
+    VerificationBaseSerializer,
+    VerifyJSONWebTokenSerializer as BaseVerifyJSONWebTokenSerializer,
+)
+from rest_framework_jwt.settings import api_settings
 
+from .conf import app_settings
+from .revocation import is_revoked, revoke_token
+from .routers import preserve_pinning
 from .models import (
     Application,
     Organization,
@@ -63,3 +81,304 @@ class RoleSerializer(serializers.ModelSerializer):
             'description',
             'permissions',
         )
+
+
+class RowSerializer(object):
+    """
+    A read-only fast path rendering `values()` rows exactly like
+    `serializer_class` renders model instances, without instantiating model
+    objects or going through the per-field serializer machinery.
+
+    The field list and the conversion of each field are computed once.
+    Values of nested serializer fields are not read from the database: the
+    caller puts their already rendered value in the row under the field name.
+    """
+    # Fields whose representation of a database value is the value itself.
+    identity_field_classes = (
+        serializers.CharField,
+        serializers.EmailField,
+        serializers.IntegerField,
+        serializers.ReadOnlyField,
+    )
+
+    def __init__(self, serializer_class):
+        self.fields = []
+        values_fields = []
+
+        for field_name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.BaseSerializer):
+                self.fields.append((field_name, field_name, None))
+                continue
+
+            if type(field) in self.identity_field_classes:
+                to_representation = None
+            else:
+                to_representation = field.to_representation
+
+            self.fields.append((field_name, field.source, to_representation))
+            values_fields.append(field.source)
+
+        self.values_fields = tuple(values_fields)
+
+    def to_representation(self, row):
+        ret = OrderedDict()
+        for field_name, source, to_representation in self.fields:
+            value = row[source]
+            if to_representation is not None and value is not None:
+                value = to_representation(value)
+            ret[field_name] = value
+        return ret
+
+    def to_representation_many(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+user_row_serializer = RowSerializer(UserSerializer)
+organization_row_serializer = RowSerializer(OrganizationSerializer)
+role_row_serializer = RowSerializer(RoleSerializer)
+permission_row_serializer = RowSerializer(PermissionSerializer)
+
+
+class JSONWebTokenSerializer(BaseJSONWebTokenSerializer):
+    """
+    Logs a user in through `AUTHENTICATION_BACKENDS`, sending
+    `user_login_failed` or `user_logged_in`, and returns a new token.
+    """
+
+    def validate(self, attrs):
+        user = self.authenticate(attrs)
+        return {
+            'token': api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user)),
+            'user': user,
+        }
+
+    def authenticate(self, attrs):
+        """
+        Returns the active user the credentials in `attrs` belong to, or
+        raises a `ValidationError`.
+        """
+        credentials = {
+            self.username_field: attrs.get(self.username_field),
+            'password': attrs.get('password'),
+        }
+        if not all(credentials.values()):
+            raise serializers.ValidationError(
+                _('Must include "{username_field}" and "password".').format(username_field=self.username_field)
+            )
+
+        user = authenticate(**credentials)
+        if not user:
+            raise serializers.ValidationError(_('Unable to login with provided credentials.'))
+        if not user.is_active:
+            raise serializers.ValidationError(_('User account is disabled.'))
+
+        # Updates `last_login`, which no response reads back.
+        with preserve_pinning():
+            user_logged_in.send(sender=user.__class__, request=self.context.get('request'), user=user)
+        return user
+
+
+class TokenCheckMixin(object):
+    """
+    Rejects invalid and revoked tokens along with those of inactive users.
+    """
+
+    def _check_payload(self, token):
+        try:
+            return super(TokenCheckMixin, self)._check_payload(token)
+        except jwt.InvalidTokenError:
+            # A wrong algorithm, or an invalid `iat`, `aud` or `iss`.
+            raise serializers.ValidationError(_('Invalid token.'))
+
+    def _check_user(self, payload):
+        user = super(TokenCheckMixin, self)._check_user(payload)
+        if is_revoked(payload):
+            raise serializers.ValidationError(_('Token has been revoked.'))
+        return user
+
+
+class VerifyJSONWebTokenSerializer(TokenCheckMixin, BaseVerifyJSONWebTokenSerializer):
+    """
+    Check the veracity of an access token, which must not be revoked.
+    """
+
+
+class RefreshJSONWebTokenSerializer(TokenCheckMixin, BaseRefreshJSONWebTokenSerializer):
+    """
+    Refreshes an access token, carrying its authorization claims over to the
+    new token as long as the user's authorization version did not change,
+    so that most refreshes only look the user up.
+    """
+
+    def validate(self, attrs):
+        from .utils.jwt import get_current_authorization_claims
+
+        token = attrs['token']
+
+        payload = self._check_payload(token=token)
+        user = self._check_user(payload=payload)
+        orig_iat = self._check_orig_iat(payload)
+
+        new_payload = api_settings.JWT_PAYLOAD_HANDLER(
+            user,
+            authorization_claims=get_current_authorization_claims(payload, user),
+        )
+        new_payload['orig_iat'] = orig_iat
+
+        return {
+            'token': api_settings.JWT_ENCODE_HANDLER(new_payload),
+            'user': user,
+        }
+
+    def _check_orig_iat(self, payload):
+        orig_iat = payload.get('orig_iat')
+        if not orig_iat:
+            raise serializers.ValidationError(_('orig_iat field is required.'))
+
+        refresh_limit = api_settings.JWT_REFRESH_EXPIRATION_DELTA
+        if isinstance(refresh_limit, timedelta):
+            refresh_limit = refresh_limit.days * 24 * 3600 + refresh_limit.seconds
+
+        if timegm(datetime.utcnow().utctimetuple()) > orig_iat + int(refresh_limit):
+            raise serializers.ValidationError(_('Refresh has expired.'))
+
+        return orig_iat
+
+
+class RevokeJSONWebTokenSerializer(TokenCheckMixin, VerificationBaseSerializer):
+    """
+    Revokes a valid access token, e.g. on logout.
+    """
+
+    def validate(self, attrs):
+        payload = self._check_payload(token=attrs['token'])
+        user = self._check_user(payload=payload)
+        if 'jti' not in payload:
+            raise serializers.ValidationError(_('Token cannot be revoked.'))
+
+        revoke_token(payload)
+        return {
+            'token': attrs['token'],
+            'user': user,
+        }
+
+
+class BatchVerifyJSONWebTokenSerializer(serializers.Serializer):
+    """
+    Checks the veracity of many access tokens at once, with the checks of
+    `VerifyJSONWebTokenSerializer`. Each distinct token is decoded once and
+    the owners of all tokens are fetched with a single query; revocation is
+    checked in memory.
+    """
+    tokens = serializers.ListField(child=serializers.CharField())
+
+    def validate_tokens(self, tokens):
+        if not tokens:
+            raise serializers.ValidationError(_('Provide at least one token.'))
+
+        max_tokens = app_settings.BATCH_VERIFY_MAX_TOKENS
+        if len(tokens) > max_tokens:
+            raise serializers.ValidationError(
+                _('Provide at most %d tokens.') % max_tokens
+            )
+
+        return tokens
+
+    def validate(self, attrs):
+        decode = api_settings.JWT_DECODE_HANDLER
+        get_username = api_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER
+
+        # Token -> verified payload or error message, in first seen order.
+        outcomes = OrderedDict()
+        for token in attrs['tokens']:
+            if token in outcomes:
+                continue
+
+            try:
+                outcomes[token] = decode(token)
+            except jwt.ExpiredSignature:
+                outcomes[token] = _('Signature has expired.')
+            except jwt.DecodeError:
+                outcomes[token] = _('Error decoding signature.')
+            except jwt.InvalidTokenError:
+                # A wrong algorithm, or an invalid `iat`, `aud` or `iss`.
+                outcomes[token] = _('Invalid token.')
+
+        usernames = set()
+        for token, payload in outcomes.items():
+            if not isinstance(payload, dict):
+                continue
+
+            username = get_username(payload)
+            if username:
+                usernames.add(username)
+            else:
+                outcomes[token] = _('Invalid payload.')
+
+        active_by_username = {}
+        if usernames:
+            active_by_username = dict(
+                User.objects
+                .filter(**{'%s__in' % User.USERNAME_FIELD: usernames})
+                .values_list(User.USERNAME_FIELD, 'is_active')
+            )
+
+        results = {}
+        for token, payload in outcomes.items():
+            if not isinstance(payload, dict):
+                results[token] = {'valid': False, 'error': payload}
+                continue
+
+            is_active = active_by_username.get(get_username(payload))
+            if is_active is None:
+                results[token] = {'valid': False, 'error': _("User doesn't exist.")}
+            elif not is_active:
+                results[token] = {'valid': False, 'error': _('User account is disabled.')}
+            elif is_revoked(payload):
+                results[token] = {'valid': False, 'error': _('Token has been revoked.')}
+            else:
+                results[token] = {'valid': True, 'payload': payload}
+
+        return {
+            'results': [results[token] for token in attrs['tokens']],
+        }
+
+
+class BatchPermissionCheckSerializer(serializers.Serializer):
+    """
+    Validates a list of `[user_id, organization_id, permission_name]`
+    checks, `organization_id` being `null` to check across organizations.
+    """
+    checks = serializers.ListField(child=serializers.ListField())
+
+    def validate_checks(self, checks):
+        if not checks:
+            raise serializers.ValidationError(_('Provide at least one check.'))
+
+        max_checks = app_settings.BATCH_PERMISSION_CHECK_MAX_CHECKS
+        if len(checks) > max_checks:
+            raise serializers.ValidationError(
+                _('Provide at most %d checks.') % max_checks
+            )
+
+        message = _('Each check must be [user_id, organization_id, permission_name].')
+
+        validated = []
+        for check in checks:
+            if len(check) != 3:
+                raise serializers.ValidationError(message)
+
+            user_id, organization_id, permission_name = check
+            if not (
+                is_id(user_id) and
+                (organization_id is None or is_id(organization_id)) and
+                isinstance(permission_name, six.string_types)
+            ):
+                raise serializers.ValidationError(message)
+
+            validated.append((user_id, organization_id, permission_name))
+        return validated
+
+
+def is_id(value):
+    return isinstance(value, six.integer_types) and not isinstance(value, bool)
@@ -0,0 +1,126 @@
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .catalogue import invalidate_catalogue
+from .hierarchy import organization_index
+from .models import (
+    Organization,
+    Permission,
+    Role,
+    RolePermissionAssociation,
+    OrganizationTreeGeneration,
+    PermissionCatalogueGeneration,
+    RoleUserOrgAssociation,
+    User,
+)
+from .revocation import revoke_user_tokens
+
+
+@receiver(pre_save, sender=RoleUserOrgAssociation)
+def invalidate_previous_association_user(sender, instance, **kwargs):
+    # An existing association may be re-pointed to another user, in which
+    # case the previous user loses the role.
+    if instance.pk is not None:
+        User.objects.bump_authorization_version(roleuserorgassociation__pk=instance.pk)
+
+
+@receiver(post_save, sender=RoleUserOrgAssociation)
+@receiver(post_delete, sender=RoleUserOrgAssociation)
+def invalidate_association_user(sender, instance, **kwargs):
+    User.objects.bump_authorization_version(pk=instance.user_id)
+
+
+@receiver(pre_save, sender=RoleUserOrgAssociation)
+def revoke_previous_association_user_tokens(sender, instance, **kwargs):
+    # Re-pointing an association to another user, role or organization
+    # takes the previous role away from the previous user.
+    if instance.pk is None:
+        return
+
+    previous = (
+        RoleUserOrgAssociation.objects
+        .filter(pk=instance.pk)
+        .values_list('user_id', 'role_id', 'organization_id')
+        .first()
+    )
+    if previous is not None and previous != (instance.user_id, instance.role_id, instance.organization_id):
+        revoke_user_tokens(previous[0])
+
+
+@receiver(post_delete, sender=RoleUserOrgAssociation)
+def revoke_association_user_tokens(sender, instance, **kwargs):
+    # The user lost the role, which their tokens still grant.
+    revoke_user_tokens(instance.user_id)
+
+
+@receiver(pre_save, sender=User)
+def revoke_deactivated_user_tokens(sender, instance, **kwargs):
+    if instance.pk is None or instance.is_active:
+        return
+
+    if User.objects.filter(pk=instance.pk, is_active=True).exists():
+        revoke_user_tokens(instance.pk)
+
+
+@receiver(pre_save, sender=RolePermissionAssociation)
+def invalidate_previous_permission_role_users(sender, instance, **kwargs):
+    if instance.pk is not None:
+        User.objects.bump_authorization_version(
+            roleuserorgassociation__role__rolepermissionassociation__pk=instance.pk,
+        )
+
+
+@receiver(post_save, sender=RolePermissionAssociation)
+@receiver(post_delete, sender=RolePermissionAssociation)
+def invalidate_permission_role_users(sender, instance, **kwargs):
+    User.objects.bump_authorization_version(roleuserorgassociation__role_id=instance.role_id)
+
+
+@receiver(post_save, sender=Role)
+def invalidate_role_users(sender, instance, **kwargs):
+    User.objects.bump_authorization_version(roleuserorgassociation__role_id=instance.pk)
+
+
+@receiver(post_save, sender=Permission)
+def invalidate_permission_users(sender, instance, **kwargs):
+    User.objects.bump_authorization_version(
+        roleuserorgassociation__role__rolepermissionassociation__permission_id=instance.pk,
+    )
+
+
+@receiver(post_save, sender=Organization)
+def invalidate_organization_users(sender, instance, **kwargs):
+    User.objects.bump_authorization_version(roleuserorgassociation__organization_id=instance.pk)
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+@receiver(post_save, sender=RolePermissionAssociation)
+@receiver(post_delete, sender=RolePermissionAssociation)
+def reload_permission_catalogue(sender, **kwargs):
+    # Other processes notice the new generation on their next check.
+    PermissionCatalogueGeneration.objects.bump()
+    invalidate_catalogue()
+
+
+@receiver(post_save, sender=Organization)
+def update_organization_index(sender, instance, using, created, **kwargs):
+    if created or instance.parent_id != instance._saved_parent_id:
+        # Other processes notice the new generation on their next check.
+        OrganizationTreeGeneration.objects.bump()
+
+    # Only once committed: `Organization.save()` rolls back refused moves.
+    organization_id, parent_id = instance.pk, instance.parent_id
+    transaction.on_commit(lambda: organization_index.update(organization_id, parent_id), using=using)
+
+
+@receiver(post_delete, sender=Organization)
+def remove_from_organization_index(sender, instance, using, **kwargs):
+    OrganizationTreeGeneration.objects.bump()
+    organization_id = instance.pk
+    transaction.on_commit(lambda: organization_index.remove(organization_id), using=using)
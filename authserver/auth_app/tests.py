@@ -1,3 +1,1998 @@
-from django.test import TestCase
+import json
+import logging
+import sys
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from collections import OrderedDict
+from datetime import timedelta
 
-# Create your tests here.
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.signals import user_logged_in, user_login_failed
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.settings import api_settings
+
+from . import catalogue, instrumentation
+from .backends import HashingPoolModelBackend
+from .catalogue import (
+    PermissionCatalogue,
+    decode_bitset,
+    encode_bitset,
+    get_catalogue,
+    invalidate_catalogue,
+)
+from .db.backends.sqlite3.base import DatabaseWrapper as PooledSQLiteDatabaseWrapper
+from .db.pool import ConnectionPool, PoolTimeout, get_pool
+from .hashers import PasswordHashingPool, PasswordHashingUnavailable, get_hashing_pool
+from .hierarchy import has_organization_permission, organization_index
+from .management.commands.sync_sqlite_replica import sync_database
+from .middleware import ReplicaPinningMiddleware
+from .models import (
+    AuthorizationSnapshot,
+    Organization,
+    OrganizationClosure,
+    OrganizationTreeGeneration,
+    Permission,
+    PermissionCatalogueGeneration,
+    Role,
+    RolePermissionAssociation,
+    RoleUserOrgAssociation,
+    TokenEpoch,
+    User,
+)
+from .permissions import JWTPermission, check_permissions
+from .revocation import (
+    get_revocation_list,
+    get_tokens_expire_at,
+    invalidate_revocation_list,
+    is_revoked,
+    revoke_user_tokens,
+)
+from .routers import ReplicaRouter, get_read_database, reset_pinning
+from .serializers import (
+    BatchVerifyJSONWebTokenSerializer,
+    OrganizationSerializer,
+    PermissionSerializer,
+    RefreshJSONWebTokenSerializer,
+    RevokeJSONWebTokenSerializer,
+    RoleSerializer,
+    UserSerializer,
+    VerifyJSONWebTokenSerializer,
+    user_row_serializer,
+)
+from .utils.bloom import BloomFilter
+from .utils.cache import SharedCache, TTLCache
+from .utils.jwt import (
+    get_authorization_claims,
+    get_organization_permission_names,
+    get_permission_names,
+    jwt_decode_handler,
+    jwt_encode_handler,
+    jwt_payload_handler,
+    shared_authorization_cache,
+)
+from .utils.keys import KeyRing, SigningKey, get_key_ring
+from .views import ResourceAPIView, UserList
+
+
+def reset_authorization_state():
+    """
+    Drops the process-local catalogue and organization index and the shared
+    authorization data,
+    which would otherwise outlive the rolled back rows of previous tests
+    whose IDs and authorization versions get reused.
+    """
+    invalidate_catalogue()
+    organization_index.invalidate()
+    caches[settings.AUTH_APP['CACHE_ALIAS']].clear()
+    invalidate_revocation_list()
+
+
+class AuthorizationDataTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        clinic = Organization.objects.create(name='ABC Clinic Group')
+        cls.branch_1 = Organization.objects.create(name='Indiranagar Branch', parent=clinic)
+        cls.branch_2 = Organization.objects.create(name='Koramangala Branch', parent=clinic)
+
+        permissions = {}
+        for name in ('Patient-GET', 'Patient-POST', 'Patient-PUT', 'Patient-DELETE', 'Users-GET'):
+            permissions[name] = Permission.objects.create(name=name, description='Allows %s' % name)
+
+        roles = {}
+        for name, permission_names in (
+            ('Clinic-Doctor', ('Patient-PUT', 'Patient-GET', 'Patient-POST')),
+            ('Chat-Doctor', ('Patient-GET', 'Patient-DELETE')),
+            ('Clinic-Assistant', ('Users-GET',)),
+        ):
+            roles[name] = Role.objects.create(name=name, description='The %s role' % name)
+            for permission_name in permission_names:
+                RolePermissionAssociation.objects.create(
+                    role=roles[name],
+                    permission=permissions[permission_name],
+                )
+
+        cls.doctor = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+        for role_name, organization in (
+            ('Chat-Doctor', cls.branch_2),
+            ('Clinic-Doctor', cls.branch_1),
+            ('Chat-Doctor', cls.branch_1),
+            ('Clinic-Assistant', cls.branch_2),
+        ):
+            RoleUserOrgAssociation.objects.create(
+                user=cls.doctor,
+                role=roles[role_name],
+                organization=organization,
+            )
+
+        User.objects.create_user('patient@example.com', 'password', name='Patient')
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_user_row_serializer_matches_user_serializer(self):
+        users = User.objects.order_by('id')
+        rows = users.values(*user_row_serializer.values_fields)
+
+        self.assertEqual(
+            self.render(user_row_serializer.to_representation_many(rows)),
+            self.render(UserSerializer(users, many=True).data),
+        )
+        self.assertEqual(
+            self.render(user_row_serializer.to_representation(rows[0])),
+            self.render(UserSerializer(users[0]).data),
+        )
+
+    def serialize_organizations(self, user):
+        associations = RoleUserOrgAssociation.objects.filter(user=user).order_by('id')
+
+        organizations = OrderedDict()
+        for association in associations:
+            try:
+                organization = organizations[association.organization_id]
+            except KeyError:
+                organization = organizations[association.organization_id] = OrganizationSerializer(
+                    association.organization,
+                ).data
+                organization['roles'] = []
+            organization['roles'].append(RoleSerializer(association.role).data)
+        return list(organizations.values())
+
+    def test_build_authorization_data_matches_serializers(self):
+        self.doctor.build_authorization_data()
+
+        # The catalogue generation check and the user's associations.
+        with self.assertNumQueries(2):
+            data = self.doctor.build_authorization_data()
+
+        self.assertEqual(
+            json.dumps(data['organizations']),
+            json.dumps(self.serialize_organizations(self.doctor)),
+        )
+        self.assertEqual(
+            json.dumps(data['permissions']),
+            json.dumps(PermissionSerializer(self.doctor.get_permissions(), many=True).data),
+        )
+
+    def test_get_permissions(self):
+        with self.assertNumQueries(1):
+            permissions = list(self.doctor.get_permissions())
+
+        self.assertEqual(
+            [permission.name for permission in permissions],
+            ['Patient-GET', 'Patient-POST', 'Patient-PUT', 'Patient-DELETE', 'Users-GET'],
+        )
+        self.assertEqual(
+            list(self.doctor.get_permissions(names_only=True)),
+            [permission.name for permission in permissions],
+        )
+
+    def test_build_authorization_data_without_roles(self):
+        patient = User.objects.get(email='patient@example.com')
+
+        self.assertEqual(patient.build_authorization_data(), {
+            'organizations': [],
+            'permissions': [],
+        })
+
+
+class CompactPermissionsTestCase(SimpleTestCase):
+
+    def make_catalogue(self, permission_ids):
+        return PermissionCatalogue(
+            [{'id': n, 'name': 'Permission-%d' % n, 'description': ''} for n in permission_ids],
+            [],
+        )
+
+    def test_bitset_round_trip(self):
+        for ids in ([], [0], [7], [8], [0, 1, 9, 15, 16, 63, 64, 1000]):
+            self.assertEqual(decode_bitset(encode_bitset(ids)), ids)
+
+        self.assertEqual(decode_bitset(encode_bitset([1, 5, 20]), limit=6), [1, 5])
+
+    def test_bitset_decodes_in_linear_time(self):
+        encoded = encode_bitset(range(0, 800000, 7))
+        self.assertEqual(len(decode_bitset(encoded)), len(range(0, 800000, 7)))
+
+    def test_sparse_high_ids(self):
+        catalogue = self.make_catalogue([3, 100000, 5000000])
+
+        encoded = catalogue.encode_permissions([100000, 5000000, 42])
+        # One byte, whatever the IDs.
+        self.assertEqual(encoded, 'Bg')
+        self.assertEqual(
+            [catalogue.permission_ids[position] for position in decode_bitset(encoded)],
+            [100000, 5000000],
+        )
+
+    def test_permission_version(self):
+        permissions = [{'id': n, 'name': 'Permission-%d' % n, 'description': ''} for n in (1, 2)]
+        current = PermissionCatalogue(permissions, [{'id': 1, 'permissions': [1]}])
+
+        # Editing roles moves no bit.
+        edited = PermissionCatalogue(permissions, [{'id': 1, 'permissions': [1, 2]}])
+        self.assertNotEqual(edited.version, current.version)
+        self.assertEqual(edited.permission_version, current.permission_version)
+
+        renamed = PermissionCatalogue([dict(permissions[0], name='Renamed')] + permissions[1:], [])
+        self.assertEqual(renamed.permission_version, current.permission_version)
+
+        self.assertNotEqual(self.make_catalogue([1, 2, 3]).permission_version, current.permission_version)
+
+
+@override_settings(AUTH_APP=dict(settings.AUTH_APP, TOKEN_FORMAT='compact'))
+class CompactTokenTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        clinic = Organization.objects.create(name='ABC Clinic Group')
+        cls.branch = Organization.objects.create(name='Indiranagar Branch', parent=clinic)
+        cls.users_get = Permission.objects.create(name='Users-GET', description='Allows Users-GET')
+        cls.patient_get = Permission.objects.create(name='Patient-GET', description='Allows Patient-GET')
+        cls.role = Role.objects.create(name='Clinic-Assistant', description='The Clinic-Assistant role')
+        cls.role_permission = RolePermissionAssociation.objects.create(role=cls.role, permission=cls.users_get)
+        cls.user = User.objects.create_user('assistant@abcclinic.com', 'password', name='Assistant')
+        RoleUserOrgAssociation.objects.create(user=cls.user, role=cls.role, organization=cls.branch)
+
+    def setUp(self):
+        reset_authorization_state()
+
+    def get(self, url, token):
+        return self.client.get(url, HTTP_AUTHORIZATION='JWT %s' % token)
+
+    def forget_catalogue_versions(self):
+        # As in a process that never loaded the catalogue.
+        invalidate_catalogue()
+        catalogue._permission_ids_by_version.clear()
+
+    def assertGrants(self, payload, names):
+        payload = dict(payload)
+        self.assertEqual(get_permission_names(payload), frozenset(names))
+        self.assertEqual(get_organization_permission_names(payload), {self.branch.pk: frozenset(names)})
+
+    def test_compact_token(self):
+        payload = jwt_payload_handler(self.user)
+        token = jwt_encode_handler(payload)
+
+        self.assertNotIn('permissions', payload)
+        self.assertGrants(payload, ['Users-GET'])
+        self.assertEqual(self.get('/api/users/', token).status_code, 200)
+
+        response = self.get('/api/permissions/catalogue/', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['permission_version'], payload['pcv'])
+        self.assertEqual(
+            [permission['id'] for permission in response.data['permissions']],
+            [self.users_get.pk, self.patient_get.pk],
+        )
+
+    def test_role_edits_apply_to_new_tokens(self):
+        payload = jwt_payload_handler(self.user)
+        version = get_catalogue().version
+
+        RolePermissionAssociation.objects.filter(pk=self.role_permission.pk).delete()
+        RolePermissionAssociation.objects.create(role=self.role, permission=self.patient_get)
+        self.forget_catalogue_versions()
+
+        # Both the permissions and the organization grants are those of
+        # when the token was issued.
+        self.assertNotEqual(get_catalogue().version, version)
+        self.assertEqual(get_catalogue().permission_version, payload['pcv'])
+        self.assertGrants(payload, ['Users-GET'])
+        self.assertEqual(self.get('/api/users/', jwt_encode_handler(payload)).status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertGrants(jwt_payload_handler(self.user), ['Patient-GET'])
+
+    def test_decode_previous_version(self):
+        payload = jwt_payload_handler(self.user)
+
+        Permission.objects.filter(pk=self.patient_get.pk).delete()
+        Permission.objects.create(name='Patient-PUT', description='Allows Patient-PUT')
+        self.forget_catalogue_versions()
+
+        self.assertNotEqual(get_catalogue().permission_version, payload['pcv'])
+        self.assertGrants(payload, ['Users-GET'])
+
+        token = jwt_encode_handler(payload)
+        self.assertEqual(self.get('/api/users/', token).status_code, 200)
+        self.assertEqual(self.get('/api/permissions/catalogue/', token).status_code, 200)
+
+    def test_unknown_version(self):
+        payload = jwt_payload_handler(self.user)
+        payload['pcv'] = 'unknown'
+
+        response = self.get('/api/users/', jwt_encode_handler(payload))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Token was issued against an unknown permission catalogue.')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Uses SQLite EXPLAIN QUERY PLAN.')
+class AssociationQueryPlanTestCase(TestCase):
+    """
+    Checks that the hot authorization queries read the association tables
+    through covering indexes only, never scanning them.
+    """
+    association_tables = ('roles_users_org', 'roles_permissions')
+
+    @classmethod
+    def setUpTestData(cls):
+        organization = Organization.objects.create(name='ABC Clinic Group')
+        permission = Permission.objects.create(name='Patient-GET', description='Allows Patient-GET')
+        role = Role.objects.create(name='Clinic-Doctor', description='The Clinic-Doctor role')
+        RolePermissionAssociation.objects.create(role=role, permission=permission)
+
+        cls.user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+        RoleUserOrgAssociation.objects.create(user=cls.user, role=role, organization=organization)
+
+    def get_query_plans(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                cursor.execute('EXPLAIN QUERY PLAN %s' % query['sql'])
+                plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertCoveredAssociationLookups(self, func):
+        plans = self.get_query_plans(func)
+
+        checked = 0
+        for sql, details in plans:
+            # Subqueries refer to the tables by alias.
+            names = set(self.association_tables)
+            for table in self.association_tables:
+                names.update(re.findall(r'"%s" (?:AS )?"?(\w+)' % table, sql))
+
+            for detail in details:
+                match = re.match(r'(SCAN|SEARCH)( TABLE)? (\w+)', detail)
+                if match is None or match.group(3) not in names:
+                    continue
+
+                checked += 1
+                self.assertEqual(match.group(1), 'SEARCH', '%s\n%s' % (sql, detail))
+                self.assertIn('USING COVERING INDEX', detail, '%s\n%s' % (sql, detail))
+
+        self.assertTrue(checked, 'No association table lookups in %r' % plans)
+
+    def test_get_permissions(self):
+        self.assertCoveredAssociationLookups(lambda: list(self.user.get_permissions()))
+
+    def test_build_authorization_data(self):
+        # Loading the catalogue reads the whole of the (small) role tables.
+        get_catalogue()
+        self.assertCoveredAssociationLookups(self.user.build_authorization_data)
+
+    def test_check_permissions(self):
+        self.assertCoveredAssociationLookups(
+            lambda: check_permissions([(self.user.pk, None, 'Patient-GET')])
+        )
+
+
+class OrganizationClosureTestCase(TestCase):
+
+    def setUp(self):
+        self.clinic = Organization.objects.create(name='ABC Clinic Group')
+        self.branch_1 = Organization.objects.create(name='Indiranagar Branch', parent=self.clinic)
+        self.branch_2 = Organization.objects.create(name='Koramangala Branch', parent=self.clinic)
+        self.ward = Organization.objects.create(name='Pediatrics Ward', parent=self.branch_1)
+        self.bed = Organization.objects.create(name='Bed 1', parent=self.ward)
+
+    def ancestors(self, organization):
+        return [ancestor.name for ancestor in Organization.objects.ancestors(organization)]
+
+    def descendants(self, organization):
+        return [descendant.name for descendant in Organization.objects.descendants(organization)]
+
+    def assertClosureComplete(self):
+        # Recompute the closure from the parent links and compare.
+        parents = dict(Organization.objects.values_list('id', 'parent_id'))
+        expected = set()
+        for organization_id in parents:
+            ancestor_id, depth = organization_id, 0
+            while ancestor_id is not None:
+                expected.add((ancestor_id, organization_id, depth))
+                ancestor_id, depth = parents[ancestor_id], depth + 1
+
+        self.assertEqual(
+            set(OrganizationClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')),
+            expected,
+        )
+
+    def test_insert_node(self):
+        self.assertEqual(self.ancestors(self.bed), ['Pediatrics Ward', 'Indiranagar Branch', 'ABC Clinic Group'])
+        self.assertEqual(
+            self.descendants(self.clinic),
+            ['Indiranagar Branch', 'Koramangala Branch', 'Pediatrics Ward', 'Bed 1'],
+        )
+        self.assertEqual(
+            self.descendants(self.branch_1),
+            ['Pediatrics Ward', 'Bed 1'],
+        )
+        self.assertClosureComplete()
+
+    def test_move_subtree(self):
+        self.ward.parent = self.branch_2
+        self.ward.save()
+
+        self.assertEqual(self.ancestors(self.bed), ['Pediatrics Ward', 'Koramangala Branch', 'ABC Clinic Group'])
+        self.assertEqual(self.descendants(self.branch_1), [])
+        self.assertEqual(self.descendants(self.branch_2), ['Pediatrics Ward', 'Bed 1'])
+
+        # Detach the subtree into a tree of its own.
+        self.ward.parent = None
+        self.ward.save()
+
+        self.assertEqual(self.ancestors(self.bed), ['Pediatrics Ward'])
+        self.assertEqual(self.descendants(self.clinic), ['Indiranagar Branch', 'Koramangala Branch'])
+        self.assertClosureComplete()
+
+    def test_refuse_cycle(self):
+        self.branch_1.parent = self.bed
+        with self.assertRaises(ValueError):
+            self.branch_1.save()
+
+        self.assertEqual(Organization.objects.get(pk=self.branch_1.pk).parent_id, self.clinic.pk)
+        self.assertEqual(self.descendants(self.branch_1), ['Pediatrics Ward', 'Bed 1'])
+        self.assertClosureComplete()
+
+    def test_delete_node(self):
+        self.ward.delete()
+
+        self.assertFalse(Organization.objects.filter(name__in=['Pediatrics Ward', 'Bed 1']).exists())
+        self.assertEqual(self.descendants(self.clinic), ['Indiranagar Branch', 'Koramangala Branch'])
+        self.assertClosureComplete()
+
+
+class BulkLoadTestCase(TestCase):
+
+    def setUp(self):
+        scripts_dir = os.path.join(os.path.dirname(settings.BASE_DIR), 'scripts')
+        sys.path.insert(0, scripts_dir)
+        self.addCleanup(sys.path.remove, scripts_dir)
+
+        from initialize_data import bulk_load
+        self.bulk_load = bulk_load
+
+        self.existing = User.objects.create_user('owner@abcclinic.com', 'password', name='Owner')
+
+    def load(self):
+        self.bulk_load({
+            'permissions': [{'name': 'Patient-GET', 'description': 'Allows Patient-GET'}],
+            # Children listed before their parents.
+            'organizations': [
+                {'name': 'Pediatrics Ward', 'parent': 'Indiranagar Branch'},
+                {'name': 'Indiranagar Branch', 'parent': 'ABC Clinic Group'},
+                {'name': 'ABC Clinic Group', 'parent': None},
+            ],
+            'roles': [
+                {'name': 'Clinic-Doctor', 'description': 'The Clinic-Doctor role', 'permissions': ['patient-get']},
+                {'name': 'Clinic-Owner', 'description': 'The Clinic-Owner role', 'permissions': ['Patient-PUT']},
+            ],
+            'users': [
+                {
+                    'email': 'doctor@abcclinic.com',
+                    'name': 'Doctor',
+                    'password': 'secret',
+                    'roles': [
+                        {'role': 'Clinic-Doctor', 'organization': 'Pediatrics Ward'},
+                        {'role': 'Clinic-Doctor', 'organization': 'Indiranagar Branch'},
+                    ],
+                },
+                {
+                    'email': 'owner@abcclinic.com',
+                    'name': 'Owner',
+                    'password': 'ignored',
+                    'roles': [{'role': 'Clinic-Owner', 'organization': 'ABC Clinic Group'}],
+                },
+            ],
+        }, workers=1)
+
+    def test_bulk_load(self):
+        self.load()
+
+        self.assertEqual(
+            sorted(Permission.objects.values_list('name', flat=True)),
+            ['Patient-GET', 'Patient-PUT'],
+        )
+        clinic = Organization.objects.get(name='ABC Clinic Group')
+        branch = Organization.objects.get(name='Indiranagar Branch', parent=clinic)
+        ward = Organization.objects.get(name='Pediatrics Ward', parent=branch)
+        self.assertEqual(set(OrganizationClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')), {
+            (clinic.pk, clinic.pk, 0),
+            (branch.pk, branch.pk, 0),
+            (ward.pk, ward.pk, 0),
+            (clinic.pk, branch.pk, 1),
+            (branch.pk, ward.pk, 1),
+            (clinic.pk, ward.pk, 2),
+        })
+
+        doctor = User.objects.get(email='doctor@abcclinic.com')
+        self.assertNotEqual(doctor.password, 'secret')
+        self.assertTrue(doctor.check_password('secret'))
+        self.assertEqual(
+            set(RoleUserOrgAssociation.objects.filter(user=doctor).values_list('role__name', 'organization_id')),
+            {('Clinic-Doctor', ward.pk), ('Clinic-Doctor', branch.pk)},
+        )
+
+        # Existing users keep their password and get their new roles.
+        owner = User.objects.get(pk=self.existing.pk)
+        self.assertTrue(owner.check_password('password'))
+        self.assertEqual(owner.authorization_version, self.existing.authorization_version + 1)
+        self.assertEqual(
+            list(RoleUserOrgAssociation.objects.filter(user=owner).values_list('role__name', 'organization_id')),
+            [('Clinic-Owner', clinic.pk)],
+        )
+
+        self.assertEqual(PermissionCatalogueGeneration.objects.current(), 1)
+        self.assertEqual(OrganizationTreeGeneration.objects.current(), 1)
+
+    def count_rows(self):
+        return [model.objects.count() for model in (
+            Permission, Organization, OrganizationClosure, Role, RolePermissionAssociation, User,
+            RoleUserOrgAssociation,
+        )]
+
+    def test_load_twice(self):
+        self.load()
+        counts = self.count_rows()
+
+        self.load()
+        self.assertEqual(self.count_rows(), counts)
+        self.assertEqual(PermissionCatalogueGeneration.objects.current(), 1)
+        self.assertEqual(OrganizationTreeGeneration.objects.current(), 1)
+
+
+class OrganizationIndexTestCase(TransactionTestCase):
+    """
+    The index is updated once the organization changes are committed, so
+    these tests run outside of a test transaction.
+    """
+
+    def setUp(self):
+        self.clinic = Organization.objects.create(name='ABC Clinic Group')
+        self.branch = Organization.objects.create(name='Indiranagar Branch', parent=self.clinic)
+        self.ward = Organization.objects.create(name='Pediatrics Ward', parent=self.branch)
+        organization_index.load()
+        self.addCleanup(organization_index.load)
+
+    def test_permissions_inherited_from_ancestors(self):
+        organization_permissions = {
+            self.clinic.pk: frozenset(['Patient-GET']),
+            self.branch.pk: frozenset(['Patient-PUT']),
+        }
+
+        for organization, permission_name, granted in (
+            (self.ward, 'Patient-GET', True),
+            (self.ward, 'Patient-PUT', True),
+            (self.branch, 'Patient-GET', True),
+            (self.clinic, 'Patient-PUT', False),
+            (self.ward, 'Patient-DELETE', False),
+        ):
+            self.assertEqual(
+                has_organization_permission(organization_permissions, organization.pk, permission_name),
+                granted,
+                (organization.name, permission_name),
+            )
+
+    def test_index_follows_committed_changes(self):
+        self.ward.parent = self.clinic
+        self.ward.save()
+        self.assertEqual(organization_index.ancestors(self.ward.pk), (self.ward.pk, self.clinic.pk))
+        self.assertEqual(organization_index.descendants(self.branch.pk), frozenset([self.branch.pk]))
+
+        self.branch.delete()
+        self.assertEqual(
+            organization_index.descendants(self.clinic.pk),
+            frozenset([self.clinic.pk, self.ward.pk]),
+        )
+
+    def test_refused_cycle_leaves_index_unchanged(self):
+        self.clinic.parent = self.ward
+        with self.assertRaises(ValueError):
+            self.clinic.save()
+
+        self.assertIsNone(Organization.objects.get(pk=self.clinic.pk).parent_id)
+        self.assertEqual(organization_index.ancestors(self.clinic.pk), (self.clinic.pk,))
+        self.assertFalse(has_organization_permission(
+            {self.ward.pk: frozenset(['Patient-GET'])}, self.clinic.pk, 'Patient-GET',
+        ))
+
+
+class TTLCacheTestCase(SimpleTestCase):
+
+    def test_entries_expire(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set('expired', 1, expires_at=time.time() - 1)
+        cache.set('current', 2, expires_at=time.time() + 60)
+
+        self.assertIsNone(cache.get('expired'))
+        self.assertEqual(cache.get('current'), 2)
+
+        # The TTL caps later deadlines.
+        cache = TTLCache(max_size=10, ttl=0)
+        cache.set('key', 1, expires_at=time.time() + 60)
+        self.assertIsNone(cache.get('key'))
+
+    def test_least_recently_used_evicted(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {
+            'size': 2,
+            'max_size': 2,
+            'hits': 3,
+            'misses': 1,
+            'evictions': 1,
+        })
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'authorization': {
+        'BACKEND': 'auth_app.cache_backends.RedisCache',
+        'LOCATION': 'memory://tests?max_keys=3',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'auth_app.cache_backends.InProcessRedisClient',
+        },
+    },
+})
+class SharedCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = caches['authorization']
+        self.cache.clear()
+
+    def test_redis_backend(self):
+        self.cache.set('a', {'id': 1})
+        self.assertEqual(self.cache.get('a'), {'id': 1})
+        self.assertFalse(self.cache.add('a', 'other'))
+        self.assertTrue(self.cache.add('b', None))
+        self.assertTrue(self.cache.has_key('b'))
+        self.assertIsNone(self.cache.get('b', 'default'))
+
+        self.cache.set('a', 'expired', 0)
+        self.assertEqual(self.cache.get('a', 'default'), 'default')
+
+        evictions = self.cache.get_stats()['evictions']
+        for key in ('c', 'd', 'e', 'f'):
+            self.cache.set(key, key)
+        self.assertEqual(self.cache.get_stats(), {'keys': 3, 'evictions': evictions + 2})
+        self.assertFalse(self.cache.has_key('b'))
+
+    def test_get_or_compute_waits_for_other_worker(self):
+        shared = SharedCache('test')
+        key = shared.make_key('value')
+
+        # Another worker is computing the value and stores it shortly.
+        self.assertTrue(self.cache.add('%s:lock' % key, True, 5, version=shared.key_version))
+        threading.Timer(0.05, shared.set, (key, 'computed elsewhere')).start()
+
+        def compute():
+            raise AssertionError('Computed twice.')
+
+        self.assertEqual(shared.get_or_compute(key, compute), 'computed elsewhere')
+
+    def test_authorization_data_keyed_by_version(self):
+        organization = Organization.objects.create(name='ABC Clinic Group')
+        role = Role.objects.create(name='Clinic-Doctor', description='The Clinic-Doctor role')
+        user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+
+        self.assertEqual(jwt_payload_handler(User.objects.get(pk=user.pk))['organizations'], [])
+
+        user = User.objects.get(pk=user.pk)
+        # Only the user's token epoch.
+        with self.assertNumQueries(1):
+            jwt_payload_handler(user)
+
+        RoleUserOrgAssociation.objects.create(user=user, role=role, organization=organization)
+        payload = jwt_payload_handler(User.objects.get(pk=user.pk))
+        self.assertEqual([o['id'] for o in payload['organizations']], [organization.pk])
+
+    def test_lagging_data_not_shared(self):
+        user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+        user = User.objects.get(pk=user.pk)
+
+        # The primary is a version ahead of the replica the data is read from.
+        user.authorization_version += 1
+        self.assertEqual(get_authorization_claims(user)['av'], user.authorization_version - 1)
+        self.assertIsNone(shared_authorization_cache.get(
+            shared_authorization_cache.make_key(user.pk, user.authorization_version),
+        ))
+
+    def test_get_or_compute_after_lock_released_without_value(self):
+        shared = SharedCache('test')
+        key = shared.make_key('value')
+
+        # Another worker computed a value it did not store.
+        lock_key = '%s:lock' % key
+        self.assertTrue(self.cache.add(lock_key, True, 5, version=shared.key_version))
+        threading.Timer(0.05, self.cache.delete, (lock_key,), {'version': shared.key_version}).start()
+
+        started = time.time()
+        self.assertEqual(shared.get_or_compute(key, lambda: 'computed', is_cacheable=lambda value: False), 'computed')
+        self.assertLess(time.time() - started, 1)
+        self.assertIsNone(shared.get(key))
+
+
+class LaggingReplicaTestCase(TestCase):
+    """
+    Reads authorization data with a replica that only has the rows copied
+    to it explicitly.
+    """
+
+    def setUp(self):
+        reset_authorization_state()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, 'replica.sqlite3'),
+        }
+        self.addCleanup(self.remove_replica)
+        with connections['replica'].schema_editor() as editor:
+            editor.create_model(User)
+            editor.create_model(AuthorizationSnapshot)
+
+        self.organization = Organization.objects.create(name='ABC Clinic Group')
+        self.role = Role.objects.create(name='Clinic-Doctor', description='The Clinic-Doctor role')
+        self.user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+
+    def remove_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        reset_pinning()
+
+    def replicate_user(self):
+        User.objects.using('replica').filter(pk=self.user.pk).delete()
+        User.objects.using('replica').bulk_create([User.objects.get(pk=self.user.pk)])
+
+    def get_authorization_claims(self):
+        with override_settings(AUTH_APP=dict(settings.AUTH_APP, READ_REPLICAS=['replica'])):
+            reset_pinning()
+            return get_authorization_claims(User.objects.get(pk=self.user.pk))
+
+    def test_role_granted_after_replication(self):
+        self.replicate_user()
+        RoleUserOrgAssociation.objects.create(user=self.user, role=self.role, organization=self.organization)
+
+        claims = self.get_authorization_claims()
+        self.assertEqual(claims['av'], User.objects.get(pk=self.user.pk).authorization_version)
+        self.assertEqual([organization['id'] for organization in claims['organizations']], [self.organization.pk])
+
+    def test_role_revoked_after_replication(self):
+        association = RoleUserOrgAssociation.objects.create(
+            user=self.user,
+            role=self.role,
+            organization=self.organization,
+        )
+        self.replicate_user()
+        association.delete()
+
+        claims = self.get_authorization_claims()
+        self.assertEqual(claims['av'], User.objects.get(pk=self.user.pk).authorization_version)
+        self.assertEqual(claims['organizations'], [])
+
+    def test_user_not_replicated_yet(self):
+        RoleUserOrgAssociation.objects.create(user=self.user, role=self.role, organization=self.organization)
+
+        claims = self.get_authorization_claims()
+        self.assertEqual([organization['id'] for organization in claims['organizations']], [self.organization.pk])
+
+
+class PasswordHashingTestCase(TestCase):
+
+    def test_rehash_on_login(self):
+        with override_settings(AUTH_APP={'PASSWORD_HASH_ITERATIONS': 1000}):
+            user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+
+        with override_settings(AUTH_APP={'PASSWORD_HASH_ITERATIONS': 2000}):
+            backend = HashingPoolModelBackend()
+            self.assertIsNone(backend.authenticate(email='doctor@abcclinic.com', password='wrong'))
+            self.assertTrue(User.objects.get(pk=user.pk).password.startswith('pbkdf2_sha256$1000$'))
+
+            self.assertEqual(backend.authenticate(email='doctor@abcclinic.com', password='password'), user)
+            password = User.objects.get(pk=user.pk).password
+            self.assertTrue(password.startswith('pbkdf2_sha256$2000$'))
+
+            # Current hashes are left alone.
+            backend.authenticate(email='doctor@abcclinic.com', password='password')
+            self.assertEqual(User.objects.get(pk=user.pk).password, password)
+
+    def test_saturated_pool_rejects(self):
+        pool = PasswordHashingPool(workers=1, max_pending=0, timeout=5)
+        started = threading.Event()
+        release = threading.Event()
+
+        def hash_slowly():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=pool.run, args=(hash_slowly,))
+        thread.start()
+        started.wait()
+        try:
+            with self.assertRaises(PasswordHashingUnavailable):
+                pool.run(lambda: None)
+        finally:
+            release.set()
+            thread.join()
+        self.assertIsNone(pool.run(lambda: None))
+        pool.close()
+
+    @override_settings(AUTH_APP=dict(
+        settings.AUTH_APP,
+        PASSWORD_HASHING_WORKERS=1,
+        PASSWORD_HASHING_MAX_PENDING=0,
+    ))
+    def test_set_password_bypasses_pool(self):
+        pool = get_hashing_pool()
+        started = threading.Event()
+        release = threading.Event()
+
+        def hash_slowly():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=pool.run, args=(hash_slowly,))
+        thread.start()
+        started.wait()
+        try:
+            # As from the admin or `createsuperuser`, while logins get 503.
+            user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+            self.assertTrue(user.check_password('password'))
+            with self.assertRaises(PasswordHashingUnavailable):
+                pool.run(lambda: None)
+        finally:
+            release.set()
+            thread.join()
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'db.sqlite3')
+
+    def connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def test_reuse_and_limit(self):
+        pool = ConnectionPool(max_size=2, idle_timeout=60, health_check_interval=60, timeout=0.05)
+        first = pool.acquire(self.connect)
+        second = pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect)
+
+        pool.release(first)
+        self.assertIs(pool.acquire(self.connect), first)
+        pool.release(first)
+        pool.release(second)
+        pool.close()
+        self.assertEqual(pool.size, 0)
+
+    def test_broken_connection_replaced(self):
+        pool = ConnectionPool(max_size=1, idle_timeout=60, health_check_interval=0, timeout=0.05)
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        connection.close()
+
+        replacement = pool.acquire(self.connect)
+        self.assertIsNot(replacement, connection)
+        replacement.execute('SELECT 1')
+        pool.release(replacement)
+        pool.close()
+
+    def test_pooled_sqlite_backend(self):
+        wrapper = PooledSQLiteDatabaseWrapper({
+            'ENGINE': 'auth_app.db.backends.sqlite3',
+            'NAME': self.path,
+            'POOL': {'MAX_SIZE': 1},
+            'PRAGMAS': {'cache_size': -1000},
+            'OPTIONS': {},
+            'AUTOCOMMIT': True,
+            'CONN_MAX_AGE': 0,
+            'TIME_ZONE': None,
+        }, 'pooled')
+        self.addCleanup(get_pool(wrapper.settings_dict).close)
+
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1000)
+        raw_connection = wrapper.connection
+
+        wrapper.close()
+        self.assertIsNone(wrapper.connection)
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertIs(wrapper.connection, raw_connection)
+        wrapper.close()
+
+        wrapper.settings_dict['READ_ONLY'] = True
+        wrapper.settings_dict['NAME'] = self.path + '-read'
+        self.addCleanup(get_pool(wrapper.settings_dict).close)
+        with self.assertRaises(OperationalError):
+            with wrapper.cursor() as cursor:
+                cursor.execute('CREATE TABLE t (id INTEGER)')
+        wrapper.close()
+
+
+@override_settings(AUTH_APP={'READ_REPLICAS': ['replica']})
+class ReplicaRoutingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        reset_pinning()
+        self.addCleanup(reset_pinning)
+
+    def test_writes_pin_to_primary(self):
+        self.assertEqual(get_read_database(), 'replica')
+        self.assertEqual(ReplicaRouter().db_for_write(User), 'default')
+        self.assertEqual(get_read_database(), 'default')
+
+        reset_pinning()
+        self.assertEqual(get_read_database(), 'replica')
+
+    def test_pinning_middleware(self):
+        factory = RequestFactory()
+        databases = []
+
+        def write(request):
+            databases.append(get_read_database())
+            ReplicaRouter().db_for_write(User)
+            return HttpResponse()
+
+        def read(request):
+            databases.append(get_read_database())
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(read)(factory.get('/'))
+        self.assertNotIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+
+        response = ReplicaPinningMiddleware(write)(factory.post('/'))
+        self.assertIn(ReplicaPinningMiddleware.cookie_name, response.cookies)
+        self.assertEqual(get_read_database(), 'replica')
+
+        request = factory.get('/')
+        request.COOKIES[ReplicaPinningMiddleware.cookie_name] = '1'
+        ReplicaPinningMiddleware(read)(request)
+        self.assertEqual(databases, ['replica', 'replica', 'default'])
+
+    def test_sync_sqlite_replica(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'primary.sqlite3')
+        replica = os.path.join(directory, 'replica.sqlite3')
+
+        connection = sqlite3.connect(source)
+        connection.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)')
+        connection.execute('CREATE INDEX users_email ON users (email)')
+        connection.execute("INSERT INTO users (email) VALUES ('doctor@abcclinic.com')")
+        connection.commit()
+
+        self.assertEqual(sync_database(source, replica), 1)
+        connection.execute("INSERT INTO users (email) VALUES ('nurse@abcclinic.com')")
+        connection.commit()
+        connection.close()
+        self.assertEqual(sync_database(source, replica), 1)
+
+        connection = sqlite3.connect(replica)
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM users').fetchone()[0], 2)
+        self.assertEqual(connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'users_email'"
+        ).fetchone()[0], 1)
+        connection.close()
+
+
+class TokenRevocationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='ABC Clinic Group')
+        cls.role = Role.objects.create(name='Clinic-Assistant', description='The Clinic-Assistant role')
+        RolePermissionAssociation.objects.create(
+            role=cls.role,
+            permission=Permission.objects.create(name='Users-GET', description='Allows Users-GET'),
+        )
+        cls.user = User.objects.create_user('assistant@abcclinic.com', 'password', name='Assistant')
+        cls.association = RoleUserOrgAssociation.objects.create(
+            user=cls.user,
+            role=cls.role,
+            organization=cls.organization,
+        )
+
+    def setUp(self):
+        reset_authorization_state()
+        self.addCleanup(invalidate_revocation_list)
+
+    def issue_token(self):
+        return jwt_encode_handler(jwt_payload_handler(self.user))
+
+    def check_permission(self, token):
+        request = type(str('Request'), (object,), {'auth': token})()
+        return JWTPermission().get_payload(request)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('revoked-%d' % i)
+
+        self.assertEqual(len(bloom), 1000)
+        self.assertTrue(all('revoked-%d' % i in bloom for i in range(1000)))
+        false_positives = sum('valid-%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_payload_identifies_token(self):
+        first = jwt_payload_handler(self.user)
+        second = jwt_payload_handler(self.user)
+
+        self.assertNotEqual(first['jti'], second['jti'])
+        self.assertIsInstance(first['iat'], float)
+
+    def test_valid_token_checked_in_memory(self):
+        token = self.issue_token()
+        get_revocation_list()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.check_permission(token)['user_id'], self.user.pk)
+
+    def test_revoke_token(self):
+        token = self.issue_token()
+        other_token = self.issue_token()
+
+        serializer = RevokeJSONWebTokenSerializer(data={'token': token})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.check_permission(token)
+        self.check_permission(other_token)
+
+        self.assertFalse(VerifyJSONWebTokenSerializer(data={'token': token}).is_valid())
+        self.assertFalse(RefreshJSONWebTokenSerializer(data={'token': token}).is_valid())
+        self.assertTrue(VerifyJSONWebTokenSerializer(data={'token': other_token}).is_valid())
+
+        # Other processes load the revocation from the database.
+        invalidate_revocation_list()
+        with self.assertRaises(AuthenticationFailed):
+            self.check_permission(token)
+
+    def test_losing_role_revokes_user_tokens(self):
+        token = self.issue_token()
+        self.check_permission(token)
+
+        self.association.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.check_permission(token)
+
+        payload = jwt_payload_handler(self.user)
+        invalidate_revocation_list()
+        self.assertTrue(is_revoked(dict(payload, iat=payload['iat'] - 1)))
+        self.assertFalse(is_revoked(payload))
+
+    def test_changing_role_revokes_user_tokens(self):
+        token = self.issue_token()
+        self.association.save()
+        self.check_permission(token)
+
+        other_role = Role.objects.create(name='Clinic-Doctor', description='The Clinic-Doctor role')
+        for field, value in (
+            ('role', other_role),
+            ('organization', Organization.objects.create(name='Indiranagar Branch', parent=self.organization)),
+        ):
+            association = RoleUserOrgAssociation.objects.get(pk=self.association.pk)
+            setattr(association, field, value)
+            association.save()
+
+            with self.assertRaises(AuthenticationFailed):
+                self.check_permission(token)
+            token = self.issue_token()
+
+    def test_login_straight_after_revocation(self):
+        for _ in range(3):
+            revoke_user_tokens(self.user.pk)
+            response = self.client.post('/api/tokens/auth/', {
+                'email': 'assistant@abcclinic.com',
+                'password': 'password',
+            })
+            self.check_permission(response.data['token'])
+
+            # In other processes too.
+            invalidate_revocation_list()
+            self.check_permission(response.data['token'])
+
+    def test_issue_after_revocation_by_host_ahead(self):
+        revoked_at = timezone.now() + timedelta(seconds=10)
+        TokenEpoch.objects.revoke_user_tokens(self.user.pk, revoked_at, get_tokens_expire_at(revoked_at))
+        invalidate_revocation_list()
+
+        token = self.issue_token()
+        self.check_permission(token)
+        self.assertTrue(VerifyJSONWebTokenSerializer(data={'token': token}).is_valid())
+
+    def test_clock_skew(self):
+        payload = jwt_payload_handler(self.user)
+        payload['iat'] += 10
+        self.assertTrue(VerifyJSONWebTokenSerializer(data={'token': jwt_encode_handler(payload)}).is_valid())
+
+        payload['iat'] += api_settings.JWT_LEEWAY
+        for serializer_class in (VerifyJSONWebTokenSerializer, RefreshJSONWebTokenSerializer):
+            serializer = serializer_class(data={'token': jwt_encode_handler(payload)})
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(serializer.errors['non_field_errors'], ['Invalid token.'])
+
+    def test_revoked_token_cannot_read_catalogue(self):
+        token = self.issue_token()
+        headers = {'HTTP_AUTHORIZATION': 'JWT %s' % token}
+        self.assertEqual(self.client.get('/api/permissions/catalogue/', **headers).status_code, 200)
+
+        RevokeJSONWebTokenSerializer(data={'token': token}).is_valid(raise_exception=True)
+        self.assertEqual(self.client.get('/api/permissions/catalogue/', **headers).status_code, 401)
+
+    def test_deactivation_revokes_user_tokens(self):
+        token = self.issue_token()
+
+        self.user.is_active = False
+        self.user.save()
+        self.user.is_active = True
+        self.user.save()
+
+        self.assertFalse(RefreshJSONWebTokenSerializer(data={'token': token}).is_valid())
+        with self.assertRaises(AuthenticationFailed):
+            self.check_permission(token)
+
+
+class UserListTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        role = Role.objects.create(name='Clinic-Assistant', description='The Clinic-Assistant role')
+        RolePermissionAssociation.objects.create(
+            role=role,
+            permission=Permission.objects.create(name='Users-GET', description='Allows Users-GET'),
+        )
+        cls.user = User.objects.create_user('assistant@abcclinic.com', 'password', name='Assistant')
+        RoleUserOrgAssociation.objects.create(
+            user=cls.user,
+            role=role,
+            organization=Organization.objects.create(name='ABC Clinic Group'),
+        )
+        User.objects.bulk_create([
+            User(email='patient%d@example.com' % i, name='Patient %d' % i)
+            for i in range(24)
+        ])
+
+    def setUp(self):
+        reset_authorization_state()
+        token = jwt_encode_handler(jwt_payload_handler(self.user))
+        self.headers = {'HTTP_AUTHORIZATION': 'JWT %s' % token}
+
+    def get(self, url):
+        return self.client.get(url, **self.headers)
+
+    def get_json(self, url):
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_follow_cursor(self):
+        expected = self.get_json('/api/users/')
+        self.assertEqual(len(expected), 25)
+
+        rows = []
+        url = '/api/users/?limit=10'
+        pages = 0
+        while url:
+            page = self.get_json(url)
+            self.assertLessEqual(len(page['results']), 10)
+            rows.extend(page['results'])
+            url = page['next']
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(rows, expected)
+
+    def test_bad_limit_uses_default_page_size(self):
+        for limit in ('0', '-1', 'ten'):
+            page = self.get_json('/api/users/?limit=%s' % limit)
+            self.assertEqual(len(page['results']), 25)
+            self.assertIsNone(page['next'])
+
+    def test_bad_cursor(self):
+        response = self.get('/api/users/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_streamed_rows_match(self):
+        expected = self.get_json('/api/users/')
+
+        # Several chunks, the last one partial.
+        self.addCleanup(setattr, UserList, 'stream_chunk_size', UserList.stream_chunk_size)
+        UserList.stream_chunk_size = 10
+
+        response = self.get('/api/users/?stream=json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(json.loads(content), expected)
+
+        response = self.get('/api/users/?stream=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.endswith('\n'))
+        self.assertEqual([json.loads(line) for line in content.splitlines()], expected)
+
+
+class JWTPermissionTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        role = Role.objects.create(name='Clinic-Assistant', description='The Clinic-Assistant role')
+        for name in ('Users-GET', 'Reports-GET'):
+            RolePermissionAssociation.objects.create(
+                role=role,
+                permission=Permission.objects.create(name=name, description='Allows %s' % name),
+            )
+        cls.user = User.objects.create_user('assistant@abcclinic.com', 'password', name='Assistant')
+        RoleUserOrgAssociation.objects.create(
+            user=cls.user,
+            role=role,
+            organization=Organization.objects.create(name='ABC Clinic Group'),
+        )
+
+    def setUp(self):
+        reset_authorization_state()
+        self.token = jwt_encode_handler(jwt_payload_handler(self.user))
+        self.headers = {'HTTP_AUTHORIZATION': 'JWT %s' % self.token}
+
+    def call(self, view_class, method):
+        request = getattr(RequestFactory(), method)('/', **self.headers)
+        return view_class.as_view()(request)
+
+    def make_view(self, base, **attrs):
+        attrs.update(
+            authentication_classes=(JSONWebTokenAuthentication,),
+            permission_classes=(JWTPermission,),
+            get=lambda self, request: Response({}),
+            post=lambda self, request: Response({}),
+        )
+        return type(str('ReportList'), (base,), attrs)
+
+    def test_required_permissions_precomputed(self):
+        view_class = self.make_view(ResourceAPIView, resource_name='Reports')
+
+        self.assertEqual(view_class.required_permissions, {
+            method.upper(): 'Reports-%s' % method.upper()
+            for method in view_class.http_method_names
+        })
+        self.assertEqual(UserList.required_permissions['GET'], 'Users-GET')
+        self.assertFalse(hasattr(ResourceAPIView, 'required_permissions'))
+
+        self.assertEqual(self.call(view_class, 'get').status_code, 200)
+        self.assertEqual(self.call(view_class, 'post').status_code, 403)
+
+        # Checked against the permission names decoded once per token.
+        payload = jwt_decode_handler(self.token)
+        self.assertEqual(payload.permission_names, frozenset(['Users-GET', 'Reports-GET']))
+        self.assertIs(jwt_decode_handler(self.token).permission_names, payload.permission_names)
+
+    def test_views_without_metaclass(self):
+        view_class = self.make_view(APIView, resource_name='Reports')
+        self.assertEqual(self.call(view_class, 'get').status_code, 200)
+        self.assertEqual(self.call(view_class, 'post').status_code, 403)
+
+        for view_class in (self.make_view(APIView), self.make_view(APIView, resource_name=None)):
+            self.assertEqual(self.call(view_class, 'get').status_code, 403)
+
+    def test_unmapped_method(self):
+        self.assertEqual(self.client.get('/api/users/', **self.headers).status_code, 200)
+        self.assertEqual(self.client.generic('PROPFIND', '/api/users/', **self.headers).status_code, 403)
+
+
+class OrganizationUserListTestCase(TestCase):
+    """
+    Changes to organizations are never committed here, so this process only
+    learns of them through the `OrganizationTreeGeneration`, like any other.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = Organization.objects.create(name='ABC Clinic Group')
+        cls.branch = Organization.objects.create(name='Indiranagar Branch', parent=cls.clinic)
+        cls.ward = Organization.objects.create(name='Pediatrics Ward', parent=cls.branch)
+        cls.other_branch = Organization.objects.create(name='Koramangala Branch', parent=cls.clinic)
+
+        admin_role = Role.objects.create(name='Branch-Admin', description='The Branch-Admin role')
+        RolePermissionAssociation.objects.create(
+            role=admin_role,
+            permission=Permission.objects.create(name='Users-GET', description='Allows Users-GET'),
+        )
+        nurse_role = Role.objects.create(name='Clinic-Nurse', description='The Clinic-Nurse role')
+
+        cls.admin = User.objects.create_user('admin@abcclinic.com', 'password', name='Admin')
+        RoleUserOrgAssociation.objects.create(user=cls.admin, role=admin_role, organization=cls.branch)
+        cls.nurse = User.objects.create_user('nurse@abcclinic.com', 'password', name='Nurse')
+        RoleUserOrgAssociation.objects.create(user=cls.nurse, role=nurse_role, organization=cls.ward)
+        RoleUserOrgAssociation.objects.create(user=cls.nurse, role=nurse_role, organization=cls.branch)
+        cls.doctor = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+        RoleUserOrgAssociation.objects.create(user=cls.doctor, role=nurse_role, organization=cls.other_branch)
+
+    def setUp(self):
+        reset_authorization_state()
+        organization_index.load()
+        self.addCleanup(organization_index.load)
+        self.token = jwt_encode_handler(jwt_payload_handler(self.admin))
+
+    def get(self, organization_id, **params):
+        return self.client.get(
+            '/api/organizations/%s/users/' % organization_id,
+            params,
+            HTTP_AUTHORIZATION='JWT %s' % self.token,
+        )
+
+    def test_lists_users_below_organization(self):
+        response = self.get(self.branch.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['email'] for user in response.data], [self.admin.email, self.nurse.email])
+
+        response = self.get(self.ward.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['email'] for user in response.data], [self.nurse.email])
+
+    def test_paginated(self):
+        response = self.get(self.branch.pk, limit=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['email'] for user in response.data['results']], [self.admin.email])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_requires_permission_in_organization_or_ancestor(self):
+        for organization_id in (self.clinic.pk, self.other_branch.pk, 0):
+            self.assertEqual(self.get(organization_id).status_code, 403, organization_id)
+
+    def test_picks_up_moves_made_elsewhere(self):
+        self.other_branch.parent = self.branch
+        self.other_branch.save()
+
+        with override_settings(AUTH_APP=dict(settings.AUTH_APP, ORGANIZATION_INDEX_CHECK_INTERVAL=60)):
+            self.assertEqual(self.get(self.other_branch.pk).status_code, 403)
+
+        with override_settings(AUTH_APP=dict(settings.AUTH_APP, ORGANIZATION_INDEX_CHECK_INTERVAL=0)):
+            response = self.get(self.other_branch.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['email'] for user in response.data], [self.doctor.email])
+
+
+class InstrumentationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        role = Role.objects.create(name='Clinic-Assistant', description='The Clinic-Assistant role')
+        RolePermissionAssociation.objects.create(
+            role=role,
+            permission=Permission.objects.create(name='Users-GET', description='Allows Users-GET'),
+        )
+        cls.user = User.objects.create_user('assistant@abcclinic.com', 'password', name='Assistant')
+        RoleUserOrgAssociation.objects.create(
+            user=cls.user,
+            role=role,
+            organization=Organization.objects.create(name='ABC Clinic Group'),
+        )
+
+    def setUp(self):
+        reset_authorization_state()
+        instrumentation.registry.clear()
+        self.addCleanup(instrumentation.registry.clear)
+        self.headers = {'HTTP_AUTHORIZATION': 'JWT %s' % jwt_encode_handler(jwt_payload_handler(self.user))}
+
+    def test_render(self):
+        registry = instrumentation.MetricsRegistry(buckets=(0.1, 1.0))
+        registry.describe('requests_total', 'Requests handled.')
+        registry.inc('requests_total', view='UserList', status=200)
+        registry.inc('requests_total', 2, view='UserList', status=200)
+        registry.inc('requests_total', view='say "hi"\n')
+        registry.set('evictions', 7)
+        registry.observe('duration_seconds', 0.05, view='UserList')
+        registry.observe('duration_seconds', 0.5, view='UserList')
+        registry.observe('duration_seconds', 5, view='UserList')
+
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP requests_total Requests handled.',
+            '# TYPE requests_total counter',
+            'requests_total{status="200",view="UserList"} 3',
+            'requests_total{view="say \\"hi\\"\\n"} 1',
+            '# TYPE evictions gauge',
+            'evictions 7',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{view="UserList",le="0.1"} 1',
+            'duration_seconds_bucket{view="UserList",le="1.0"} 2',
+            'duration_seconds_bucket{view="UserList",le="+Inf"} 3',
+            'duration_seconds_count{view="UserList"} 3',
+            'duration_seconds_sum{view="UserList"} 5.55',
+            '',
+        ]))
+
+        registry.clear()
+        self.assertEqual(registry.render(), '\n')
+
+    def test_middleware(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('auth_app.instrumentation')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.INFO)
+
+        with override_settings(AUTH_APP=dict(
+            settings.AUTH_APP,
+            INSTRUMENTATION_ENABLED=True,
+            INSTRUMENTATION_LOG=True,
+        )):
+            self.assertEqual(self.client.get('/api/users/', **self.headers).status_code, 200)
+
+        rendered = instrumentation.registry.render()
+        self.assertIn('authserver_requests_total{method="GET",status="200",view="UserList"} 1\n', rendered)
+        self.assertIn('authserver_request_duration_seconds_count{view="UserList"} 1\n', rendered)
+        self.assertIn('authserver_operation_duration_seconds_count{operation="permission_check"} 1\n', rendered)
+        query_count = int(re.search(r'authserver_db_queries_total\{view="UserList"\} (\d+)', rendered).group(1))
+        self.assertGreater(query_count, 0)
+
+        self.assertEqual(len(records), 1)
+        record = json.loads(records[0].getMessage())
+        self.assertEqual(record['view'], 'UserList')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['db_queries'], query_count)
+        self.assertIn('permission_check_ms', record)
+
+    def test_middleware_disabled(self):
+        self.assertEqual(self.client.get('/api/users/', **self.headers).status_code, 200)
+        self.assertEqual(instrumentation.registry.render(), '\n')
+
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+        with override_settings(AUTH_APP=dict(settings.AUTH_APP, INSTRUMENTATION_ENABLED=True, METRICS_TOKEN='s3cret')):
+            self.client.get('/api/users/', **self.headers)
+
+            for headers in ({}, self.headers, {'HTTP_AUTHORIZATION': 'Bearer wrong'}):
+                response = self.client.get('/api/metrics/', **headers)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="metrics"')
+
+            response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+            self.assertIn(
+                'authserver_requests_total{method="GET",status="200",view="UserList"} 1\n',
+                response.content.decode('utf-8'),
+            )
+
+
+class PermissionCheckTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinic = Organization.objects.create(name='ABC Clinic Group')
+        cls.branch = Organization.objects.create(name='Indiranagar Branch', parent=cls.clinic)
+        cls.ward = Organization.objects.create(name='Pediatrics Ward', parent=cls.branch)
+        cls.other_clinic = Organization.objects.create(name='XYZ Clinic Group')
+
+        doctor_role = Role.objects.create(name='Clinic-Doctor', description='The Clinic-Doctor role')
+        RolePermissionAssociation.objects.create(
+            role=doctor_role,
+            permission=Permission.objects.create(name='Patient-GET', description='Allows Patient-GET'),
+        )
+        admin_role = Role.objects.create(name='Clinic-Admin', description='The Clinic-Admin role')
+        RolePermissionAssociation.objects.create(
+            role=admin_role,
+            permission=Permission.objects.create(name='Permissions-POST', description='Allows Permissions-POST'),
+        )
+
+        cls.doctor = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+        RoleUserOrgAssociation.objects.create(user=cls.doctor, role=doctor_role, organization=cls.branch)
+        cls.inactive = User.objects.create_user('former@abcclinic.com', 'password', name='Former', is_active=False)
+        RoleUserOrgAssociation.objects.create(user=cls.inactive, role=doctor_role, organization=cls.branch)
+        cls.admin = User.objects.create_user('admin@abcclinic.com', 'password', name='Admin')
+        RoleUserOrgAssociation.objects.create(user=cls.admin, role=admin_role, organization=cls.clinic)
+
+    def setUp(self):
+        reset_authorization_state()
+        organization_index.load()
+        self.addCleanup(organization_index.load)
+
+    def post(self, checks, user=None):
+        token = jwt_encode_handler(jwt_payload_handler(user or self.admin))
+        return self.client.post(
+            '/api/permissions/check/',
+            json.dumps({'checks': checks}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='JWT %s' % token,
+        )
+
+    def test_check_permissions(self):
+        self.assertEqual(check_permissions([
+            # Granted where the role is held, and below.
+            (self.doctor.pk, self.branch.pk, 'Patient-GET'),
+            (self.doctor.pk, self.ward.pk, 'Patient-GET'),
+            # Not above, nor in another tree.
+            (self.doctor.pk, self.clinic.pk, 'Patient-GET'),
+            (self.doctor.pk, self.other_clinic.pk, 'Patient-GET'),
+            # In any organization.
+            (self.doctor.pk, None, 'Patient-GET'),
+            (self.admin.pk, None, 'Patient-GET'),
+            (self.inactive.pk, self.branch.pk, 'Patient-GET'),
+            (self.inactive.pk, None, 'Patient-GET'),
+            (self.doctor.pk, self.branch.pk, 'Patient-DELETE'),
+            (self.doctor.pk, None, 'Patient-DELETE'),
+            (0, None, 'Patient-GET'),
+        ]), [True, True, False, False, True, False, False, False, False, False, False])
+
+        self.assertEqual(check_permissions([]), [])
+
+    def test_queries_independent_of_checks(self):
+        with self.assertNumQueries(1):
+            check_permissions([(self.doctor.pk, self.ward.pk, 'Patient-GET')])
+
+        users = [self.doctor, self.inactive, self.admin]
+        organizations = [self.clinic, self.branch, self.ward, self.other_clinic, None]
+        checks = [
+            (user.pk, organization and organization.pk, permission_name)
+            for user in users
+            for organization in organizations
+            for permission_name in ('Patient-GET', 'Permissions-POST', 'Patient-DELETE')
+        ]
+        with self.assertNumQueries(1):
+            check_permissions(checks)
+
+    def test_endpoint(self):
+        response = self.post([
+            [self.doctor.pk, self.ward.pk, 'Patient-GET'],
+            [self.doctor.pk, None, 'Patient-DELETE'],
+            [self.inactive.pk, None, 'Patient-GET'],
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data, {'results': [True, False, False]})
+
+        with CaptureQueriesContext(connection) as one_check:
+            self.assertEqual(self.post([[self.doctor.pk, self.ward.pk, 'Patient-GET']]).status_code, 200)
+        with CaptureQueriesContext(connection) as many_checks:
+            self.assertEqual(self.post([[self.doctor.pk, self.ward.pk, 'Patient-GET']] * 100).status_code, 200)
+        self.assertEqual(len(many_checks), len(one_check))
+
+    def test_endpoint_validation(self):
+        self.assertEqual(self.post([[self.doctor.pk, self.ward.pk, 'Patient-GET']], user=self.doctor).status_code, 403)
+
+        for checks in (
+            [],
+            [[self.doctor.pk, 'Patient-GET']],
+            [[True, None, 'Patient-GET']],
+            [[self.doctor.pk, str(self.ward.pk), 'Patient-GET']],
+        ):
+            self.assertEqual(self.post(checks).status_code, 400, checks)
+
+        with override_settings(AUTH_APP=dict(settings.AUTH_APP, BATCH_PERMISSION_CHECK_MAX_CHECKS=2)):
+            self.assertEqual(self.post([[self.doctor.pk, None, 'Patient-GET']] * 3).status_code, 400)
+
+
+class JSONWebKeySetTestCase(SimpleTestCase):
+
+    def test_not_modified(self):
+        response = self.client.get('/api/tokens/jwks/')
+        self.assertEqual(response.status_code, 200)
+        kids = [key['kid'] for key in json.loads(response.content.decode('utf-8'))['keys']]
+        self.assertEqual(kids, sorted(get_key_ring().keys))
+
+        etag = response['ETag']
+        response = self.client.get('/api/tokens/jwks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get('/api/tokens/jwks/', HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_token_verified_with_key_of_kid(self):
+        key_ring = get_key_ring()
+        payload = {'user_id': 1, 'username': 'doctor@abcclinic.com'}
+        self.assertEqual(key_ring.decode(key_ring.encode(payload)), payload)
+
+        for kid, key in key_ring.keys.items():
+            token = jwt.encode(payload, key.private_key, key.algorithm, headers={'kid': kid})
+            self.assertEqual(key_ring.decode(token), payload)
+
+        token = jwt.encode(payload, api_settings.JWT_PRIVATE_KEY, 'RS512', headers={'kid': 'unknown'})
+        with self.assertRaises(jwt.DecodeError):
+            key_ring.decode(token)
+
+
+class KeyRingTestCase(SimpleTestCase):
+    payload = {'user_id': 1, 'username': 'doctor@abcclinic.com'}
+
+    def generate_key(self, kid, algorithm, private_key):
+        return SigningKey.from_pem(algorithm, private_pem=private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        ), kid=kid)
+
+    def test_es256(self):
+        with override_settings(AUTH_APP=dict(settings.AUTH_APP, SIGNING_KEY_ID='es256-1')):
+            token = jwt_encode_handler(self.payload)
+            self.assertEqual(jwt.get_unverified_header(token)['alg'], 'ES256')
+            self.assertEqual(jwt.get_unverified_header(token)['kid'], 'es256-1')
+            self.assertEqual(get_key_ring().decode(token), self.payload)
+
+        # Still verified once signing switched back to the RSA key.
+        self.assertEqual(get_key_ring().decode(token), self.payload)
+
+    def test_eddsa(self):
+        key = self.generate_key('ed25519-1', 'EdDSA', Ed25519PrivateKey.generate())
+        key_ring = KeyRing([key])
+
+        token = key_ring.encode(self.payload)
+        self.assertEqual(jwt.get_unverified_header(token), {'alg': 'EdDSA', 'kid': 'ed25519-1', 'typ': 'JWT'})
+        self.assertEqual(key_ring.decode(token), self.payload)
+
+        other_key = self.generate_key('ed25519-1', 'EdDSA', Ed25519PrivateKey.generate())
+        with self.assertRaises(jwt.DecodeError):
+            KeyRing([other_key]).decode(token)
+
+        jwk = key.to_jwk()
+        self.assertEqual((jwk['kty'], jwk['crv'], jwk['alg']), ('OKP', 'Ed25519', 'EdDSA'))
+        self.assertEqual(len(jwk['x']), 43)
+
+    def test_rotation(self):
+        old_key = self.generate_key('es256-old', 'ES256', ec.generate_private_key(ec.SECP256R1(), default_backend()))
+        new_key = self.generate_key('es256-new', 'ES256', ec.generate_private_key(ec.SECP256R1(), default_backend()))
+
+        old_token = KeyRing([old_key]).encode(self.payload)
+
+        # Signing with the new key, the old one kept until its tokens expire.
+        key_ring = KeyRing([old_key, new_key], 'es256-new')
+        self.assertEqual(jwt.get_unverified_header(key_ring.encode(self.payload))['kid'], 'es256-new')
+        self.assertEqual(key_ring.decode(old_token), self.payload)
+
+        # Then retired.
+        with self.assertRaisesRegexp(jwt.DecodeError, 'Unknown signing key id.'):
+            KeyRing([new_key]).decode(old_token)
+
+    def test_unknown_kid(self):
+        key = get_key_ring().signing_key
+        token = jwt.encode(self.payload, key.private_key, key.algorithm, headers={'kid': 'unknown'})
+
+        with self.assertRaisesRegexp(jwt.DecodeError, 'Unknown signing key id.'):
+            get_key_ring().decode(token)
+
+        serializer = VerifyJSONWebTokenSerializer(data={'token': token.decode('utf-8')})
+        self.assertFalse(serializer.is_valid())
+
+    def test_algorithm_of_key_only(self):
+        # An RSA signed token claiming the kid of the EC key.
+        token = jwt.encode(self.payload, api_settings.JWT_PRIVATE_KEY, 'RS512', headers={'kid': 'es256-1'})
+        with self.assertRaises(jwt.InvalidTokenError):
+            get_key_ring().decode(token)
+
+
+class BatchVerifyTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+
+    def setUp(self):
+        reset_authorization_state()
+        self.addCleanup(invalidate_revocation_list)
+
+    def test_mixed_tokens(self):
+        valid = jwt_encode_handler(jwt_payload_handler(self.user))
+
+        payload = jwt_payload_handler(self.user)
+        payload['exp'] = payload['iat'] - api_settings.JWT_LEEWAY - 10
+        expired = jwt_encode_handler(payload)
+
+        wrong_algorithm = jwt.encode(jwt_payload_handler(self.user), 'secret', 'HS256').decode('utf-8')
+
+        payload = jwt_payload_handler(self.user)
+        revoked = jwt_encode_handler(payload)
+        RevokeJSONWebTokenSerializer(data={'token': revoked}).is_valid(raise_exception=True)
+
+        tokens = [valid, expired, 'malformed', wrong_algorithm, revoked, valid, 'malformed']
+        serializer = BatchVerifyJSONWebTokenSerializer(data={'tokens': tokens})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        results = serializer.validated_data['results']
+        self.assertEqual(
+            [result.get('error') for result in results],
+            [
+                None,
+                'Signature has expired.',
+                'Error decoding signature.',
+                'Invalid token.',
+                'Token has been revoked.',
+                None,
+                'Error decoding signature.',
+            ],
+        )
+        self.assertTrue(results[0]['valid'])
+        self.assertEqual(results[0]['payload']['user_id'], self.user.pk)
+        self.assertEqual(results[5], results[0])
+
+
+class RefreshTokenTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name='ABC Clinic Group')
+        cls.roles = {}
+        for name in ('Clinic-Assistant', 'Clinic-Doctor'):
+            cls.roles[name] = Role.objects.create(name=name, description='The %s role' % name)
+        for role_name, permission_name in (('Clinic-Assistant', 'Users-GET'), ('Clinic-Doctor', 'Patient-GET')):
+            RolePermissionAssociation.objects.create(
+                role=cls.roles[role_name],
+                permission=Permission.objects.create(name=permission_name, description='Allows %s' % permission_name),
+            )
+
+        cls.user = User.objects.create_user('assistant@abcclinic.com', 'password', name='Assistant')
+        RoleUserOrgAssociation.objects.create(
+            user=cls.user,
+            role=cls.roles['Clinic-Assistant'],
+            organization=cls.organization,
+        )
+
+    def setUp(self):
+        reset_authorization_state()
+        self.addCleanup(invalidate_revocation_list)
+
+    def refresh(self, payload):
+        serializer = RefreshJSONWebTokenSerializer(data={'token': jwt_encode_handler(payload)})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        return api_settings.JWT_DECODE_HANDLER(serializer.validated_data['token'])
+
+    def permission_names(self, payload):
+        return sorted(permission['name'] for permission in payload['permissions'])
+
+    # Without the shared cache, rebuilt claims are read from the snapshot.
+    @override_settings(AUTH_APP=dict(settings.AUTH_APP, CACHE_ALIAS=None))
+    def test_claims_carried_over(self):
+        payload = jwt_payload_handler(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            refreshed = self.refresh(payload)
+
+        self.assertFalse([query for query in queries if 'authorization_snapshots' in query['sql']])
+        self.assertEqual(refreshed['av'], payload['av'])
+        self.assertEqual(refreshed['permissions'], payload['permissions'])
+        self.assertEqual(refreshed['organizations'], payload['organizations'])
+        self.assertEqual(refreshed['orig_iat'], payload['orig_iat'])
+        self.assertNotEqual(refreshed['jti'], payload['jti'])
+
+    def test_role_change_rebuilds_claims(self):
+        payload = jwt_payload_handler(self.user)
+        self.assertEqual(self.permission_names(payload), ['Users-GET'])
+
+        RoleUserOrgAssociation.objects.create(
+            user=self.user,
+            role=self.roles['Clinic-Doctor'],
+            organization=self.organization,
+        )
+
+        refreshed = self.refresh(payload)
+        self.assertGreater(refreshed['av'], payload['av'])
+        self.assertEqual(self.permission_names(refreshed), ['Patient-GET', 'Users-GET'])
+
+    def test_refresh_limit(self):
+        payload = jwt_payload_handler(self.user)
+        refresh_seconds = int(api_settings.JWT_REFRESH_EXPIRATION_DELTA.total_seconds())
+
+        payload['orig_iat'] -= refresh_seconds - 60
+        self.refresh(payload)
+
+        payload['orig_iat'] -= 120
+        serializer = RefreshJSONWebTokenSerializer(data={'token': jwt_encode_handler(payload)})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['non_field_errors'], ['Refresh has expired.'])
+
+        del payload['orig_iat']
+        serializer = RefreshJSONWebTokenSerializer(data={'token': jwt_encode_handler(payload)})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['non_field_errors'], ['orig_iat field is required.'])
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'The ASGI application requires Python 3.5+.')
+class TokenApplicationTestCase(TransactionTestCase):
+    """
+    Authentication runs on the executor threads, which only see committed
+    rows.
+    """
+
+    def setUp(self):
+        from .asgi import TokenApplication
+
+        reset_authorization_state()
+        self.user = User.objects.create_user('doctor@abcclinic.com', 'password', name='Doctor')
+        self.application = TokenApplication(None)
+
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+
+    def call(self, method, path, body=b'', headers=(), query_string=b''):
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        def receive():
+            future = self.loop.create_future()
+            future.set_result(messages.pop(0))
+            return future
+
+        def send(message):
+            sent.append(message)
+            future = self.loop.create_future()
+            future.set_result(None)
+            return future
+
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query_string,
+            'headers': list(headers),
+        }
+        self.loop.run_until_complete(self.application(scope, receive, send))
+        return sent
+
+    def post(self, path, body, content_type):
+        sent = self.call('POST', path, body, headers=[
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+        ])
+        return sent[0]['status'], json.loads(sent[1]['body'].decode('utf-8'))
+
+    def connect(self, signal):
+        received = []
+
+        def receiver(**kwargs):
+            received.append(kwargs)
+
+        signal.connect(receiver)
+        self.addCleanup(signal.disconnect, receiver)
+        return received
+
+    def test_login(self):
+        logged_in = self.connect(user_logged_in)
+
+        status, data = self.post(
+            '/api/tokens/auth/',
+            json.dumps({'email': 'doctor@abcclinic.com', 'password': 'password'}).encode('utf-8'),
+            'application/json',
+        )
+        self.assertEqual(status, 200, data)
+        self.assertEqual(api_settings.JWT_DECODE_HANDLER(data['token'])['user_id'], self.user.pk)
+        self.assertEqual([kwargs['user'] for kwargs in logged_in], [self.user])
+        self.assertIsNotNone(User.objects.get(pk=self.user.pk).last_login)
+
+        status, data = self.post(
+            '/api/tokens/auth/',
+            encode_multipart(BOUNDARY, {'email': 'doctor@abcclinic.com', 'password': 'password'}),
+            MULTIPART_CONTENT,
+        )
+        self.assertEqual(status, 200, data)
+
+    def test_failed_login(self):
+        login_failed = self.connect(user_login_failed)
+
+        status, data = self.post(
+            '/api/tokens/auth/',
+            b'email=doctor%40abcclinic.com&password=wrong',
+            'application/x-www-form-urlencoded',
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(data, {'non_field_errors': ['Unable to login with provided credentials.']})
+        self.assertEqual(len(login_failed), 1)
+
+    def test_errors_rendered(self):
+        status, data = self.post('/api/tokens/auth/', b'{', 'application/json')
+        self.assertEqual(status, 400)
+        self.assertIn('detail', data)
+
+        status, data = self.post('/api/tokens/auth/', b'password', 'text/plain')
+        self.assertEqual(status, 415)
+
+        from . import asgi
+
+        def fail(data):
+            raise RuntimeError('Unexpected')
+
+        self.addCleanup(asgi.TOKEN_ENDPOINTS.pop, '/api/tokens/fail/')
+        asgi.TOKEN_ENDPOINTS['/api/tokens/fail/'] = fail
+        status, data = self.post('/api/tokens/fail/', b'{}', 'application/json')
+        self.assertEqual((status, data), (500, {'detail': 'A server error occurred.'}))
+
+    def test_streams_wsgi_responses(self):
+        role = Role.objects.create(name='Clinic-Admin', description='The Clinic-Admin role')
+        RolePermissionAssociation.objects.create(
+            role=role,
+            permission=Permission.objects.create(name='Users-GET', description='Allows Users-GET'),
+        )
+        RoleUserOrgAssociation.objects.create(
+            user=self.user,
+            role=role,
+            organization=Organization.objects.create(name='ABC Clinic Group'),
+        )
+        User.objects.create_user('nurse@abcclinic.com', 'password', name='Nurse')
+        self.addCleanup(setattr, UserList, 'stream_chunk_size', UserList.stream_chunk_size)
+        UserList.stream_chunk_size = 1
+        self.application.wsgi_application = WSGIHandler()
+
+        token = jwt_encode_handler(jwt_payload_handler(self.user))
+        sent = self.call('GET', '/api/users/', query_string=b'stream=ndjson', headers=[
+            (b'authorization', ('JWT %s' % token).encode('latin-1')),
+        ])
+
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertEqual(sent[0]['status'], 200)
+        bodies = sent[1:]
+        # A message per row and one for the closing newline, then the end.
+        self.assertEqual([message.get('more_body', False) for message in bodies], [True, True, True, False])
+        lines = b''.join(message['body'] for message in bodies).decode('utf-8').splitlines()
+        self.assertEqual(
+            [json.loads(line)['email'] for line in lines],
+            ['doctor@abcclinic.com', 'nurse@abcclinic.com'],
+        )
@@ -0,0 +1,47 @@
+from __future__ import division, unicode_literals
+
+import hashlib
+import math
+import struct
+
+
+class BloomFilter(object):
+    """
+    A set-membership filter answering "definitely not present" or "maybe
+    present", sized for `capacity` items at the given false positive rate.
+    Positions are derived by double hashing from a single SHA-256 digest.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        if capacity < 1:
+            raise ValueError('The capacity must be at least 1.')
+        if not 0 < error_rate < 1:
+            raise ValueError('The error rate must be between 0 and 1.')
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        if not isinstance(item, bytes):
+            item = ('%s' % item).encode('utf-8')
+        h1, h2 = struct.unpack('>QQ', hashlib.sha256(item).digest()[:16])
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,180 @@
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+from django.core.cache import caches
+
+from auth_app.conf import app_settings
+from auth_app.instrumentation import count
+
+
+class TTLCache(object):
+    """
+    A thread-safe, size-bounded LRU cache whose entries also expire at a
+    per-entry deadline. Entries evicted to make room are counted under
+    `name` in the `authserver_cache_evictions_total` metric.
+    """
+
+    def __init__(self, max_size, ttl, name=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at <= time.time():
+                self.misses += 1
+                return default
+
+            # Re-insert to mark the entry as most recently used.
+            self._entries[key] = (value, expires_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """
+        Stores `value` until `expires_at` (a UNIX timestamp), or for `ttl`
+        seconds if that comes first.
+        """
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+
+        evicted = 0
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, deadline)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+
+        if evicted:
+            count('authserver_cache_evictions_total', evicted, cache=self.name)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+MISSING = object()
+
+
+class SharedCache(object):
+    """
+    Values shared by all workers and hosts through the Django cache named by
+    `AUTH_APP['CACHE_ALIAS']`, or not cached at all if it is `None`.
+
+    Keys are prefixed with `name` and stored under `key_version`, to be
+    bumped whenever the format of the cached values changes. Callers put
+    the version of the data a value was computed from in the key, so that
+    stale values are never read rather than having to be deleted.
+    Lookups are counted in the `authserver_shared_cache_total` metric.
+    """
+
+    def __init__(self, name, key_version=1):
+        self.name = name
+        self.key_version = key_version
+
+    @property
+    def enabled(self):
+        return app_settings.CACHE_ALIAS is not None
+
+    @property
+    def cache(self):
+        return caches[app_settings.CACHE_ALIAS]
+
+    def make_key(self, *parts):
+        return ':'.join([self.name] + ['%s' % part for part in parts])
+
+    def get(self, key, default=None):
+        value = self.cache.get(key, MISSING, version=self.key_version)
+        if value is MISSING:
+            count('authserver_shared_cache_total', cache=self.name, result='miss')
+            return default
+
+        count('authserver_shared_cache_total', cache=self.name, result='hit')
+        return value
+
+    def set(self, key, value, timeout=None):
+        """
+        Stores `value` for `timeout` seconds, or `CACHE_TIMEOUT` if `None`.
+        """
+        if timeout is None:
+            timeout = app_settings.CACHE_TIMEOUT
+        self.cache.set(key, value, timeout, version=self.key_version)
+
+    def get_or_compute(self, key, compute, timeout=None, is_cacheable=None):
+        """
+        Returns the cached value of `key`, computing and storing it on a
+        miss, unless `is_cacheable(value)` is false. Only one worker
+        computes a missing value at a time: the others wait for it to be
+        stored, until that worker gives up its lock or for at most
+        `CACHE_LOCK_TIMEOUT` seconds, before computing it themselves.
+        """
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        cache = self.cache
+        lock_key = '%s:lock' % key
+        lock_timeout = app_settings.CACHE_LOCK_TIMEOUT
+
+        if cache.add(lock_key, True, lock_timeout, version=self.key_version):
+            try:
+                return self._compute(key, compute, timeout, is_cacheable)
+            finally:
+                cache.delete(lock_key, version=self.key_version)
+
+        count('authserver_shared_cache_total', cache=self.name, result='wait')
+        deadline = time.time() + lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.01)
+            value = cache.get(key, MISSING, version=self.key_version)
+            if value is not MISSING:
+                return value
+            if cache.get(lock_key, version=self.key_version) is None:
+                # Released without storing a value.
+                value = cache.get(key, MISSING, version=self.key_version)
+                if value is not MISSING:
+                    return value
+                return self._compute(key, compute, timeout, is_cacheable)
+
+        count('authserver_shared_cache_total', cache=self.name, result='lock_timeout')
+        return self._compute(key, compute, timeout, is_cacheable)
+
+    def _compute(self, key, compute, timeout, is_cacheable):
+        value = compute()
+        if is_cacheable is None or is_cacheable(value):
+            self.set(key, value, timeout)
+        return value
@@ -1,16 +1,157 @@
+import hashlib
 import jwt
+import time
 import uuid
 import warnings
 from calendar import timegm
 from datetime import datetime
 
+from django.utils.functional import cached_property
 from rest_framework_jwt.compat import get_username, get_username_field
 from rest_framework_jwt.settings import api_settings
 
-from auth_app.serializers import PermissionSerializer
+from auth_app.catalogue import (
+    decode_compact_organization_permissions,
+    decode_compact_permissions,
+    encode_compact_authorization,
+    get_catalogue,
+)
+from auth_app.conf import app_settings
+from auth_app.instrumentation import count, timer
+from auth_app.models import AuthorizationSnapshot
+from auth_app.revocation import get_new_token_issued_at
+from auth_app.utils.cache import SharedCache, TTLCache
+from auth_app.utils.keys import get_key_ring
 
 
-def jwt_payload_handler(user):
+# Payloads of tokens whose signature was already verified, keyed by the
+# SHA-256 digest of the token. Shared by `JSONWebTokenAuthentication`, the
+# token views and `JWTPermission`, which all decode the same token.
+verified_token_cache = TTLCache(
+    max_size=app_settings.TOKEN_CACHE_MAX_SIZE,
+    ttl=app_settings.TOKEN_CACHE_TTL,
+    name='verified_tokens',
+)
+
+# The same, shared by all workers when `CACHE_ALIAS` is set. Anyone able to
+# write to that cache can forge verified payloads, so it must be as trusted
+# as the database.
+shared_verified_token_cache = SharedCache('verified_token')
+
+# Authorization data of users, keyed by user ID and authorization version.
+shared_authorization_cache = SharedCache('authorization')
+
+
+class VerifiedPayload(dict):
+    """
+    A verified token payload, which also carries the lookup structures
+    derived from its claims so that they are built once per token rather
+    than once per request.
+    """
+
+    @cached_property
+    def permission_names(self):
+        return get_permission_names(self)
+
+    @cached_property
+    def organization_permission_names(self):
+        return get_organization_permission_names(self)
+
+
+def get_permission_names(payload):
+    """
+    Returns the names of the permissions granted by `payload` as a frozenset.
+    Raises `KeyError` if the payload carries no permissions.
+    """
+    if 'perms' in payload:
+        return decode_compact_permissions(payload)
+
+    return frozenset(permission['name'] for permission in payload['permissions'])
+
+
+def get_organization_permission_names(payload):
+    """
+    Returns a dict mapping the IDs of the organizations in `payload` to the
+    frozenset of permission names the user's roles grant there. Raises
+    `KeyError` if the payload carries no organizations.
+    """
+    if 'orgs' in payload:
+        return decode_compact_organization_permissions(payload)
+
+    return {
+        organization['id']: frozenset(
+            permission['name']
+            for role in organization['roles']
+            for permission in role['permissions']
+        )
+        for organization in payload['organizations']
+    }
+
+
+# Claims carrying the authorization data of each `TOKEN_FORMAT`.
+AUTHORIZATION_CLAIMS = {
+    'full': ('organizations', 'permissions'),
+    'compact': ('pcv', 'perms', 'orgs'),
+}
+
+
+def get_authorization_claims(user):
+    """
+    Returns the authorization claims of a new token of `user`, stamped with
+    the authorization version (`av`) they reflect.
+    """
+    with timer('authorization_data'):
+        if shared_authorization_cache.enabled:
+            # `user` was just loaded from the primary by the login or refresh
+            # views, so its version is current. Data read elsewhere, e.g.
+            # for a stale `user`, is only shared if it is of that version.
+            authorization_data, version = shared_authorization_cache.get_or_compute(
+                shared_authorization_cache.make_key(user.pk, user.authorization_version),
+                lambda: AuthorizationSnapshot.objects.get_data_for_user(user),
+                is_cacheable=lambda value: value[1] == user.authorization_version,
+            )
+        else:
+            authorization_data, version = AuthorizationSnapshot.objects.get_data_for_user(user)
+
+    if app_settings.TOKEN_FORMAT == 'compact':
+        claims = encode_compact_authorization(authorization_data)
+    else:
+        claims = {
+            'organizations': authorization_data['organizations'],
+            'permissions': authorization_data['permissions'],
+        }
+
+    claims['av'] = version
+    return claims
+
+
+def get_current_authorization_claims(payload, user):
+    """
+    Returns the authorization claims of `payload` if they are still current
+    for `user`, that is if the user's authorization version did not change
+    since they were issued, or `None` if they must be rebuilt.
+    """
+    if payload.get('av') != user.authorization_version:
+        return None
+
+    names = AUTHORIZATION_CLAIMS[app_settings.TOKEN_FORMAT]
+    if any(name not in payload for name in names):
+        # Issued in another token format.
+        return None
+
+    if app_settings.TOKEN_FORMAT == 'compact' and payload['pcv'] != get_catalogue().permission_version:
+        return None
+
+    claims = dict((name, payload[name]) for name in names)
+    claims['av'] = payload['av']
+    return claims
+
+
+def jwt_payload_handler(user, authorization_claims=None):
+    """
+    Builds the payload of a new token of `user`, carrying the given
+    `authorization_claims` or else freshly looked up ones.
+    """
     username_field = get_username_field()
     username = get_username(user)
 
@@ -20,14 +161,22 @@ def jwt_payload_handler(user):
         DeprecationWarning
     )
 
+    if authorization_claims is None:
+        authorization_claims = get_authorization_claims(user)
+
+    now = datetime.utcnow()
     payload = {
         'user_id': user.pk,
         'email': user.email,
         'username': username,
-        'organizations': user.get_organizations(),
-        'permissions': PermissionSerializer(user.get_permissions(), many=True).data,
-        'exp': datetime.utcnow() + api_settings.JWT_EXPIRATION_DELTA
+        'exp': now + api_settings.JWT_EXPIRATION_DELTA,
+        # Identify the token and when it was issued, for `auth_app.revocation`,
+        # to the microsecond to tell tokens issued right before and after a
+        # revocation apart.
+        'jti': uuid.uuid4().hex,
+        'iat': get_new_token_issued_at(user.pk, timegm(now.utctimetuple()) + now.microsecond / 1e6),
     }
+    payload.update(authorization_claims)
 
     if isinstance(user.pk, uuid.UUID):
         payload['user_id'] = str(user.pk)
@@ -50,6 +199,61 @@ def jwt_payload_handler(user):
     return payload
 
 
+def jwt_decode_handler(token):
+    """
+    Returns the verified payload of `token`, verifying the signature only the
+    first time a given token is seen by this process, or by any worker if a
+    shared cache is configured. Cached payloads are dropped no later than
+    the token's expiration time.
+    """
+    if not isinstance(token, bytes):
+        token = token.encode('utf-8')
+
+    key = hashlib.sha256(token).hexdigest()
+
+    payload = verified_token_cache.get(key)
+    if payload is not None:
+        count('authserver_token_cache_total', result='hit')
+        return payload
+
+    count('authserver_token_cache_total', result='miss')
+
+    claims = None
+    if shared_verified_token_cache.enabled:
+        claims = shared_verified_token_cache.get(key)
+
+    if claims is None:
+        with timer('jwt_verify'):
+            claims = get_key_ring().decode(token)
+
+        if shared_verified_token_cache.enabled:
+            shared_verified_token_cache.set(key, claims, timeout=get_token_cache_timeout(claims))
+
+    payload = VerifiedPayload(claims)
+    verified_token_cache.set(key, payload, expires_at=payload.get('exp'))
+    return payload
+
+
+def get_token_cache_timeout(claims):
+    """
+    Returns how long the verified `claims` of a token may be cached: no
+    longer than `TOKEN_CACHE_TTL`, nor past the token's expiration.
+    """
+    timeout = app_settings.TOKEN_CACHE_TTL
+    if claims.get('exp') is not None:
+        timeout = min(timeout, claims['exp'] - time.time())
+    return max(timeout, 0)
+
+
+def jwt_encode_handler(payload):
+    """
+    Signs `payload` with the signing key of the key ring, stamping its
+    `kid` in the token header.
+    """
+    with timer('jwt_sign'):
+        return get_key_ring().encode(payload)
+
+
 def jwt_get_user_id_from_payload_handler(payload):
     """
     Override this function if user_id is formatted differently in payload
@@ -0,0 +1,308 @@
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import io
+import json
+import threading
+
+import jwt
+from jwt.algorithms import Algorithm
+from jwt.utils import base64url_encode, number_to_bytes
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey,
+    Ed25519PublicKey,
+)
+from django.test.signals import setting_changed
+from django.utils.functional import cached_property
+from rest_framework_jwt.settings import api_settings
+
+from auth_app.conf import app_settings
+
+
+class EdDSAAlgorithm(Algorithm):
+    """
+    Ed25519 signatures (RFC 8037), which PyJWT does not provide yet.
+    Only accepts already parsed key objects.
+    """
+
+    def prepare_key(self, key):
+        if not isinstance(key, (Ed25519PrivateKey, Ed25519PublicKey)):
+            raise TypeError('Expecting an Ed25519 key object.')
+        return key
+
+    def sign(self, msg, key):
+        return key.sign(msg)
+
+    def verify(self, msg, key, sig):
+        try:
+            key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+
+try:
+    jwt.register_algorithm('EdDSA', EdDSAAlgorithm())
+except ValueError:
+    # Already registered, e.g. by a newer PyJWT.
+    pass
+
+
+SUPPORTED_ALGORITHMS = ('RS256', 'RS384', 'RS512', 'ES256', 'ES384', 'ES512', 'EdDSA')
+
+
+class SigningKey(object):
+    """
+    A key of the key ring, holding parsed key objects so that tokens are
+    signed and verified without parsing PEM data on every call.
+    """
+
+    def __init__(self, kid, algorithm, public_key, private_key=None):
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise ValueError('Unsupported signing algorithm: %s' % algorithm)
+
+        self.kid = kid
+        self.algorithm = algorithm
+        self.public_key = public_key
+        self.private_key = private_key
+
+    @classmethod
+    def from_pem(cls, algorithm, public_pem=None, private_pem=None, kid=None):
+        backend = default_backend()
+
+        private_key = None
+        if private_pem:
+            private_key = serialization.load_pem_private_key(
+                to_bytes(private_pem), password=None, backend=backend,
+            )
+
+        if public_pem:
+            public_key = serialization.load_pem_public_key(to_bytes(public_pem), backend=backend)
+        elif private_key is not None:
+            public_key = private_key.public_key()
+        else:
+            raise ValueError('A public or private key is required.')
+
+        if kid is None:
+            kid = get_key_id(public_key)
+
+        return cls(kid, algorithm, public_key, private_key)
+
+    @classmethod
+    def from_settings(cls, key_settings):
+        """
+        Builds a key from a `SIGNING_KEYS` entry: a dict with `algorithm`,
+        an optional `kid` and the PEM data as `public_key`/`private_key` or
+        the paths to PEM files as `public_key_file`/`private_key_file`.
+        """
+        pems = {}
+        for name in ('public_key', 'private_key'):
+            pems[name] = key_settings.get(name)
+            path = key_settings.get('%s_file' % name)
+            if pems[name] is None and path:
+                with io.open(path, 'rb') as f:
+                    pems[name] = f.read()
+
+        return cls.from_pem(
+            key_settings['algorithm'],
+            public_pem=pems['public_key'],
+            private_pem=pems['private_key'],
+            kid=key_settings.get('kid'),
+        )
+
+    def public_bytes(self):
+        return self.public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+
+    def to_jwk(self):
+        """
+        Returns the public key as a JSON Web Key (RFC 7517).
+        """
+        jwk = {
+            'kid': self.kid,
+            'alg': self.algorithm,
+            'use': 'sig',
+        }
+
+        if isinstance(self.public_key, rsa.RSAPublicKey):
+            numbers = self.public_key.public_numbers()
+            jwk.update({
+                'kty': 'RSA',
+                'n': encode_uint(numbers.n),
+                'e': encode_uint(numbers.e),
+            })
+        elif isinstance(self.public_key, ec.EllipticCurvePublicKey):
+            numbers = self.public_key.public_numbers()
+            size = (self.public_key.curve.key_size + 7) // 8
+            jwk.update({
+                'kty': 'EC',
+                'crv': JWK_CURVES[self.public_key.curve.name],
+                'x': encode_uint(numbers.x, size),
+                'y': encode_uint(numbers.y, size),
+            })
+        else:
+            jwk.update({
+                'kty': 'OKP',
+                'crv': 'Ed25519',
+                'x': base64url_encode(self.public_key.public_bytes(
+                    encoding=serialization.Encoding.Raw,
+                    format=serialization.PublicFormat.Raw,
+                )).decode('ascii'),
+            })
+
+        return jwk
+
+
+class KeyRing(object):
+    """
+    The keys tokens may be verified with, looked up by the `kid` token
+    header, and the one new tokens are signed with. Keeping retired keys in
+    the ring lets tokens they signed stay valid until they expire.
+    """
+
+    def __init__(self, keys, signing_kid=None):
+        if not keys:
+            raise ValueError('The key ring needs at least one key.')
+
+        self.keys = dict((key.kid, key) for key in keys)
+        self.signing_key = self.keys[signing_kid] if signing_kid else keys[0]
+
+        if self.signing_key.private_key is None:
+            raise ValueError('The signing key %s has no private key.' % self.signing_key.kid)
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Builds the ring from `AUTH_APP['SIGNING_KEYS']`, or from the single
+        `JWT_AUTH` key pair and algorithm if no keys are configured.
+        """
+        keys_settings = app_settings.SIGNING_KEYS
+        if keys_settings:
+            keys = [SigningKey.from_settings(key_settings) for key_settings in keys_settings]
+            return cls(keys, app_settings.SIGNING_KEY_ID)
+
+        key = SigningKey.from_pem(
+            api_settings.JWT_ALGORITHM,
+            public_pem=api_settings.JWT_PUBLIC_KEY,
+            private_pem=api_settings.JWT_PRIVATE_KEY,
+        )
+        return cls([key])
+
+    def get_verification_key(self, header):
+        """
+        Returns the key matching the `kid` of a token header. Tokens issued
+        before key ids were introduced are checked with the signing key.
+        """
+        kid = header.get('kid')
+        if kid is None:
+            return self.signing_key
+
+        try:
+            return self.keys[kid]
+        except KeyError:
+            raise jwt.DecodeError('Unknown signing key id.')
+
+    @cached_property
+    def jwks(self):
+        """
+        The JSON Web Key Set (RFC 7517) of the public keys, serialized once
+        per key ring, and its strong ETag.
+        """
+        document = json.dumps(
+            {'keys': [self.keys[kid].to_jwk() for kid in sorted(self.keys)]},
+            separators=(',', ':'),
+            sort_keys=True,
+        ).encode('utf-8')
+        return document, hashlib.sha256(document).hexdigest()
+
+    def encode(self, payload):
+        key = self.signing_key
+        return jwt.encode(
+            payload,
+            key.private_key,
+            key.algorithm,
+            headers={'kid': key.kid},
+        ).decode('utf-8')
+
+    def decode(self, token):
+        key = self.get_verification_key(jwt.get_unverified_header(token))
+
+        options = {
+            'verify_exp': api_settings.JWT_VERIFY_EXPIRATION,
+        }
+
+        # Each key only accepts its own algorithm.
+        return jwt.decode(
+            token,
+            key.public_key,
+            api_settings.JWT_VERIFY,
+            options=options,
+            leeway=api_settings.JWT_LEEWAY,
+            audience=api_settings.JWT_AUDIENCE,
+            issuer=api_settings.JWT_ISSUER,
+            algorithms=[key.algorithm],
+        )
+
+
+# Curve names of cryptography and the matching JWK `crv` values.
+JWK_CURVES = {
+    'secp256r1': 'P-256',
+    'secp384r1': 'P-384',
+    'secp521r1': 'P-521',
+}
+
+
+def encode_uint(value, size=None):
+    """
+    Encodes a non-negative integer as the unpadded base64url string of its
+    big-endian bytes, left-padded to `size` bytes if given.
+    """
+    if size is None:
+        size = max(1, (value.bit_length() + 7) // 8)
+    return base64url_encode(number_to_bytes(value, size)).decode('ascii')
+
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def get_key_id(public_key):
+    """
+    Returns a key id derived from the DER encoding of `public_key`.
+    """
+    der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return hashlib.sha256(der).hexdigest()[:16]
+
+
+_key_ring = None
+_key_ring_lock = threading.Lock()
+
+
+def get_key_ring():
+    global _key_ring
+
+    if _key_ring is None:
+        with _key_ring_lock:
+            if _key_ring is None:
+                _key_ring = KeyRing.from_settings()
+    return _key_ring
+
+
+def reload_key_ring(*args, **kwargs):
+    global _key_ring
+    if kwargs['setting'] in ('AUTH_APP', 'JWT_AUTH'):
+        _key_ring = None
+
+
+setting_changed.connect(reload_key_ring)
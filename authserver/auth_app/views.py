@@ -1,26 +1,131 @@
-from django.http import Http404
+import json
+
+from django.core.cache import caches
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import six
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import parse_etags, quote_etag
+from django.views.generic import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.views import JSONWebTokenAPIView
 
+from . import instrumentation
+from .catalogue import get_catalogue
+from .conf import app_settings
 from .models import User
-from .permissions import JWTPermission
-from .serializers import UserSerializer
+from .pagination import IdCursorPagination
+from .permissions import IsAuthenticatedJWT, JWTPermission, OrganizationJWTPermission, check_permissions
+from .routers import get_read_database
+from .serializers import (
+    BatchPermissionCheckSerializer,
+    BatchVerifyJSONWebTokenSerializer,
+    JSONWebTokenSerializer,
+    RefreshJSONWebTokenSerializer,
+    RevokeJSONWebTokenSerializer,
+    UserSerializer,
+    VerifyJSONWebTokenSerializer,
+    user_row_serializer,
+)
+from .utils.keys import get_key_ring
+
+
+def dump_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class ResourceAPIViewMetaclass(type):
+    """
+    Precomputes, at class creation, the permission name required for each
+    HTTP method of views declaring a `resource_name`.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(ResourceAPIViewMetaclass, cls).__init__(name, bases, attrs)
+
+        resource_name = getattr(cls, 'resource_name', None)
+        if resource_name is not None:
+            cls.required_permissions = {
+                method.upper(): '%s-%s' % (resource_name, method.upper())
+                for method in cls.http_method_names
+            }
 
 
-class UserList(APIView):
+class ResourceAPIView(six.with_metaclass(ResourceAPIViewMetaclass, APIView)):
+    """
+    Base class for views protected by `JWTPermission`.
+    """
+    resource_name = None
+
+
+class UserList(ResourceAPIView):
     """
     List all users, or create a new user.
+
+    Listing is paginated on `id` when a `cursor` or `limit` query parameter
+    is given, and streamed row by row with `?stream=json` or
+    `?stream=ndjson`.
     """
     authentication_classes = (JSONWebTokenAuthentication,)
     permission_classes = (JWTPermission,)
     resource_name = 'Users'
+    pagination_class = IdCursorPagination
+
+    stream_chunk_size = 500
+    stream_content_types = {
+        'json': 'application/json',
+        'ndjson': 'application/x-ndjson',
+    }
 
     def get(self, request, format=None):
-        snippets = User.objects.all()
-        serializer = UserSerializer(snippets, many=True)
-        return Response(serializer.data)
+        users = User.objects.using(get_read_database())
+
+        stream_format = request.query_params.get('stream')
+        if stream_format in self.stream_content_types:
+            return StreamingHttpResponse(
+                self.stream_users(users, stream_format),
+                content_type=self.stream_content_types[stream_format],
+            )
+
+        if 'cursor' in request.query_params or 'limit' in request.query_params:
+            paginator = self.pagination_class()
+            rows = paginator.paginate_queryset(
+                users.values(*user_row_serializer.values_fields), request, view=self,
+            )
+            with instrumentation.timer('serialization'):
+                data = user_row_serializer.to_representation_many(rows)
+            return paginator.get_paginated_response(data)
+
+        rows = list(users.values(*user_row_serializer.values_fields))
+        with instrumentation.timer('serialization'):
+            data = user_row_serializer.to_representation_many(rows)
+        return Response(data)
+
+    def stream_users(self, users, stream_format):
+        rows = users.order_by('id').values(*user_row_serializer.values_fields).iterator()
+
+        if stream_format == 'ndjson':
+            separator, opening, closing = '\n', '', '\n'
+        else:
+            separator, opening, closing = ',', '[', ']'
+
+        yield opening
+        chunk = []
+        first = True
+        for row in rows:
+            chunk.append(dump_json(user_row_serializer.to_representation(row)))
+            if len(chunk) >= self.stream_chunk_size:
+                yield ('' if first else separator) + separator.join(chunk)
+                chunk = []
+                first = False
+        if chunk:
+            yield ('' if first else separator) + separator.join(chunk)
+            first = False
+        if stream_format == 'json' or not first:
+            yield closing
 
     def post(self, request, format=None):
         serializer = UserSerializer(data=request.data)
@@ -30,7 +135,42 @@ class UserList(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserDetail(APIView):
+class OrganizationUserList(ResourceAPIView):
+    """
+    List the users holding a role in an organization or any organization
+    below it, to callers granted `Users-GET` in that organization or one of
+    its ancestors.
+
+    Listing is paginated on `id` when a `cursor` or `limit` query parameter
+    is given.
+    """
+    authentication_classes = (JSONWebTokenAuthentication,)
+    permission_classes = (OrganizationJWTPermission,)
+    resource_name = 'Users'
+    pagination_class = IdCursorPagination
+
+    def get(self, request, organization_id, format=None):
+        # A single join on the closure table covers the whole subtree.
+        users = User.objects.using(get_read_database()).filter(
+            roleuserorgassociation__organization__ancestor_links__ancestor_id=organization_id,
+        ).distinct()
+
+        if 'cursor' in request.query_params or 'limit' in request.query_params:
+            paginator = self.pagination_class()
+            rows = paginator.paginate_queryset(
+                users.values(*user_row_serializer.values_fields), request, view=self,
+            )
+            with instrumentation.timer('serialization'):
+                data = user_row_serializer.to_representation_many(rows)
+            return paginator.get_paginated_response(data)
+
+        rows = list(users.order_by('id').values(*user_row_serializer.values_fields))
+        with instrumentation.timer('serialization'):
+            data = user_row_serializer.to_representation_many(rows)
+        return Response(data)
+
+
+class UserDetail(ResourceAPIView):
     """
     Retrieve, update or delete a user instance.
     """
@@ -45,9 +185,14 @@ class UserDetail(APIView):
             raise Http404
 
     def get(self, request, pk, format=None):
-        snippet = self.get_object(pk)
-        serializer = UserSerializer(snippet)
-        return Response(serializer.data)
+        row = User.objects.using(get_read_database()).filter(
+            pk=pk,
+        ).values(*user_row_serializer.values_fields).first()
+        if row is None:
+            raise Http404
+        with instrumentation.timer('serialization'):
+            data = user_row_serializer.to_representation(row)
+        return Response(data)
 
     def put(self, request, pk, format=None):
         snippet = self.get_object(pk)
@@ -61,3 +206,147 @@ class UserDetail(APIView):
         snippet = self.get_object(pk)
         snippet.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PermissionCatalogueDetail(APIView):
+    """
+    Retrieve the role and permission catalogue that compact tokens reference.
+    """
+    authentication_classes = (JSONWebTokenAuthentication,)
+    permission_classes = (IsAuthenticatedJWT,)
+
+    def get(self, request, format=None):
+        catalogue = get_catalogue()
+        response = Response(catalogue.as_dict())
+        response['ETag'] = '"%s"' % catalogue.version
+        return response
+
+
+class ObtainJSONWebToken(JSONWebTokenAPIView):
+    """
+    Return a token for valid credentials.
+    """
+    serializer_class = JSONWebTokenSerializer
+
+
+class RefreshJSONWebToken(JSONWebTokenAPIView):
+    """
+    Return a refreshed token, reusing the authorization claims of the
+    submitted token while they are current.
+    """
+    serializer_class = RefreshJSONWebTokenSerializer
+
+
+class VerifyJSONWebToken(JSONWebTokenAPIView):
+    """
+    Verify a token, which must not be revoked.
+    """
+    serializer_class = VerifyJSONWebTokenSerializer
+
+
+class RevokeJSONWebToken(JSONWebTokenAPIView):
+    """
+    Revoke a token, e.g. on logout. Other processes reject it within
+    `REVOCATION_REFRESH_INTERVAL` seconds.
+    """
+    serializer_class = RevokeJSONWebTokenSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BatchVerifyJSONWebToken(JSONWebTokenAPIView):
+    """
+    Verify many tokens in one request. Responds with one result per token,
+    in the order of the request, whether or not each token is valid.
+    """
+    serializer_class = BatchVerifyJSONWebTokenSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.validated_data)
+
+
+class JSONWebKeySetDetail(View):
+    """
+    Serve the public keys tokens are verified with as a JSON Web Key Set, so
+    that other services can verify tokens offline, matching the `kid`
+    header of a token to a key. Clients should revalidate with
+    `If-None-Match` once the response is stale, and refetch early when they
+    meet an unknown `kid`.
+    """
+
+    def get(self, request):
+        document, etag = get_key_ring().jwks
+
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(document, content_type='application/json')
+
+        response['ETag'] = quote_etag(etag)
+        patch_cache_control(response, public=True, max_age=app_settings.JWKS_MAX_AGE)
+        return response
+
+
+class PermissionCheck(ResourceAPIView):
+    """
+    Check many `[user_id, organization_id, permission_name]` tuples at once.
+    Responds with one boolean per check, in the order of the request.
+    """
+    authentication_classes = (JSONWebTokenAuthentication,)
+    permission_classes = (JWTPermission,)
+    resource_name = 'Permissions'
+
+    def post(self, request, format=None):
+        serializer = BatchPermissionCheckSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with instrumentation.timer('batch_permission_check'):
+            results = check_permissions(serializer.validated_data['checks'])
+        return Response({'results': results})
+
+
+class MetricsView(View):
+    """
+    Serve the instrumentation metrics in the Prometheus text format, to
+    requests bearing `METRICS_TOKEN` only (Prometheus' `bearer_token`).
+    Without a token configured, the endpoint does not exist.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = app_settings.METRICS_TOKEN
+        if not token:
+            raise Http404
+
+        scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme.lower() != 'bearer' or not constant_time_compare(credentials.strip(), token):
+            response = HttpResponse('Authentication credentials were not provided.', status=401)
+            response['WWW-Authenticate'] = 'Bearer realm="metrics"'
+            return response
+
+        return super(MetricsView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        self.collect_shared_cache_metrics()
+        return HttpResponse(
+            instrumentation.registry.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
+
+    def collect_shared_cache_metrics(self):
+        alias = app_settings.CACHE_ALIAS
+        if alias is None:
+            return
+
+        # Only servers such as Redis report their evictions.
+        get_stats = getattr(caches[alias], 'get_stats', None)
+        if get_stats is not None:
+            instrumentation.registry.set(
+                'authserver_shared_cache_evictions',
+                get_stats()['evictions'],
+                cache=alias,
+            )
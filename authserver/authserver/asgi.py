@@ -0,0 +1,23 @@
+"""
+ASGI config for authserver project. Requires Python 3.5+ and an ASGI 3
+server, e.g.:
+
+    uvicorn authserver.asgi:application --workers 4
+
+It exposes the ASGI callable as a module-level variable named
+``application``. The token endpoints are served asynchronously by
+`auth_app.asgi.TokenApplication`; every other request is passed to the
+WSGI application.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "authserver.settings")
+
+wsgi_application = get_wsgi_application()
+
+from auth_app.asgi import TokenApplication  # noqa: E402
+
+application = TokenApplication(wsgi_application)
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auth_app.middleware.InstrumentationMiddleware',
+    'auth_app.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +85,9 @@ with open(PRIVATE_RSA_KEY_FILEPATH, 'r') as f:
 with open(PUBLIC_RSA_KEY_FILEPATH, 'r') as f:
     PUBLIC_RSA_KEY = f.read()
 
+PRIVATE_EC_KEY_FILEPATH = os.path.join(HERE, 'ec-key/private.pem')
+PUBLIC_EC_KEY_FILEPATH = os.path.join(HERE, 'ec-key/public.pem')
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -98,6 +103,12 @@ JWT_AUTH = {
     'JWT_PAYLOAD_HANDLER':
     'auth_app.utils.jwt.jwt_payload_handler',
 
+    'JWT_ENCODE_HANDLER':
+    'auth_app.utils.jwt.jwt_encode_handler',
+
+    'JWT_DECODE_HANDLER':
+    'auth_app.utils.jwt.jwt_decode_handler',
+
     'JWT_PAYLOAD_GET_USER_ID_HANDLER':
     'auth_app.utils.jwt.jwt_get_user_id_from_payload_handler',
 
@@ -113,26 +124,213 @@ JWT_AUTH = {
     'JWT_ALGORITHM': 'RS512',
     'JWT_VERIFY': True,
     'JWT_VERIFY_EXPIRATION': True,
+    # Seconds of clock skew tolerated between the hosts issuing and
+    # verifying tokens, for `exp` and `iat`.
+    'JWT_LEEWAY': 30,
     'JWT_EXPIRATION_DELTA': datetime.timedelta(seconds=3600),
     'JWT_ALLOW_REFRESH': True,
     'JWT_REFRESH_EXPIRATION_DELTA': datetime.timedelta(days=7),
     'JWT_AUTH_HEADER_PREFIX': 'JWT',
 }
 
+AUTH_APP = {
+    # 'full' embeds organizations, roles and permissions in tokens, 'compact'
+    # references them by ID against the catalogue served at
+    # api/permissions/catalogue/. Either way, a token grants the permissions
+    # its roles granted when it was issued: editing a role only applies to
+    # tokens issued or refreshed afterwards.
+    'TOKEN_FORMAT': 'full',
+
+    # Verified token payloads kept in memory, so that a token is only
+    # signature-checked once per process until it expires.
+    'TOKEN_CACHE_MAX_SIZE': 10000,
+    'TOKEN_CACHE_TTL': 300,
+
+    # The CACHES alias authorization data and verified tokens are shared
+    # through, or None to only cache them per process. Entries live for
+    # CACHE_TIMEOUT seconds; a worker waits at most CACHE_LOCK_TIMEOUT
+    # seconds for another one to compute a missing entry.
+    'CACHE_ALIAS': 'authorization',
+    'CACHE_TIMEOUT': 300,
+    'CACHE_LOCK_TIMEOUT': 5,
+
+    # PBKDF2 iterations of new password hashes. Passwords hashed with
+    # another count are re-hashed on the next successful login.
+    'PASSWORD_HASH_ITERATIONS': 30000,
+
+    # Threads logins check and re-hash passwords on (None for one per CPU),
+    # and how many more hashing jobs may wait for one. Logins beyond that,
+    # or waiting longer than PASSWORD_HASHING_TIMEOUT seconds, are answered
+    # with 503 Service Unavailable. User.set_password() hashes in the
+    # calling thread, for the admin, management commands and scripts.
+    'PASSWORD_HASHING_WORKERS': None,
+    'PASSWORD_HASHING_MAX_PENDING': 16,
+    'PASSWORD_HASHING_TIMEOUT': 10,
+
+    # Aliases of DATABASES that token issuance (organizations and
+    # permissions) and the user GET endpoints read from. Once a request
+    # writes, it and the client's requests of the next REPLICA_PIN_SECONDS
+    # read from 'default' instead, so clients read their own writes.
+    'READ_REPLICAS': [],
+    'REPLICA_PIN_SECONDS': 15,
+
+    # Seconds between rebuilds of the in-memory revocation list, hence how
+    # long a token revoked by another process stays usable here. The Bloom
+    # filter of revoked token IDs is sized for at least
+    # REVOCATION_BLOOM_MIN_CAPACITY of them at REVOCATION_BLOOM_ERROR_RATE
+    # false positives, each costing a query.
+    'REVOCATION_REFRESH_INTERVAL': 5,
+    'REVOCATION_BLOOM_MIN_CAPACITY': 10000,
+    'REVOCATION_BLOOM_ERROR_RATE': 0.001,
+
+    # Threads of each authserver.asgi process running database queries,
+    # and signing and verifying tokens (None for one per CPU).
+    'ASGI_DATABASE_WORKERS': 8,
+    'ASGI_SIGNING_WORKERS': None,
+
+    # Keys tokens are verified with, selected by the `kid` token header.
+    # New tokens are signed with `SIGNING_KEY_ID`; to rotate, add the new
+    # key, switch `SIGNING_KEY_ID` to it, and remove the old key once the
+    # tokens it signed have expired. Algorithms: RS256/384/512,
+    # ES256/384/512 and EdDSA (Ed25519).
+    'SIGNING_KEYS': [
+        {
+            'kid': 'rs512-1',
+            'algorithm': 'RS512',
+            'private_key_file': PRIVATE_RSA_KEY_FILEPATH,
+            'public_key_file': PUBLIC_RSA_KEY_FILEPATH,
+        },
+        {
+            'kid': 'es256-1',
+            'algorithm': 'ES256',
+            'private_key_file': PRIVATE_EC_KEY_FILEPATH,
+            'public_key_file': PUBLIC_EC_KEY_FILEPATH,
+        },
+    ],
+    'SIGNING_KEY_ID': 'rs512-1',
+
+    # Seconds downstream services may cache the keys served at
+    # api/tokens/jwks/. Publish a new key at least this long before
+    # signing with it.
+    'JWKS_MAX_AGE': 86400,
+
+    # Most tokens api/tokens/verify/batch/ accepts in one request.
+    'BATCH_VERIFY_MAX_TOKENS': 100,
+
+    # Most checks api/permissions/check/ accepts in one request.
+    'BATCH_PERMISSION_CHECK_MAX_CHECKS': 1000,
+
+    # Per-request latency, query and JWT timings, served at api/metrics/
+    # and optionally logged as JSON lines on the `auth_app.instrumentation`
+    # logger. The endpoint answers requests with an `Authorization: Bearer
+    # <METRICS_TOKEN>` header only, and 404 to all while it is None.
+    'INSTRUMENTATION_ENABLED': False,
+    'INSTRUMENTATION_LOG': False,
+    'METRICS_TOKEN': None,
+}
+
 WSGI_APPLICATION = 'authserver.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
+# Connections are taken from a per-process pool and released to it at the
+# end of each request (keep CONN_MAX_AGE at 0). POOL sets MAX_SIZE (open
+# connections), IDLE_TIMEOUT (seconds before an idle connection is closed),
+# HEALTH_CHECK_INTERVAL (seconds idle before a connection is pinged on
+# reuse) and TIMEOUT (seconds to wait for a connection). The SQLite backend
+# also switches to WAL journaling and sets PRAGMAS, see
+# auth_app/db/backends/sqlite3/base.py.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'auth_app.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'POOL': {
+            'MAX_SIZE': 10,
+            'IDLE_TIMEOUT': 300,
+            'HEALTH_CHECK_INTERVAL': 30,
+            'TIMEOUT': 10,
+        },
+        # 'PRAGMAS': {'cache_size': -64000},
+    },
+    # A pool of read-only connections to the same file; with WAL, readers
+    # do not wait for the writer.
+    # 'read': {
+    #     'ENGINE': 'auth_app.db.backends.sqlite3',
+    #     'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    #     'READ_ONLY': True,
+    #     'POOL': {'MAX_SIZE': 20},
+    # },
+    # A second file standing in for a read replica, refreshed from the
+    # primary with `python manage.py sync_sqlite_replica replica --interval 5`
+    # to simulate replication lag. List it in AUTH_APP['READ_REPLICAS'].
+    # 'replica': {
+    #     'ENGINE': 'auth_app.db.backends.sqlite3',
+    #     'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+    #     'READ_ONLY': True,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+    # 'default': {
+    #     'ENGINE': 'auth_app.db.backends.postgresql',
+    #     'NAME': 'authserver',
+    #     'USER': 'authserver',
+    #     'HOST': 'localhost',
+    #     'POOL': {'MAX_SIZE': 20},
+    # },
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Authorization data and verified tokens shared by the workers, see
+    # AUTH_APP['CACHE_ALIAS']. Local memory is per process; to share it
+    # between the workers of a host use e.g.
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': '/var/tmp/authserver_cache',
+    # and between hosts
+    #     'BACKEND': 'auth_app.cache_backends.RedisCache',
+    #     'LOCATION': 'redis://localhost:6379/0',
+    'authorization': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'authorization',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
+# Writes go to 'default' and pin the request to it; see
+# AUTH_APP['READ_REPLICAS'] for the reads served by replicas.
+DATABASE_ROUTERS = [
+    'auth_app.routers.ReplicaRouter',
+]
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/1.10/topics/auth/passwords/
+
+# The first hasher encodes new passwords; the others only verify existing
+# hashes, which are upgraded on login.
+PASSWORD_HASHERS = [
+    'auth_app.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+]
+
+AUTHENTICATION_BACKENDS = [
+    'auth_app.backends.HashingPoolModelBackend',
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
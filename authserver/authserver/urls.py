@@ -16,19 +16,20 @@ Including another URLconf
 from django.conf.urls import url
 from django.contrib import admin
 
-from rest_framework_jwt.views import (
-    obtain_jwt_token,
-    refresh_jwt_token,
-    verify_jwt_token,
-)
-
 import auth_app.views as auth_app_views
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
-    url(r'^api/tokens/auth/', obtain_jwt_token),
-    url(r'^api/tokens/refresh/', refresh_jwt_token),
-    url(r'^api/tokens/verify/', verify_jwt_token),
+    url(r'^api/tokens/auth/', auth_app_views.ObtainJSONWebToken.as_view()),
+    url(r'^api/tokens/refresh/', auth_app_views.RefreshJSONWebToken.as_view()),
+    url(r'^api/tokens/verify/batch/$', auth_app_views.BatchVerifyJSONWebToken.as_view()),
+    url(r'^api/tokens/verify/', auth_app_views.VerifyJSONWebToken.as_view()),
+    url(r'^api/tokens/revoke/$', auth_app_views.RevokeJSONWebToken.as_view()),
+    url(r'^api/tokens/jwks/$', auth_app_views.JSONWebKeySetDetail.as_view()),
     url(r'^api/users/$', auth_app_views.UserList.as_view()),
     url(r'^api/users/(?P<pk>[0-9]+)/$', auth_app_views.UserDetail.as_view()),
+    url(r'^api/organizations/(?P<organization_id>[0-9]+)/users/$', auth_app_views.OrganizationUserList.as_view()),
+    url(r'^api/permissions/catalogue/$', auth_app_views.PermissionCatalogueDetail.as_view()),
+    url(r'^api/permissions/check/$', auth_app_views.PermissionCheck.as_view()),
+    url(r'^api/metrics/$', auth_app_views.MetricsView.as_view()),
 ]
@@ -0,0 +1,361 @@
+"""
+Benchmarks token issuance, verification, permission checks and the user
+endpoints against a throwaway test database seeded at a configurable scale.
+
+Run from the `authserver` directory:
+
+    python ../scripts/benchmark.py --users 2000 --organizations 50 \
+        --roles 20 --resources 25 --output bench.json
+
+and compare a later run against it, failing on regressions:
+
+    python ../scripts/benchmark.py ... --baseline bench.json --max-regression 0.25
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'authserver.settings')
+
+import django  # noqa: E402
+
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+# Passwords are hashed with MD5 unless --real-hasher is given, so that
+# seeding and login measure the authorization code rather than PBKDF2.
+FAST_PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def build_fixture(users, organizations, roles, resources, roles_per_user, seed):
+    """
+    Returns a fixture for `initialize_data.bulk_load`: a group organization
+    with `organizations - 1` branches, `resources` x `METHODS` permissions
+    (plus `Users-GET`), `roles` roles holding random permissions and
+    `users` users each holding `roles_per_user` random roles in random
+    organizations.
+    """
+    rng = random.Random(seed)
+
+    organization_names = ['Benchmark Group'] + [
+        'Benchmark Branch %d' % i for i in range(1, organizations)
+    ]
+    permission_names = ['Users-GET'] + [
+        'Resource%d-%s' % (i, method) for i in range(resources) for method in METHODS
+    ]
+    role_names = ['Benchmark-Role-%d' % i for i in range(roles)]
+
+    fixture_roles = []
+    for i, name in enumerate(role_names):
+        granted = rng.sample(permission_names[1:], max(1, len(permission_names) // 4))
+        if i == 0:
+            granted.append('Users-GET')
+        fixture_roles.append({
+            'name': name,
+            'description': 'Benchmark role %d' % i,
+            'permissions': granted,
+        })
+
+    fixture_users = []
+    for i in range(users):
+        associations = [{'role': role_names[0], 'organization': organization_names[0]}] if i == 0 else []
+        for _ in range(roles_per_user):
+            associations.append({
+                'role': rng.choice(role_names),
+                'organization': rng.choice(organization_names),
+            })
+        fixture_users.append({
+            'email': 'user%d@benchmark.example.com' % i,
+            'name': 'Benchmark User %d' % i,
+            'password': 'password',
+            'roles': associations,
+        })
+
+    return {
+        'permissions': [{'name': name, 'description': 'Benchmark permission'} for name in permission_names],
+        'organizations': [
+            {'name': name, 'parent': None if i == 0 else organization_names[0]}
+            for i, name in enumerate(organization_names)
+        ],
+        'roles': fixture_roles,
+        'users': fixture_users,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name, iterations, operation, setup=None):
+    """
+    Runs `operation(i)` `iterations` times and returns its throughput,
+    latency percentiles (in milliseconds) and average query count.
+    `setup(i)`, if given, runs before each call and is not measured.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    latencies = []
+    queries = 0
+    started = time.time()
+    measured = 0.0
+    for i in range(iterations):
+        if setup is not None:
+            setup(i)
+        with CaptureQueriesContext(connection) as context:
+            t0 = time.time()
+            operation(i)
+            elapsed = time.time() - t0
+        measured += elapsed
+        latencies.append(elapsed * 1000)
+        queries += len(context.captured_queries)
+    wall = time.time() - started
+
+    latencies.sort()
+    return {
+        'name': name,
+        'iterations': iterations,
+        'wall_seconds': round(wall, 4),
+        'ops_per_second': round(iterations / measured, 2) if measured else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 4),
+            'p50': round(percentile(latencies, 0.50), 4),
+            'p90': round(percentile(latencies, 0.90), 4),
+            'p99': round(percentile(latencies, 0.99), 4),
+            'max': round(latencies[-1], 4),
+        },
+        'queries_per_op': round(float(queries) / iterations, 2),
+    }
+
+
+def run_benchmarks(options):
+    from django.core.cache import caches
+    from django.test import Client
+
+    from auth_app.catalogue import invalidate_catalogue
+    from auth_app.conf import app_settings
+    from auth_app.hierarchy import organization_index
+    from auth_app.models import AuthorizationSnapshot, User
+    from auth_app.permissions import JWTPermission
+    from auth_app.revocation import invalidate_revocation_list
+    from auth_app.utils.jwt import jwt_decode_handler, verified_token_cache
+    from auth_app.views import UserList
+
+    client = Client()
+    rng = random.Random(options.seed)
+    user_count = User.objects.count()
+    emails = ['user%d@benchmark.example.com' % i for i in range(user_count)]
+
+    def post_json(path, data):
+        response = client.post(path, data)
+        assert response.status_code == 200, (path, response.status_code, response.content[:200])
+        return json.loads(response.content.decode('utf-8'))
+
+    def clear_caches(i):
+        # Every layer in front of the database: the per-process caches, the
+        # shared cache and the authorization snapshots.
+        verified_token_cache.clear()
+        invalidate_catalogue()
+        organization_index.invalidate()
+        invalidate_revocation_list()
+        if app_settings.CACHE_ALIAS is not None:
+            caches[app_settings.CACHE_ALIAS].clear()
+        AuthorizationSnapshot.objects.all().delete()
+
+    cold_setup = clear_caches if options.cold else None
+
+    results = []
+    tokens = []
+
+    def obtain(i):
+        data = post_json('/api/tokens/auth/', {'email': rng.choice(emails), 'password': 'password'})
+        tokens.append(data['token'])
+
+    results.append(measure('obtain_jwt_token', options.iterations, obtain, cold_setup))
+
+    results.append(measure(
+        'refresh_jwt_token',
+        options.iterations,
+        lambda i: post_json('/api/tokens/refresh/', {'token': tokens[i % len(tokens)]}),
+        cold_setup,
+    ))
+
+    results.append(measure(
+        'verify_jwt_token',
+        options.iterations,
+        lambda i: post_json('/api/tokens/verify/', {'token': tokens[i % len(tokens)]}),
+        cold_setup,
+    ))
+
+    # Permission checks on a request that already went through authentication.
+    permission = JWTPermission()
+    view = UserList()
+
+    class AuthenticatedRequest(object):
+        def __init__(self, user, auth, method):
+            self.user = user
+            self.auth = auth
+            self.method = method
+
+    users_by_email = dict((user.email, user) for user in User.objects.all())
+    requests = []
+    for token in tokens:
+        payload = jwt_decode_handler(token)
+        requests.append(AuthenticatedRequest(users_by_email[payload['username']], token, 'GET'))
+
+    def check_permission(i):
+        permission.has_permission(requests[i % len(requests)], view)
+
+    results.append(measure(
+        'JWTPermission.has_permission',
+        options.iterations * 10,
+        check_permission,
+        cold_setup,
+    ))
+
+    # The first benchmark user holds `Users-GET`.
+    admin_token = post_json('/api/tokens/auth/', {'email': emails[0], 'password': 'password'})['token']
+    headers = {'HTTP_AUTHORIZATION': 'JWT %s' % admin_token}
+    user_ids = list(User.objects.values_list('id', flat=True))
+
+    def get(path):
+        response = client.get(path, **headers)
+        assert response.status_code == 200, (path, response.status_code, response.content[:200])
+
+    results.append(measure(
+        'UserList.get',
+        max(1, options.iterations // 10),
+        lambda i: get('/api/users/'),
+    ))
+    results.append(measure(
+        'UserList.get (limit=100)',
+        options.iterations,
+        lambda i: get('/api/users/?limit=100'),
+    ))
+    results.append(measure(
+        'UserDetail.get',
+        options.iterations,
+        lambda i: get('/api/users/%d/' % rng.choice(user_ids)),
+    ))
+
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """
+    Returns the list of regressions of `results` against `baseline`: a p50
+    latency more than `max_regression` (a fraction) above the baseline, or
+    more queries per operation.
+    """
+    baseline_by_name = dict((result['name'], result) for result in baseline['results'])
+    regressions = []
+    for result in results:
+        previous = baseline_by_name.get(result['name'])
+        if previous is None:
+            continue
+
+        limit = previous['latency_ms']['p50'] * (1 + max_regression)
+        if result['latency_ms']['p50'] > limit:
+            regressions.append('%s: p50 %.3fms > %.3fms' % (
+                result['name'], result['latency_ms']['p50'], limit,
+            ))
+        if result['queries_per_op'] > previous['queries_per_op']:
+            regressions.append('%s: %.2f queries/op > %.2f' % (
+                result['name'], result['queries_per_op'], previous['queries_per_op'],
+            ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--organizations', type=int, default=20)
+    parser.add_argument('--roles', type=int, default=10)
+    parser.add_argument('--resources', type=int, default=10, help='Each resource gets one permission per HTTP method.')
+    parser.add_argument('--roles-per-user', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--cold',
+        action='store_true',
+        help="Clear every cache before each operation, including the whole AUTH_APP['CACHE_ALIAS'] cache.",
+    )
+    parser.add_argument('--real-hasher', action='store_true', help='Use the configured password hashers.')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare against.')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    options = parser.parse_args()
+
+    django.setup()
+
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import override_settings, setup_test_environment
+
+    from initialize_data import bulk_load
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+
+    hasher_settings = {} if options.real_hasher else {'PASSWORD_HASHERS': FAST_PASSWORD_HASHERS}
+    try:
+        with override_settings(**hasher_settings):
+            t0 = time.time()
+            bulk_load(
+                build_fixture(
+                    options.users,
+                    options.organizations,
+                    options.roles,
+                    options.resources,
+                    options.roles_per_user,
+                    options.seed,
+                ),
+                workers=1 if not options.real_hasher else None,
+            )
+            seed_seconds = time.time() - t0
+
+            results = run_benchmarks(options)
+    finally:
+        runner.teardown_databases(old_config)
+
+    report = {
+        'parameters': {
+            'users': options.users,
+            'organizations': options.organizations,
+            'roles': options.roles,
+            'resources': options.resources,
+            'roles_per_user': options.roles_per_user,
+            'iterations': options.iterations,
+            'seed': options.seed,
+            'cold': options.cold,
+            'real_hasher': options.real_hasher,
+        },
+        'seed_seconds': round(seed_seconds, 4),
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.max_regression)
+        for regression in regressions:
+            sys.stderr.write('REGRESSION %s\n' % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
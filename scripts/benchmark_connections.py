@@ -0,0 +1,147 @@
+"""
+Benchmarks the latency of `UserDetail` requests with a new SQLite
+connection per request (Django's default with `CONN_MAX_AGE = 0`), with a
+persistent connection, and with the pooled `auth_app.db.backends.sqlite3`
+backend, against a throwaway database file.
+
+Run from the `authserver` directory:
+
+    python ../scripts/benchmark_connections.py --users 1000 --iterations 500
+
+Connections are closed after every request like the WSGI handler does, and
+the cost of opening one is reported separately for each configuration.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'authserver.settings')
+
+import django  # noqa: E402
+
+from benchmark import FAST_PASSWORD_HASHERS, build_fixture, measure  # noqa: E402
+
+
+CONFIGURATIONS = [
+    ('sqlite3, connection per request', {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'CONN_MAX_AGE': 0,
+    }),
+    ('sqlite3, persistent connection', {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'CONN_MAX_AGE': None,
+    }),
+    ('pooled sqlite3, WAL', {
+        'ENGINE': 'auth_app.db.backends.sqlite3',
+        'CONN_MAX_AGE': 0,
+    }),
+]
+
+
+def use_database(settings_dict):
+    """
+    Replaces the `default` connection of this thread with one for
+    `settings_dict`, updated in place.
+    """
+    from django.db import connections
+
+    connections['default'].close()
+    del connections['default']
+    connections.databases['default'].update(settings_dict)
+
+
+def run_benchmarks(options):
+    from django.db import close_old_connections, connection
+    from django.test import Client
+
+    from auth_app.models import User
+    from auth_app.db.pool import close_pools
+
+    client = Client()
+    rng = random.Random(options.seed)
+
+    response = client.post('/api/tokens/auth/', {'email': 'user0@benchmark.example.com', 'password': 'password'})
+    assert response.status_code == 200, response.content[:200]
+    # The first benchmark user holds `Users-GET`.
+    headers = {'HTTP_AUTHORIZATION': 'JWT %s' % json.loads(response.content.decode('utf-8'))['token']}
+    user_ids = list(User.objects.values_list('id', flat=True))
+
+    def get_user(i):
+        # The test client leaves connections open; close them as the WSGI
+        # handler does on `request_finished`.
+        response = client.get('/api/users/%d/' % rng.choice(user_ids), **headers)
+        close_old_connections()
+        assert response.status_code == 200, response.content[:200]
+
+    def connect(i):
+        connection.ensure_connection()
+        connection.close()
+
+    results = []
+    for name, settings_dict in CONFIGURATIONS:
+        use_database(settings_dict)
+        # Warm up caches and the pool.
+        for i in range(10):
+            get_user(i)
+
+        result = measure('UserDetail.get (%s)' % name, options.iterations, get_user)
+        result['connect_ms'] = measure('connect', options.iterations, connect)['latency_ms']
+        results.append(result)
+
+        connection.close()
+        close_pools()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+
+    from initialize_data import bulk_load
+
+    directory = tempfile.mkdtemp()
+    try:
+        use_database({
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, 'db.sqlite3'),
+        })
+        call_command('migrate', verbosity=0, interactive=False)
+
+        with override_settings(PASSWORD_HASHERS=FAST_PASSWORD_HASHERS, ALLOWED_HOSTS=['*']):
+            t0 = time.time()
+            bulk_load(build_fixture(options.users, 10, 5, 5, 2, options.seed), workers=1)
+            seed_seconds = time.time() - t0
+
+            results = run_benchmarks(options)
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        'parameters': {
+            'users': options.users,
+            'iterations': options.iterations,
+            'seed': options.seed,
+        },
+        'seed_seconds': round(seed_seconds, 4),
+        'results': results,
+    }
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Benchmarks signing and verifying tokens with each supported algorithm, with
+keys parsed from PEM data on every call (as `rest_framework_jwt` does) and
+with the preloaded key objects of the key ring.
+
+Run from the `authserver` directory:
+
+    python ../scripts/benchmark_signing.py --iterations 500 --permissions 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'authserver.settings')
+
+import django  # noqa: E402
+
+
+def build_payload(permissions):
+    """
+    Returns a payload the size of a `full` token holding `permissions`
+    permissions in a single organization.
+    """
+    permission_list = [
+        {'id': i, 'name': 'Resource%d-GET' % i, 'description': 'Benchmark permission'}
+        for i in range(permissions)
+    ]
+    return {
+        'user_id': 1,
+        'username': 'user@benchmark.example.com',
+        'email': 'user@benchmark.example.com',
+        'exp': int(time.time()) + 3600,
+        'organizations': [{
+            'id': 1,
+            'name': 'Benchmark Group',
+            'roles': [{'id': 1, 'name': 'Benchmark-Role', 'permissions': permission_list}],
+        }],
+        'permissions': permission_list,
+    }
+
+
+def get_keys():
+    """
+    Returns `(algorithm, private_pem, public_pem)` for the configured RSA and
+    EC key pairs, and for a generated Ed25519 key pair.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    from django.conf import settings
+
+    def read(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    keys = [
+        ('RS512', read(settings.PRIVATE_RSA_KEY_FILEPATH), read(settings.PUBLIC_RSA_KEY_FILEPATH)),
+        ('ES256', read(settings.PRIVATE_EC_KEY_FILEPATH), read(settings.PUBLIC_EC_KEY_FILEPATH)),
+    ]
+
+    private_key = Ed25519PrivateKey.generate()
+    keys.append((
+        'EdDSA',
+        private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        ),
+        private_key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        ),
+    ))
+
+    # Makes sure the backend is loaded before anything is measured.
+    default_backend()
+    return keys
+
+
+def measure(name, iterations, operation):
+    latencies = []
+    for i in range(iterations):
+        t0 = time.time()
+        operation()
+        latencies.append((time.time() - t0) * 1000)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'name': name,
+        'iterations': iterations,
+        'ops_per_second': round(iterations * 1000 / total, 2) if total else None,
+        'latency_ms': {
+            'mean': round(total / iterations, 4),
+            'p50': round(latencies[len(latencies) // 2], 4),
+            'max': round(latencies[-1], 4),
+        },
+    }
+
+
+def run_benchmarks(options):
+    import jwt
+
+    from auth_app.utils.keys import KeyRing, SigningKey
+
+    payload = build_payload(options.permissions)
+    results = []
+
+    for algorithm, private_pem, public_pem in get_keys():
+        key = SigningKey.from_pem(algorithm, public_pem=public_pem, private_pem=private_pem)
+        key_ring = KeyRing([key])
+        token = key_ring.encode(payload)
+
+        if algorithm != 'EdDSA':
+            # PyJWT only parses PEM data for the algorithms it ships.
+            results.append(measure(
+                '%s sign (PEM per call)' % algorithm,
+                options.iterations,
+                lambda: jwt.encode(payload, private_pem, algorithm),
+            ))
+            results.append(measure(
+                '%s verify (PEM per call)' % algorithm,
+                options.iterations,
+                lambda: jwt.decode(token, public_pem, algorithms=[algorithm]),
+            ))
+
+        results.append(measure(
+            '%s sign (preloaded key)' % algorithm,
+            options.iterations,
+            lambda: key_ring.encode(payload),
+        ))
+        results.append(measure(
+            '%s verify (preloaded key)' % algorithm,
+            options.iterations,
+            lambda: key_ring.decode(token),
+        ))
+
+        results[-1]['token_bytes'] = len(token)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--permissions', type=int, default=20, help='Permissions held by the token owner.')
+    options = parser.parse_args()
+
+    django.setup()
+
+    report = {
+        'parameters': {
+            'iterations': options.iterations,
+            'permissions': options.permissions,
+        },
+        'results': run_benchmarks(options),
+    }
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
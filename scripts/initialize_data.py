@@ -1,8 +1,21 @@
-from django.db import transaction
+import argparse
+import collections
+import csv
+import io
+import json
+import multiprocessing
+import os
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
 
 from auth_app.models import (
     Application,
     Organization,
+    OrganizationClosure,
+    OrganizationTreeGeneration,
+    PermissionCatalogueGeneration,
     Role,
     Permission,
     User,
@@ -38,7 +51,10 @@ def initialize_data():
     roles_data = [
         {
             'name': 'Super-Admin',
-            'description': 'Can access everything in system and create, modify and delete records as long as the operation keeps database integrity.',
+            'description': (
+                'Can access everything in system and create, modify and delete records '
+                'as long as the operation keeps database integrity.'
+            ),
         },
         {
             'name': 'Group-Owner',
@@ -253,10 +269,249 @@ def initialize_data():
     )
 
 
+def read_fixture(path):
+    """
+    Reads a declarative fixture from a JSON or YAML file, or the users of a
+    CSV file with `email`, `name`, `password`, `role` and `organization`
+    columns (one row per role association, repeated for users with many).
+
+    JSON/YAML fixtures may contain `permissions`, `organizations`, `roles`
+    and `users` lists, see `fixtures/abc_clinic.json`.
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.json':
+        with io.open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('PyYAML is required to read YAML fixtures.')
+        with io.open(path, encoding='utf-8') as f:
+            return yaml.safe_load(f)
+
+    if extension == '.csv':
+        users = collections.OrderedDict()
+        with io.open(path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                user = users.setdefault(row['email'], {
+                    'email': row['email'],
+                    'name': row['name'],
+                    'password': row['password'],
+                    'roles': [],
+                })
+                if row.get('role') and row.get('organization'):
+                    user['roles'].append({
+                        'role': row['role'],
+                        'organization': row['organization'],
+                    })
+        return {'users': list(users.values())}
+
+    raise ValueError('Unsupported fixture format: %s' % path)
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hashes `passwords` with the default password hasher over a pool of
+    `workers` processes (one per CPU by default).
+    """
+    if workers == 1 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+
+    pool = multiprocessing.Pool(workers, initializer=django.setup)
+    try:
+        chunksize = max(1, len(passwords) // ((workers or multiprocessing.cpu_count()) * 4))
+        return pool.map(make_password, passwords, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def bulk_create(model, objs, batch_size):
+    """
+    `bulk_create` with `batch_size` capped to what the database backend
+    accepts in a single statement (e.g. SQLite's limit on query parameters).
+    """
+    if not objs:
+        return
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    batch_size = min(batch_size, max(connection.ops.bulk_batch_size(fields, objs), 1))
+    model.objects.bulk_create(objs, batch_size=batch_size)
+
+
+def bulk_load(data, batch_size=1000, workers=None):
+    """
+    Loads a fixture (see `read_fixture`) with batched `bulk_create` calls.
+    Names are resolved to IDs in memory and rows that already exist are
+    left untouched, so a fixture can be loaded on top of existing data.
+
+    `bulk_create` skips `save()` and signals: the organization closure rows
+    are written here, and so are the bumps of the organization tree and
+    permission catalogue generations and of the authorization version of
+    existing users given new roles.
+    """
+    # Permissions, matched case-insensitively like `initialize_data`.
+    permissions_data = collections.OrderedDict()
+    for permission in data.get('permissions', []):
+        permissions_data.setdefault(permission['name'].lower(), permission)
+    for role in data.get('roles', []):
+        for name in role.get('permissions', []):
+            permissions_data.setdefault(name.lower(), {'name': name})
+
+    permission_ids = {
+        name.lower(): pk for pk, name in Permission.objects.values_list('id', 'name')
+    }
+    bulk_create(
+        Permission,
+        [
+            Permission(name=permission['name'], description=permission.get('description', ''))
+            for key, permission in permissions_data.items()
+            if key not in permission_ids
+        ],
+        batch_size,
+    )
+    permission_ids = {
+        name.lower(): pk for pk, name in Permission.objects.values_list('id', 'name')
+    }
+
+    # Organizations, created one tree level at a time so that parents
+    # already have an ID.
+    organization_ids = dict(Organization.objects.values_list('name', 'id'))
+    pending = [
+        organization for organization in data.get('organizations', [])
+        if organization['name'] not in organization_ids
+    ]
+    created_names = []
+    while pending:
+        level = [
+            organization for organization in pending
+            if organization.get('parent') is None or organization['parent'] in organization_ids
+        ]
+        if not level:
+            raise ValueError('Unknown or cyclic parents: %s' % ', '.join(
+                sorted(organization['name'] for organization in pending)
+            ))
+
+        bulk_create(
+            Organization,
+            [
+                Organization(
+                    name=organization['name'],
+                    parent_id=organization_ids.get(organization.get('parent')),
+                    is_active=organization.get('is_active', True),
+                )
+                for organization in level
+            ],
+            batch_size=batch_size,
+        )
+        organization_ids = dict(Organization.objects.values_list('name', 'id'))
+        created_names.extend(organization['name'] for organization in level)
+        pending = [organization for organization in pending if organization not in level]
+
+    parents = dict(Organization.objects.values_list('id', 'parent_id'))
+    closure_rows = []
+    for name in created_names:
+        organization_id = organization_ids[name]
+        ancestor_id, depth = organization_id, 0
+        while ancestor_id is not None:
+            closure_rows.append(OrganizationClosure(
+                ancestor_id=ancestor_id,
+                descendant_id=organization_id,
+                depth=depth,
+            ))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    bulk_create(OrganizationClosure, closure_rows, batch_size)
+    if created_names:
+        OrganizationTreeGeneration.objects.bump()
+
+    # Roles and their permissions.
+    role_ids = dict(Role.objects.values_list('name', 'id'))
+    roles = [
+        Role(name=role['name'], description=role.get('description', ''))
+        for role in data.get('roles', [])
+        if role['name'] not in role_ids
+    ]
+    bulk_create(Role, roles, batch_size)
+    role_ids = dict(Role.objects.values_list('name', 'id'))
+
+    existing_role_permissions = set(
+        RolePermissionAssociation.objects.values_list('role_id', 'permission_id')
+    )
+    role_permissions = collections.OrderedDict()
+    for role in data.get('roles', []):
+        for name in role.get('permissions', []):
+            key = (role_ids[role['name']], permission_ids[name.lower()])
+            if key not in existing_role_permissions:
+                role_permissions[key] = RolePermissionAssociation(role_id=key[0], permission_id=key[1])
+    bulk_create(RolePermissionAssociation, list(role_permissions.values()), batch_size)
+    if roles or role_permissions:
+        PermissionCatalogueGeneration.objects.bump()
+
+    # Users, with their passwords hashed in parallel.
+    user_ids = dict(User.objects.values_list('email', 'id'))
+    existing_user_ids = set(user_ids.values())
+    users_data = collections.OrderedDict()
+    for user in data.get('users', []):
+        email = User.objects.normalize_email(user['email'])
+        if email not in user_ids:
+            users_data.setdefault(email, user)
+
+    passwords = hash_passwords(
+        [user.get('password') for user in users_data.values()],
+        workers=workers,
+    )
+    bulk_create(
+        User,
+        [
+            User(
+                email=email,
+                name=user['name'],
+                password=password,
+                is_staff=user.get('is_staff', False),
+                is_superuser=user.get('is_superuser', False),
+            )
+            for (email, user), password in zip(users_data.items(), passwords)
+        ],
+        batch_size,
+    )
+    user_ids = dict(User.objects.values_list('email', 'id'))
+
+    existing_associations = set(
+        RoleUserOrgAssociation.objects.values_list('role_id', 'organization_id', 'user_id')
+    )
+    associations = collections.OrderedDict()
+    for user in data.get('users', []):
+        user_id = user_ids[User.objects.normalize_email(user['email'])]
+        for association in user.get('roles', []):
+            key = (role_ids[association['role']], organization_ids[association['organization']], user_id)
+            if key not in existing_associations:
+                associations[key] = RoleUserOrgAssociation(
+                    role_id=key[0],
+                    organization_id=key[1],
+                    user_id=key[2],
+                )
+    bulk_create(RoleUserOrgAssociation, list(associations.values()), batch_size)
+
+    # Created users have no authorization snapshots yet.
+    changed_user_ids = sorted(set(key[2] for key in associations) & existing_user_ids)
+    chunk_size = min(batch_size, max(connection.ops.bulk_batch_size(['pk'], changed_user_ids), 1))
+    for start in range(0, len(changed_user_ids), chunk_size):
+        User.objects.bump_authorization_version(pk__in=changed_user_ids[start:start + chunk_size])
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load initial data.')
+    parser.add_argument('--fixture', help='JSON, YAML or CSV fixture to bulk load instead of the built-in data.')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: one per CPU).')
+    args = parser.parse_args()
+
     with transaction.atomic():
-        initialize_data()
+        if args.fixture:
+            bulk_load(read_fixture(args.fixture), batch_size=args.batch_size, workers=args.workers)
+        else:
+            initialize_data()
 
         # raise Exception('All good!')
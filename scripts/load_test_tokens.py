@@ -0,0 +1,145 @@
+"""
+Load tests the token endpoints of running servers, e.g. one sync WSGI
+worker against one ASGI process, both seeded with `initialize_data.py`:
+
+    gunicorn authserver.wsgi --workers 1 --bind 127.0.0.1:8000
+    uvicorn authserver.asgi:application --workers 1 --port 8001
+
+    python scripts/load_test_tokens.py --concurrency 32 --requests 2000 \
+        http://127.0.0.1:8000 http://127.0.0.1:8001
+
+Each client thread keeps one connection open and sends requests back to
+back; the report gives throughput, latency percentiles and status codes
+per server and endpoint.
+"""
+import argparse
+import json
+import threading
+import time
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from httplib import HTTPConnection, HTTPSConnection
+    from urlparse import urlsplit
+
+
+ENDPOINTS = ('auth', 'refresh', 'verify')
+
+
+def connect(base_url):
+    parts = urlsplit(base_url)
+    connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+    return connection_class(parts.netloc, timeout=30), parts.path.rstrip('/')
+
+
+def post(connection, path, data):
+    connection.request('POST', path, json.dumps(data), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def obtain_token(base_url, email, password):
+    connection, prefix = connect(base_url)
+    status, content = post(connection, prefix + '/api/tokens/auth/', {'email': email, 'password': password})
+    connection.close()
+    if status != 200:
+        raise SystemExit('Login to %s failed with %d: %s' % (base_url, status, content[:200]))
+    return json.loads(content.decode('utf-8'))['token']
+
+
+def run_load(base_url, endpoint, data, concurrency, requests):
+    """
+    Sends `requests` POST requests to `endpoint` from `concurrency` threads
+    and returns the measurements.
+    """
+    remaining = [requests]
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+
+    def client():
+        connection, prefix = connect(base_url)
+        path = '%s/api/tokens/%s/' % (prefix, endpoint)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+
+            t0 = time.time()
+            try:
+                status = post(connection, path, data)[0]
+            except Exception as e:
+                status = type(e).__name__
+                connection.close()
+                connection, prefix = connect(base_url)
+            elapsed = (time.time() - t0) * 1000
+
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        connection.close()
+
+    threads = [threading.Thread(target=client) for i in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2)
+
+    return {
+        'server': base_url,
+        'endpoint': endpoint,
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / duration, 2),
+        'latency_ms': {
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99),
+            'max': round(latencies[-1], 2),
+        },
+        'statuses': dict(('%s' % status, n) for status, n in statuses.items()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('servers', nargs='+', help='Base URLs of the servers to compare.')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per server and endpoint.')
+    parser.add_argument('--email', default='doctor1@abcclinic.com')
+    parser.add_argument('--password', default='password')
+    options = parser.parse_args()
+
+    results = []
+    for base_url in options.servers:
+        token = obtain_token(base_url, options.email, options.password)
+        data = {
+            'auth': {'email': options.email, 'password': options.password},
+            'refresh': {'token': token},
+            'verify': {'token': token},
+        }
+        for endpoint in options.endpoints:
+            results.append(run_load(base_url, endpoint, data[endpoint], options.concurrency, options.requests))
+
+    report = {
+        'parameters': {
+            'concurrency': options.concurrency,
+            'requests': options.requests,
+        },
+        'results': results,
+    }
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()